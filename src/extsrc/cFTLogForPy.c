@@ -5,18 +5,16 @@
 /////////////////////////////////////////////////////////////////////
 // GLOBALS
 /////////////////////////////////////////////////////////////////////
-int logNdx;                         // 0-based current index
 int secondThreadStarted = false;    // SHOULD NOT NEED ?
 
-cFTLogDesc_t* logDescs[CLOG_MAX_LOG];             
-
 /////////////////////////////////////////////////////////////////////
 // OBJECT-LEVEL CODE 
 /////////////////////////////////////////////////////////////////////
 
 typedef struct {
     PyObject_HEAD
-    // this indexes logDescs, which contains logDir and logName
+    // this indexes the descriptor table, whose entry contains logDir
+    // and logName; -1 once the log is closed
     long objNdx;            // long to be consistent with Python
     // maybe more later
 } LogForPyObject;
@@ -42,11 +40,15 @@ LogForPy_dealloc(PyObject *ptr)
 PyDoc_STRVAR(LogForPy_init__doc__,          "Initialize log object.");
 
 static PyObject *
-LogForPy_init(LogForPyObject *self, PyObject *args) {
-    char* pathToLog;
-    if (!PyArg_ParseTuple(args, "s", &pathToLog))
+LogForPy_init(LogForPyObject *self, PyObject *args, PyObject *kwargs) {
+    const char*  pathToLog;
+    cFTLogOpts_t opts;
+    cFTLogMgr_t* mgr;
+    if (_parse_log_opts(args, kwargs, &pathToLog, &opts) < 0)
+        return NULL;
+    if (_get_mgr(opts.mgr, &mgr) < 0)
         return NULL;
-    int objNdx = _open_cft_log(pathToLog);
+    int objNdx = _open_cft_log(mgr, pathToLog, &opts);
     if (objNdx < 0) {
         Py_RETURN_NONE;
     }
@@ -60,12 +62,22 @@ PyDoc_STRVAR(LogForPy_getCount__doc__,       "Get log message count.");
 
 static PyObject *
 LogForPy_getCount(LogForPyObject* self) {
-    int ndx     = (int) self->objNdx;
-    // XXX SHOULD LOCK
-    long count  = (long) logDescs[ndx]->count;
-    // XXX AND UNLOCK
+    cFTLogDesc_t* d = _get_log((int) self->objNdx);
+    if (d == NULL)
+        return NULL;
+    pthread_mutex_lock(&d->logBufLock);
+    long count  = (long) d->count;
+    pthread_mutex_unlock(&d->logBufLock);
     return PyLong_FromLong(count);
 }
+/* stats --------------------------------------------------------- */
+PyDoc_STRVAR(LogForPy_getStats__doc__,
+                        "Get a dict of message and backpressure counts.");
+
+static PyObject *
+LogForPy_getStats(LogForPyObject* self) {
+    return _log_stats((int) self->objNdx);
+}
 /* ndx ----------------------------------------------------------- */
 PyDoc_STRVAR(LogForPy_getNdx__doc__,       "Get objNdx attr.");
 
@@ -78,8 +90,9 @@ PyDoc_STRVAR(LogForPy_getPathToLog__doc__,       "Get path to log file.");
 
 static PyObject *
 LogForPy_getPathToLog(LogForPyObject* self) {
-    int ndx         = (int)self->objNdx;
-    cFTLogDesc_t* p = logDescs[ndx];
+    cFTLogDesc_t* p = _get_log((int)self->objNdx);
+    if (p == NULL)
+        return NULL;
     char s[MAX_PATH_LEN+1];
     strncpy(s, p->logDir, MAX_PATH_LEN+1);
     int x = strlen(s);
@@ -97,30 +110,108 @@ LogForPy_getPathToLog(LogForPyObject* self) {
 
 
 /* log_msg -------------------------------------------------------- */
-PyDoc_STRVAR(LogForPy_logMsg__doc__,       "Write a log message.");
+PyDoc_STRVAR(LogForPy_logMsg__doc__,
+    "Write a log message: a str or bytes-like object, optionally "
+    "followed by the number of leading bytes to log.");
 
 static PyObject* 
 LogForPy_logMsg(LogForPyObject* self, PyObject* args) {
-    int     ndx = (int)self->objNdx;
-    const   char* msg;
+    int         ndx = (int)self->objNdx;
+    Py_buffer   msg;
+    Py_ssize_t  nbytes = -1;
+
+    if (!PyArg_ParseTuple(args, "s*|n", &msg, &nbytes))
+        return NULL;
+    Py_ssize_t len = _msg_len(&msg, nbytes);
+    if (len < 0) {
+        PyBuffer_Release(&msg);
+        return NULL;
+    }
+    cFTLogDesc_t* d = _use_log(ndx);
+    if (d == NULL) {
+        PyBuffer_Release(&msg);
+        return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    _log_msg(d, msg.buf, len);
+    _release_log(d);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&msg);
+    Py_RETURN_NONE;
+}
+
+/* log_msgs ------------------------------------------------------- */
+PyDoc_STRVAR(LogForPy_logMsgs__doc__,
+                        "Write an iterable of log messages in one batch.");
 
-    if (!PyArg_ParseTuple(args, "s", &msg))
+static PyObject*
+LogForPy_logMsgs(LogForPyObject* self, PyObject* args) {
+    int         ndx = (int)self->objNdx;
+    PyObject*   iterable;
+
+    if (!PyArg_ParseTuple(args, "O", &iterable))
+        return NULL;
+    if (_log_msg_seq(ndx, iterable) < 0)
         return NULL;
-    if (msg)
-        _log_msg(ndx, msg);
     Py_RETURN_NONE;
 }
 
+/* flush ---------------------------------------------------------- */
+PyDoc_STRVAR(LogForPy_flush__doc__,
+    "Write out and sync everything buffered; wait=False returns at once.");
+
+static PyObject*
+LogForPy_flush(LogForPyObject* self, PyObject* args, PyObject* kwargs) {
+    static char* kwlist[] = {"wait", NULL};
+    int wait = true;
+    int status;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|p", kwlist, &wait))
+        return NULL;
+    cFTLogDesc_t* d = _use_log((int)self->objNdx);
+    if (d == NULL)
+        return NULL;
+    Py_BEGIN_ALLOW_THREADS
+    status = _flush_cft_log(d, wait, true);
+    _release_log(d);
+    Py_END_ALLOW_THREADS
+    return Py_BuildValue("i", status);
+}
+
+/* close ---------------------------------------------------------- */
+PyDoc_STRVAR(LogForPy_close__doc__,
+    "Write out everything buffered, close the log and free its slot.");
+
+static PyObject*
+LogForPy_close(LogForPyObject* self) {
+    PyObject* args = Py_BuildValue("(i)", (int)self->objNdx);
+    if (args == NULL)
+        return NULL;
+    PyObject* result = close_cft_log(NULL, args);
+    Py_DECREF(args);
+    if (result != NULL)
+        self->objNdx = -1;
+    return result;
+}
+
 /* LogForPy object methods --------------------------------------- */
 static PyMethodDef LogForPy_methods[] = {
     {"init",    (PyCFunction)LogForPy_init,     
-                METH_VARARGS,   LogForPy_init__doc__},
+                METH_VARARGS | METH_KEYWORDS,   LogForPy_init__doc__},
     {"count",   (PyCFunction)LogForPy_getCount, 
                 METH_NOARGS,    LogForPy_getCount__doc__},
     {"log_file", (PyCFunction)LogForPy_getPathToLog, 
                 METH_NOARGS,    LogForPy_getPathToLog__doc__},
     {"log_msg",  (PyCFunction)LogForPy_logMsg,   
                 METH_VARARGS,   LogForPy_logMsg__doc__},
+    {"log_msgs", (PyCFunction)LogForPy_logMsgs,
+                METH_VARARGS,   LogForPy_logMsgs__doc__},
+    {"stats",   (PyCFunction)LogForPy_getStats,
+                METH_NOARGS,    LogForPy_getStats__doc__},
+    {"flush",   (PyCFunction)LogForPy_flush,
+                METH_VARARGS | METH_KEYWORDS,   LogForPy_flush__doc__},
+    {"close",   (PyCFunction)LogForPy_close,
+                METH_NOARGS,    LogForPy_close__doc__},
     {"ndx",     (PyCFunction)LogForPy_getNdx,   
                 METH_NOARGS,    LogForPy_getNdx__doc__},
 
@@ -212,12 +303,49 @@ static PyMethodDef cFTLogForPyMethods[] = {
     // which will be parsed with PyArg_ParseTuple()
     {"init_cft_logger",   init_cft_logger,      METH_VARARGS,
         "init data structures, start background thread"},
-    {"open_cft_log",      open_cft_log,         METH_VARARGS,
-        "open named log file"},
+    {"open_cft_log",      (PyCFunction)open_cft_log,
+                                        METH_VARARGS | METH_KEYWORDS,
+        "open named log file, optionally with policy, buf_size, "
+        "buf_count, durability, group_ms, group_bytes, high_water, "
+        "rotate_bytes, rotate_secs, on_rotate, mgr, shared, shm_name, "
+        "shm_slots, shm_slot_size, thread_bufs, thread_buf_size, "
+        "merge_stamps, engine, ring_size, recoverable, framed, "
+        "prealloc_bytes"},
+    {"new_cft_logger",    (PyCFunction)new_cft_logger,
+                                        METH_VARARGS | METH_KEYWORDS,
+        "create a log manager with its own writer thread, optionally "
+        "with write_interval"},
     {"close_cft_logger",  close_cft_logger,     METH_VARARGS,
         "stop background thread, join, close log file"},
+    {"close_cft_log",     close_cft_log,        METH_VARARGS,
+        "write out and close one log, freeing its slot for reuse"},
     {"log_msg",         log_msg,             METH_VARARGS,
         "write a message to the log"},
+    {"log_msgs",        log_msgs,            METH_VARARGS,
+        "write a batch of messages to the log under a single lock"},
+    {"log_stats",       log_stats,           METH_VARARGS,
+        "return message and backpressure counters for a log"},
+    {"flush_cft_log",   (PyCFunction)flush_cft_log,
+                                        METH_VARARGS | METH_KEYWORDS,
+        "write out and sync a log's buffers, by default waiting for it"},
+    {"quiesce_cft_loggers", quiesce_cft_loggers, METH_NOARGS,
+        "before fork(): write out every log's buffers"},
+    {"restart_cft_loggers", restart_cft_loggers, METH_NOARGS,
+        "after fork(), in the child: restart the writer threads"},
+    {"stop_rotate_callbacks", stop_rotate_callbacks, METH_NOARGS,
+        "at exit: stop calling on_rotate callbacks from the writers"},
+    {"attach_cft_shm",  (PyCFunction)attach_cft_shm,
+                                        METH_VARARGS | METH_KEYWORDS,
+        "attach to a log's named shared-memory ring, optionally with policy"},
+    {"shm_log_msg",     shm_log_msg,         METH_VARARGS,
+        "write a message through a shared-memory ring, without locking"},
+    {"shm_stats",       shm_stats,           METH_VARARGS,
+        "return the counters of a shared-memory ring"},
+    {"crc32c",          crc32c_of,           METH_VARARGS,
+        "return the CRC32C of some bytes, optionally continuing a CRC"},
+    {"scan_frames",     scan_frames,         METH_VARARGS,
+        "return the offset past the last good record of a framed log, "
+        "and the number of good records"},
 
     /* DEFINED IN THIS FILE, ABOVE --------------------- */
     {"LogForPy", (PyCFunction)LogForPy_new, METH_VARARGS|METH_KEYWORDS, 
@@ -239,12 +367,78 @@ static struct PyModuleDef ftLogModule = {
                             
 /* MODULE INITIALIZATION  ---------------------------------------- */
 
+/**
+ * Have os.fork() write out the logs' buffers before forking and start
+ * new writer threads in the child.  Where os.register_at_fork() does
+ * not exist (before Python 3.7) the caller must call
+ * quiesce_cft_loggers() and restart_cft_loggers() itself.  Returns 0
+ * or -1 with an exception set.
+ */
+static int
+registerAtFork(PyObject* m) {
+    int status = -1;
+    PyObject* os       = PyImport_ImportModule("os");
+    PyObject* before   = PyObject_GetAttrString(m, "quiesce_cft_loggers");
+    PyObject* after    = PyObject_GetAttrString(m, "restart_cft_loggers");
+    PyObject* register_ = NULL;
+    PyObject* noArgs   = PyTuple_New(0);
+    PyObject* kwargs   = NULL;
+    PyObject* result   = NULL;
+    if (os == NULL || before == NULL || after == NULL || noArgs == NULL)
+        goto done;
+    if (!PyObject_HasAttrString(os, "register_at_fork")) {
+        status = 0;
+        goto done;
+    }
+    register_ = PyObject_GetAttrString(os, "register_at_fork");
+    kwargs    = Py_BuildValue("{s:O,s:O}",
+                                "before", before, "after_in_child", after);
+    if (register_ == NULL || kwargs == NULL)
+        goto done;
+    result = PyObject_Call(register_, noArgs, kwargs);
+    if (result != NULL)
+        status = 0;
+
+done:
+    Py_XDECREF(result);
+    Py_XDECREF(kwargs);
+    Py_XDECREF(noArgs);
+    Py_XDECREF(register_);
+    Py_XDECREF(after);
+    Py_XDECREF(before);
+    Py_XDECREF(os);
+    return status;
+}
+
+/**
+ * Have atexit stop the writer threads calling on_rotate callbacks
+ * before the interpreter begins to finalize, when they could no longer
+ * take the GIL.  Returns 0 or -1 with an exception set.
+ */
+static int
+registerAtExit(PyObject* m) {
+    PyObject* atexit = PyImport_ImportModule("atexit");
+    PyObject* stop   = PyObject_GetAttrString(m, "stop_rotate_callbacks");
+    PyObject* result = NULL;
+    if (atexit != NULL && stop != NULL)
+        result = PyObject_CallMethod(atexit, "register", "O", stop);
+    int status = result == NULL ? -1 : 0;
+    Py_XDECREF(result);
+    Py_XDECREF(stop);
+    Py_XDECREF(atexit);
+    return status;
+}
+
 /* the method name MUST be "init" prefixed to the module name */
 
 PyMODINIT_FUNC
 PyInit_cFTLogForPy(void) {
     PyObject *m;
     Py_TYPE(&LogForPyType) = &PyType_Type;          // cant
+#if PY_VERSION_HEX < 0x03070000
+    // the writer thread may take the GIL to call on_rotate callbacks
+    PyEval_InitThreads();
+#endif
     if (PyType_Ready(&LogForPyType) < 0)
         return NULL;
 
@@ -259,7 +453,41 @@ PyInit_cFTLogForPy(void) {
     }
     // XXX ADD A CONSTANT, JUST FOR FUN
     PyModule_AddIntConstant(m, "max_log", CLOG_MAX_LOG);
-
+    PyModule_AddIntConstant(m, "max_mgr", CLOG_MAX_MGR);
+    PyModule_AddObject(m, "write_interval", PyFloat_FromDouble(WRITE_INTERVAL));
+    // default size and number of buffer pages for each log
+    PyModule_AddIntConstant(m, "log_buffer_size", LOG_BUFFER_SIZE);
+    PyModule_AddIntConstant(m, "log_buf_count",   C_FT_LOG_BUF_COUNT);
+    // default shape of a log's shared-memory ring
+    PyModule_AddIntConstant(m, "shm_slots",       SHM_RING_SLOTS);
+    PyModule_AddIntConstant(m, "shm_slot_size",   SHM_SLOT_SIZE);
+
+    // what producers do when all of a log's buffers are full
+    PyModule_AddIntConstant(m, "BLOCK_ON_FULL", BLOCK_ON_FULL);
+    PyModule_AddIntConstant(m, "GROW_ON_FULL",  GROW_ON_FULL);
+    PyModule_AddIntConstant(m, "DROP_ON_FULL",  DROP_ON_FULL);
+
+    // how hard the writer works to get each log onto the disk
+    PyModule_AddIntConstant(m, "SYNC_FSYNC",     SYNC_FSYNC);
+    PyModule_AddIntConstant(m, "SYNC_FDATASYNC", SYNC_FDATASYNC);
+    PyModule_AddIntConstant(m, "SYNC_ASYNC",     SYNC_ASYNC);
+    PyModule_AddIntConstant(m, "SYNC_GROUP",     SYNC_GROUP);
+    PyModule_AddIntConstant(m, "SYNC_NONE",      SYNC_NONE);
+
+    // how producers get messages to the writer
+    PyModule_AddIntConstant(m, "ENGINE_PAGES",   ENGINE_PAGES);
+    PyModule_AddIntConstant(m, "ENGINE_MPSC",    ENGINE_MPSC);
+    PyModule_AddIntConstant(m, "mpsc_ring_size", MPSC_RING_SIZE);
+
+    // a sensible extent in which to preallocate a log's file
+    PyModule_AddIntConstant(m, "prealloc_bytes", PREALLOC_BYTES);
+
+    // keep logging working across fork()
+    registerForkHandlers();
+    if (registerAtFork(m) < 0 || registerAtExit(m) < 0) {
+        Py_DECREF(m);
+        return NULL;
+    }
 
     return m;
 }
@@ -15,19 +15,49 @@
 #include <errno.h>
 #include <ev.h>
 #include <fcntl.h>
+#include <stdatomic.h>  // shared-memory rings
 #include <stdbool.h>
+#include <limits.h>     // IOV_MAX
 #include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>     // calloc and such
 #include <string.h>
+#include <sys/mman.h>   // mmap, for logs shared with child processes
 #include <sys/types.h>
 #include <sys/stat.h>
+#include <sys/uio.h>    // writev
+#include <time.h>
 #include <unistd.h>
 
-/* maximum number of open log files */
-#define CLOG_MAX_LOG   (16)
+#ifndef IOV_MAX
+#define IOV_MAX (1024)
+#endif
 
-// how often we write the log to disk, in seconds
+/*
+ * Each manager's descriptor table grows a chunk of LOG_TABLE_CHUNK slots
+ * at a time, so that descriptors never move, up to CLOG_MAX_LOG open
+ * logs.
+ */
+#define LOG_TABLE_CHUNK     (64)
+#define LOG_TABLE_CHUNKS    (1024)
+#define CLOG_MAX_LOG        (LOG_TABLE_CHUNK * LOG_TABLE_CHUNKS)
+
+/*
+ * There may be up to CLOG_MAX_MGR managers, each with its own writer
+ * thread.  Manager 0 is the default one, used by init_cft_logger() and
+ * close_cft_logger() without a manager.  The handle of a log, the
+ * index passed to log_msg() and so on, is its manager's id times
+ * CLOG_MAX_LOG plus its slot in the manager's table, so handles are
+ * unique across managers and those of the default manager are just
+ * slot numbers.
+ */
+#define CLOG_MAX_MGR        (256)
+#define DEFAULT_MGR_ID      (0)
+#define LOG_HANDLE(mgr, slot)   ((mgr)->id * CLOG_MAX_LOG + (slot))
+#define LOG_SLOT(handle)        ((handle) % CLOG_MAX_LOG)
+#define LOG_MGR_ID(handle)      ((handle) / CLOG_MAX_LOG)
+
+// how often we write the log to disk, in seconds, by default
 #define WRITE_INTERVAL  (0.1)
 
 #define LOG_BUFFER_SIZE (4*4096)
@@ -39,11 +69,21 @@
 #define PADBYTES (1024)
 typedef struct _logPage {
     unsigned char*  data;
-    uint16_t        offset;         // to first free byte
-    uint16_t        pageBytes;      // K * LOG_PAGE_SIZE
+    uint32_t        offset;         // to first free byte
+    uint32_t        pageBytes;      // size of the page, set at open
     uint16_t        flags;
+    uint32_t        seq;            // order in which pages became ACTIVE
+    bool            split;          // last message continues on next page
 } logBufDesc_t;
 
+/*
+ * What a producer does when the active page is full and no page is
+ * READY, that is, when the writer thread has not kept up.
+ */
+#define BLOCK_ON_FULL   (0)     // wait until the writer frees a page
+#define GROW_ON_FULL    (1)     // add a page to the ring, else block
+#define DROP_ON_FULL    (2)     // discard the message and count it
+
 
 /*
 */
@@ -51,6 +91,256 @@ typedef struct _logPage {
 #define PATH_SEP '/'
 #define MAX_PATH_LEN (256)
 #define C_FT_LOG_BUF_COUNT (4)
+// the most pages GROW_ON_FULL will let the ring grow to, unless the
+// log was opened with more
+#define C_FT_LOG_MAX_BUF_COUNT (64)
+
+// limits on the page size and page count a log may be opened with
+#define MIN_LOG_BUFFER_SIZE     (64)
+#define MAX_LOG_BUFFER_SIZE     (1 << 30)
+#define MIN_LOG_BUF_COUNT       (2)
+#define MAX_LOG_BUF_COUNT       (1 << 16)
+// and on the memory its pages may take, including any GROW_ON_FULL adds
+#define MAX_LOG_POOL_BYTES      (1ULL << 32)
+
+/*
+ * How hard the writer works to get what it has written onto the disk.
+ */
+#define SYNC_FSYNC      (0)     // fsync() after every flush
+#define SYNC_FDATASYNC  (1)     // fdatasync(): data, not all metadata
+#define SYNC_ASYNC      (2)     // start writeback, don't wait for it
+#define SYNC_GROUP      (3)     // fdatasync() every groupMs or groupBytes
+#define SYNC_NONE       (4)     // leave it to the OS
+
+// group commit defaults
+#define GROUP_COMMIT_MS     (1000)
+#define GROUP_COMMIT_BYTES  (1024 * 1024)
+
+/*
+ * How producers get messages to the writer thread.
+ */
+#define ENGINE_PAGES    (0)     // pages swapped under logBufLock
+#define ENGINE_MPSC     (1)     // a lock-free byte ring: see mpscRing_t
+
+/*
+ * A log may also have a named shared-memory ring, into which any
+ * process, related or not, may copy messages without locking: slotCount
+ * slots of slotSize bytes each, the first SHM_SLOT_HDR of them holding
+ * the slot's sequence number and the length of its message.  A producer
+ * claims the slot at head by advancing head with compare-and-swap,
+ * copies its message in and publishes it by setting the slot's
+ * sequence number to the claim plus one.  The writer thread of the
+ * process which opened the log writes published slots out in order,
+ * hands each back for the next lap by setting its sequence number to
+ * the claim plus slotCount, and advances tail.  A slot claimed but left
+ * unpublished for SHM_STALL_NANOS, as by a producer which died between
+ * the two, is taken back by the writer and skipped; the producer and
+ * the writer each change the sequence number of a claimed slot only
+ * by compare-and-swap, so that a producer which turns up late finds
+ * its slot gone.  A producer waiting for a slot gives up once the ring
+ * has not moved for SHM_GIVE_UP_SECS.
+ */
+#define SHM_RING_MAGIC      (0x534c5446)    // "FTLS"
+#define SHM_RING_VERSION    (2)
+#define SHM_RING_SLOTS      (1024)
+#define SHM_SLOT_SIZE       (512)
+#define SHM_SLOT_HDR        (16)
+#define MAX_SHM_NAME        (64)
+#define SHM_STALL_NANOS     (1000000000LL)
+#define SHM_GIVE_UP_SECS    (10)
+
+typedef struct _shm_ring_hdr_ {
+    uint32_t            magic;
+    uint32_t            version;
+    uint32_t            slotCount;      // a power of two
+    uint32_t            slotSize;       // including the slot header
+    atomic_int          closed;         // set when the owner closes
+    // producers and the consumer each have a cache line to themselves
+    atomic_uint_least64_t head __attribute__((aligned(64)));
+    atomic_uint_least64_t tail __attribute__((aligned(64)));
+    atomic_uint_least64_t dropped;      // by producers finding it full
+    atomic_uint_least64_t waits;        // times producers waited
+    atomic_uint_least64_t errors;       // bad or stalled slots skipped
+} shmRingHdr_t;
+
+typedef struct _shm_slot_ {
+    atomic_uint_least64_t seq;
+    uint32_t            len;
+    uint32_t            pad;
+    unsigned char       data[];
+} shmSlot_t;
+
+// the ring starts with the header, padded to this size
+#define SHM_RING_HDR_SIZE   (256)
+
+// a producer's view of a ring
+typedef struct _shm_ring_ref_ {
+    shmRingHdr_t*       hdr;
+    size_t              bytes;          // length mapped
+    int                 policy;         // when the ring is full
+} shmRingRef_t;
+
+/*
+ * A log may instead give each thread logging to it a staging buffer of
+ * its own, so that producers never contend for logBufLock.  Each is a
+ * byte ring with one producer, its thread, which copies messages in
+ * and advances head, and one consumer, the writer thread, which at
+ * each flush harvests the bytes between tail and head and advances
+ * tail.  Normally the messages are copied in as they are, wrapping
+ * around the end of the ring, so that a harvest is at most two
+ * iovecs per buffer.  If the writer is to merge them in timestamp
+ * order each is instead a record of a stageRec_t header and the
+ * message, padded to a multiple of STAGE_ALIGN bytes; a record which
+ * would not fit before the end of the ring is preceded by a STAGE_PAD
+ * record filling the rest.
+ *
+ * Each buffer is referred to by the log, which links it into its list
+ * of staging buffers, and by the thread which fills it, which keeps a
+ * list of its own in thread-specific data.  It is freed when both have
+ * let go: the log when it is freed, the thread when it exits or finds
+ * that the log has gone.
+ */
+#define STAGE_ALIGN         (16)
+#define STAGE_PAD           (0x1)
+#define STAGE_BUF_SIZE      (64 * 1024)
+#define MIN_STAGE_BUF_SIZE  (4 * 1024)
+#define MAX_STAGE_BUF_SIZE  (64 * 1024 * 1024)
+
+typedef struct _stage_rec_ {
+    u_int32_t           len;            // of the message
+    u_int32_t           flags;          // STAGE_PAD
+    u_int64_t           nanos;          // CLOCK_MONOTONIC when logged, or 0
+} stageRec_t;
+
+typedef struct _stage_buf_ {
+    atomic_uint_least64_t head __attribute__((aligned(64)));
+    atomic_uint_least64_t tail __attribute__((aligned(64)));
+    atomic_int          refs;           // the log's and the thread's
+    atomic_int          abandoned;      // the thread has exited
+    atomic_int          detached;       // the log has been freed
+    atomic_uint_least64_t msgs;         // messages copied in
+    u_int64_t           counted;        // msgs as of the last harvest
+    u_int64_t           serial;         // of the log it belongs to
+    u_int32_t           size;           // a power of two
+    u_int64_t           harvestTo;      // the writer's scratch space
+    struct _stage_buf_* next;           // the log's list, under logBufLock
+    struct _stage_buf_* threadNext;     // the thread's list
+    unsigned char*      data;
+} stageBuf_t;
+
+// one record, as the writer sees it while harvesting
+typedef struct _stage_entry_ {
+    u_int64_t           nanos;
+    u_int64_t           order;          // in which it was harvested
+    struct iovec        iov;
+} stageEntry_t;
+
+/*
+ * A log whose engine is ENGINE_MPSC has, instead of pages, a single
+ * byte ring which any number of producers fill without locking and
+ * the writer thread drains.  A producer reserves space for a record,
+ * an 8-byte header and the message padded to a multiple of MPSC_ALIGN
+ * bytes, with one fetch-and-add on reserve.  Once the writer has freed
+ * that much of the ring, it copies the message in, wrapping around the
+ * end of the ring if need be, and commits the record by storing its
+ * header, which is never zero.  The writer consumes committed records
+ * in order from tail, stopping at the first whose header is still
+ * zero, then zeroes the space it consumed and advances tail.
+ */
+#define MPSC_ALIGN          (8)
+#define MPSC_RING_SIZE      (1024 * 1024)
+#define MIN_MPSC_RING_SIZE  (4 * 1024)
+#define MAX_MPSC_RING_SIZE  (1 << 30)
+
+typedef struct _mpsc_ring_ {
+    atomic_uint_least64_t reserve __attribute__((aligned(64)));
+    atomic_uint_least64_t tail    __attribute__((aligned(64)));
+    u_int32_t           size __attribute__((aligned(64)));  // power of 2
+    unsigned char*      data;
+    unsigned char*      scratch;        // the writer's, size bytes
+} mpscRing_t;
+
+/*
+ * A recoverable log keeps its pages in a file named for the log with
+ * RING_FILE_EXT added, mapped MAP_SHARED: this header, padded to
+ * RING_FILE_HDR_SIZE bytes, then the page descriptors, then, from the
+ * next page boundary, the pages themselves.  Before each write the
+ * writer records where in the log it begins and ends, so that after a
+ * crash the next open can tell whether the pages BEING_WRITTEN reached
+ * the log.  None of this costs a syscall: the kernel writes the file
+ * back in its own time, and keeps it if the process dies.
+ */
+#define RING_FILE_MAGIC     (0x524c5446)    // "FTLR"
+#define RING_FILE_VERSION   (1)
+#define RING_FILE_EXT       ".ring"
+#define RING_FILE_HDR_SIZE  (64)
+
+typedef struct _ring_file_hdr_ {
+    uint32_t            magic;
+    uint32_t            version;
+    uint32_t            bufSize;        // bytes per page
+    uint32_t            bufCount;       // pages in the file
+    uint32_t            descSize;       // sizeof(logBufDesc_t)
+    uint32_t            pad;
+    uint64_t            flushStart;     // log offset of the last write
+    uint64_t            flushEnd;       // and of its end
+} ringFileHdr_t;
+
+/*
+ * A framed log writes each message as a record: a header of
+ * FRAME_HDR_SIZE bytes, the length of the message and the CRC32C of
+ * that length and the message, both little-endian, then the message.
+ * Producers frame messages of up to FRAME_ON_STACK bytes on the stack.
+ */
+#define FRAME_HDR_SIZE      (8)
+#define FRAME_ON_STACK      (1024)
+
+/*
+ * A log may have its file preallocated with posix_fallocate(), an
+ * extent of preallocBytes at a time, kept at least half an extent
+ * ahead of what has been written, so that a flush need not extend the
+ * file.  Its file is then not opened O_APPEND: the writer writes at
+ * the logical end itself, and cuts the file back to it when the file
+ * is closed or rotated.  Extents end at multiples of preallocBytes.
+ * Until then the logical end is recorded after each flush, as eight
+ * bytes little-endian, in a file named for the log with END_FILE_EXT
+ * added, so that the next open knows where to write if this process
+ * dies; it is locked, so that no other process can open the log to
+ * write over what this one writes, and removed once the file is cut
+ * back.
+ */
+#define END_FILE_EXT        ".end"
+#define PREALLOC_BYTES      (64 * 1024 * 1024)
+#define MIN_PREALLOC_BYTES  (64 * 1024)
+
+/*
+ * Options chosen when a log is opened.
+ */
+typedef struct _c_log_opts_ {
+    int                 policy;         // BLOCK_ON_FULL etc
+    u_int32_t           bufSize;        // bytes per page
+    u_int32_t           bufCount;       // pages initially in the ring
+    int                 durability;     // SYNC_FSYNC etc
+    u_int32_t           groupMs;        // SYNC_GROUP: longest gap, ms
+    u_int32_t           groupBytes;     // SYNC_GROUP: most unsynced bytes
+    u_int32_t           highWater;      // FULL pages which wake the writer
+    unsigned long long  rotateBytes;    // rotate at this size, if not 0
+    u_int32_t           rotateSecs;     // or at this age, if not 0
+    PyObject*           onRotate;       // callable or NULL; borrowed
+    PyObject*           mgr;            // manager capsule or NULL; ditto
+    int                 shared;         // pages shared with children
+    const char*         shmName;        // of a shared-memory ring, or NULL
+    u_int32_t           shmSlots;       // slots in it
+    u_int32_t           shmSlotSize;    // bytes per slot
+    int                 threadBufs;     // stage messages per thread
+    u_int32_t           threadBufSize;  // bytes in each staging buffer
+    int                 mergeStamps;    // harvest in timestamp order
+    int                 engine;         // ENGINE_PAGES etc
+    u_int32_t           ringSize;       // bytes, for ENGINE_MPSC
+    int                 recoverable;    // pages in a file: see ringFileHdr_t
+    int                 framed;         // records with a length and CRC
+    unsigned long long  preallocBytes;  // extent to preallocate, if not 0
+} cFTLogOpts_t;
 
 /*
  * This is a data structure allocated for each log in use.  The data structure
@@ -59,10 +349,23 @@ typedef struct _logPage {
  * Presumably need to align this
  *
  */
+struct _c_log_mgr_;
+
 typedef struct _c_log_ {
 
-    logBufDesc_t        logBufDescs[C_FT_LOG_BUF_COUNT];
-    unsigned char       logBuffers[C_FT_LOG_BUF_COUNT * LOG_BUFFER_SIZE];
+    // pages are heap-allocated; only the first bufCount are in use
+    logBufDesc_t*       logBufDescs;    // bufCapacity descriptors
+    u_int32_t           bufCount;
+    u_int32_t           bufCapacity;    // most pages the ring may have
+    u_int32_t           bufSize;        // bytes per page
+    u_int32_t           nextSeq;        // seq of the next page made ACTIVE
+    u_int32_t*          flushOrder;     // scratch space for the writer
+    struct iovec*       flushIov;       // ditto, one per page
+
+    // set while a message larger than a page is copied over several
+    // pages, so that no other producer's message lands in the middle
+    bool                spanning;
+    pthread_t           spanner;
 
     // GCC insists upon all the parentheses
     char                logDir [MAX_PATH_LEN+1] __attribute__((aligned(16)));
@@ -75,44 +378,269 @@ typedef struct _c_log_ {
     // buffer write flags 
 #   define WRITE_PENDING     (0x0001)
 #   define WRITE_IN_PROGRESS (0x0002)
+#   define FLUSH_REQUESTED   (0x0004)
+#   define CLOSE_REQUESTED   (0x0008)
+#   define SYNC_REQUESTED    (0x0010)   // with FLUSH_REQUESTED
     u_int32_t           writeFlags;
+    int                 ndx;            // the log's handle
+    bool                closed;         // by the writer, on request
+    // set, under logBufLock, once close_cft_log() has begun; users
+    // counts the calls logging or flushing with the GIL released, for
+    // which it waits before asking the writer to close the log
+    bool                closing;
+    u_int32_t           users;
+    struct _c_log_mgr_* mgr;            // whose writer thread serves us
+
+    // a shared log's descriptor and pages are in MAP_SHARED memory, so
+    // that child processes forked after it is opened log into the same
+    // ring; it is drained only by the writer thread of the process
+    // which opened it, its owner
+    bool                shared;
+    pid_t               owner;
+
+    // the named shared-memory ring, if any, mapped shmBytes long;
+    // created by the owner, which unlinks it when the log is freed
+    shmRingHdr_t*       shmRing;
+    size_t              shmBytes;
+    char                shmName[MAX_SHM_NAME + 2];
+    // the first unpublished slot, if claimed, and since when the writer
+    // has seen it so
+    bool                shmStalled;
+    u_int64_t           shmStallPos;
+    struct timespec     shmStallSince;
+
+    // per-thread staging buffers, if threadBufs is set; the list is
+    // changed under logBufLock, and the entries and iovecs are the
+    // writer's scratch space
+    bool                threadBufs;
+    bool                mergeStamps;
+    u_int32_t           stageSize;
+    u_int64_t           serial;         // unique to this log
+    stageBuf_t*         stageBufs;
+    stageEntry_t*       stageEntries;
+    struct iovec*       stageIov;
+    size_t              stageCapacity;
+
+    // the lock-free byte ring, if the engine is ENGINE_MPSC, else NULL
+    mpscRing_t*         mpsc;
+
+    // a recoverable log's pages and descriptors are in ringFile, mapped
+    // ringBytes long from ringPath, on which ringFd holds a lock; in a
+    // child process the mapping is made private and ringPath emptied.
+    // recovered counts the bytes a crashed run left, appended at open
+    bool                recoverable;
+    ringFileHdr_t*      ringFile;
+    size_t              ringBytes;
+    int                 ringFd;
+    char                ringPath[2 * MAX_PATH_LEN + 8];
+    u_int64_t           recovered;
+
+    // each message is written as a record with a length and CRC32C
+    bool                framed;
+
+    // FULL pages not yet collected by the writer; when there are
+    // highWater of them the writer is woken at once (0: wait for the
+    // timer)
+    u_int32_t           fullCount;
+    u_int32_t           highWater;
+
+    // explicit flushes: requests are numbered and the writer records
+    // the last one it has completed; waiters wait on bufFreed
+    u_int64_t           flushRequested;
+    u_int64_t           flushDone;
+    int                 flushStatus;    // of the last explicit flush
 
     u_int32_t           bufInUse;       // which buffer we are using
     pthread_mutex_t     logBufLock;     // = PTHREAD_MUTEX_INITIALIZER;
+
+    // backpressure: what to do when no page is free, and how often
+    // producers have had to do it
+    int                 policy;         // BLOCK_ON_FULL etc
+    pthread_cond_t      bufFreed;       // signalled when pages are READY
+    u_int64_t           blockedCount;   // times a producer waited
+    u_int64_t           grownCount;     // pages added to the ring
+    u_int64_t           droppedCount;   // messages discarded
+
+    // durability, used only by the writer
+    int                 durability;     // SYNC_FSYNC etc
+    u_int32_t           groupMs;
+    u_int32_t           groupBytes;
+    u_int64_t           unsyncedBytes;  // written since the last sync
+    struct timespec     lastSync;
+
+    // rotation, done by the writer: when the file reaches rotateBytes
+    // or is rotateSecs old it is renamed with the next free numeric
+    // suffix and a new file opened; onRotate, if set, is called with
+    // the old and new paths and may return the first record of the
+    // new file
+    u_int64_t           rotateBytes;
+    u_int32_t           rotateSecs;
+    PyObject*           onRotate;       // owned reference or NULL
+    u_int64_t           fileBytes;      // in the current file
+    u_int64_t           preallocBytes;  // extent, or 0: not preallocated
+    u_int64_t           allocEnd;       // of the space preallocated
+    int                 endFd;          // the end file, or -1
+    char                endPath[2 * MAX_PATH_LEN + 8];  // '' in a child
+    bool                midMessage;     // last flush ended inside one
+    struct timespec     fileOpened;
+    u_int32_t           segment;        // last suffix used
+    u_int64_t           rotations;
+
+    // writer statistics
+    u_int64_t           flushCount;     // flushes which wrote something
+    u_int64_t           writeCalls;     // write syscalls made
+    u_int64_t           bytesWritten;
+    u_int64_t           syncCalls;      // fsync, fdatasync etc made
+    u_int64_t           flushNanos;     // time spent writing and syncing
 } cFTLogDesc_t;
 
+// whether a log is drained by this process's writer thread
+#define LOG_OWNED(d)    (!(d)->shared || (d)->owner == (d)->mgr->pid)
 
-// GLOBALS //////////////////////////////////////////////////////////
-extern int    secondThreadStarted;
-extern struct ev_loop* loop;
+/*
+ * A log manager: a writer thread with its own event loop, serving the
+ * logs in its own descriptor table.  Nothing is shared between
+ * managers, so each may have its own write interval and its writer may
+ * run on its own core.
+ */
+typedef struct _c_log_mgr_ {
+    int                 id;             // slot in the manager registry
+    double              writeInterval;  // seconds between timed flushes
+
+    // the writer thread and its loop.  libev is not thread-safe: only
+    // the writer thread may touch the loop and its watchers.  Other
+    // threads set flags and then wake the writer with ev_async_send(),
+    // which is safe to call from any thread.
+    struct ev_loop*     loop;
+    ev_async            wakeupWatcher;
+    volatile int        stopRequested;
+    int                 closeStatus;    // set by the writer as it stops
+    pthread_t           writerThread;
+    pid_t               pid;            // of the process it runs in
+    bool                running;        // started and not yet joined
+    bool                forked;         // this is a child: no writer yet
+    bool                writerReady;
+    pthread_mutex_t     readyLock;
+    pthread_cond_t      readyCond;
 
-extern int logNdx;              // one less than the number of logs open
-extern cFTLogDesc_t* logDescs[CLOG_MAX_LOG];
+    // the descriptor table, read and written under descLock, which is
+    // never held for long; the free list is only used holding the GIL
+    cFTLogDesc_t**      descChunks[LOG_TABLE_CHUNKS];
+    pthread_mutex_t     descLock;
+    int                 logNdx;         // highest slot ever used
+    int*                freeSlots;
+    int                 freeCount;
+    int                 freeCapacity;
+} cFTLogMgr_t;
 
-extern pthread_t            writerThread;
-// extern int               writerReady;
-// extern pthread_mutex_t   readyLock;
-// extern pthread_cond_t    readyCond;
+
+// GLOBALS //////////////////////////////////////////////////////////
+extern int    secondThreadStarted;
 
 // PROTOTYPES ///////////////////////////////////////////////////////
-extern void initLogDescs(void);
-extern int openLogFile(const char* pathToLog) ;
-extern void cLogDealloc(int ndx);
-extern int  setupLibEvAndCallbacks(int);
+extern cFTLogMgr_t* newLogMgr(int id, double writeInterval);
+extern void freeLogMgr(cFTLogMgr_t* mgr);
+extern cFTLogMgr_t* logMgrAt(int id);
+extern int  freeLogMgrId(void);
+extern void clearLogDescs(cFTLogMgr_t* mgr);
+extern void lockForFork(void);
+extern void unlockAfterFork(void);
+extern void resetInChild(void);
+extern cFTLogDesc_t* logDescAt(int handle);
+extern int  lastLogSlot(cFTLogMgr_t* mgr);
+extern int  allocLogSlot(cFTLogMgr_t* mgr);
+extern void setLogDesc(int handle, cFTLogDesc_t* d);
+extern void freeLogSlot(int handle);
+extern cFTLogDesc_t* openLogFile(const char* pathToLog,
+                                                const cFTLogOpts_t* opts);
+extern void cLogDealloc(cFTLogDesc_t* d);
+extern int  setupLibEvAndCallbacks(cFTLogDesc_t* d);
+extern void initLogTimer(cFTLogDesc_t* d);
+extern void setupWakeupWatcher(cFTLogMgr_t* mgr);
+extern void stopWriter(cFTLogMgr_t* mgr);
+extern void stopCallbacks(void);
+extern void resetCallbacks(void);
+extern int  scheduleWrite(int);
+extern int  flushLog(cFTLogDesc_t* d, bool final, bool sync);
+extern void wakeWriter(cFTLogDesc_t* d);
+extern u_int64_t requestFlush(cFTLogDesc_t* d, bool sync);
+extern void requestClose(cFTLogDesc_t* d);
+extern int  growLogBuffers(cFTLogDesc_t* d);
 
-extern int   initLogBuffers(int);
-extern int   writerInitThreaded(void);
+extern int   initLogBuffers(cFTLogDesc_t* d);
+extern int   openShmRing(cFTLogDesc_t* d, const cFTLogOpts_t* opts);
+extern void  closeShmRing(cFTLogDesc_t* d);
+extern int   drainShmRing(cFTLogDesc_t* d, size_t* bytes);
+extern shmRingHdr_t* attachShmRing(const char* name, size_t* bytes);
+extern int   shmPut(shmRingHdr_t* h, const void* msg, size_t len, int policy);
+extern int   writeAll(int fd, struct iovec* iov, int iovcnt);
+extern int64_t nanosBetween(const struct timespec* a, const struct timespec* b);
+extern int   initThreadBufs(cFTLogDesc_t* d, const cFTLogOpts_t* opts);
+extern void  freeThreadBufs(cFTLogDesc_t* d);
+extern void  resetThreadBufs(cFTLogDesc_t* d);
+extern int   stageMsg(cFTLogDesc_t* d, const char* msg, u_int32_t len);
+extern int   harvestStaged(cFTLogDesc_t* d, size_t* bytes);
+extern int   initMpscRing(cFTLogDesc_t* d, const cFTLogOpts_t* opts);
+extern void  freeMpscRing(cFTLogDesc_t* d);
+extern void  resetMpscRing(cFTLogDesc_t* d);
+extern int   mpscPut(cFTLogDesc_t* d, const char* msg, u_int32_t len);
+extern int   drainMpscRing(cFTLogDesc_t* d, size_t* bytes);
+extern int   mapRingFile(cFTLogDesc_t* d, u_int32_t count,
+                                                unsigned char** pages);
+extern void  unmapRingFile(cFTLogDesc_t* d);
+extern void  privatizeRingFile(cFTLogDesc_t* d);
+extern void  removeRingFile(cFTLogDesc_t* d);
+extern u_int32_t crc32c(u_int32_t crc, const void* buf, size_t len);
+extern size_t frameMsg(unsigned char* out, const char* msg, u_int32_t len);
+extern size_t scanFrames(const unsigned char* buf, size_t len, size_t start,
+                                                    u_int64_t* records);
+extern int   writerInitThreaded(cFTLogMgr_t* mgr);
+extern void  registerForkHandlers(void);
+extern void  restartWriters(void);
 
 // MODULE-LEVEL METHODS ////////////////////////////////////
 
+// the name of the capsules wrapping a cFTLogMgr_t
+#define LOG_MGR_CAPSULE "cFTLogForPy.logger"
+// and of those wrapping a shared-memory ring attached by a producer
+#define SHM_RING_CAPSULE "cFTLogForPy.shm"
+
 PyObject* init_cft_logger(PyObject* self, PyObject* args);
-PyObject* open_cft_log(PyObject* self, PyObject* args);
+PyObject* new_cft_logger(PyObject* self, PyObject* args, PyObject* kwargs);
+PyObject* open_cft_log(PyObject* self, PyObject* args, PyObject* kwargs);
 PyObject* close_cft_logger(PyObject* self, PyObject* args);
+PyObject* close_cft_log(PyObject* self, PyObject* args);
 PyObject* log_msg(PyObject* self, PyObject* args);
+PyObject* log_msgs(PyObject* self, PyObject* args);
+PyObject* log_stats(PyObject* self, PyObject* args);
+PyObject* flush_cft_log(PyObject* self, PyObject* args, PyObject* kwargs);
+PyObject* quiesce_cft_loggers(PyObject* self, PyObject* args);
+PyObject* attach_cft_shm(PyObject* self, PyObject* args, PyObject* kwargs);
+PyObject* shm_log_msg(PyObject* self, PyObject* args);
+PyObject* shm_stats(PyObject* self, PyObject* args);
+PyObject* crc32c_of(PyObject* self, PyObject* args);
+PyObject* scan_frames(PyObject* self, PyObject* args);
+PyObject* restart_cft_loggers(PyObject* self, PyObject* args);
+PyObject* stop_rotate_callbacks(PyObject* self, PyObject* args);
 
 // WRAPPED FUNCTIONS //////////////////////////////////////
-int  _open_cft_log(const char* pathToLog);
-void _log_msg(const int ndx, const char* msg);
+int  _open_cft_log(cFTLogMgr_t* mgr, const char* pathToLog,
+                                                const cFTLogOpts_t* opts);
+int  _close_cft_logger(cFTLogMgr_t* mgr);
+int  _get_mgr(PyObject* obj, cFTLogMgr_t** mgr);
+int  _parse_log_opts(PyObject* args, PyObject* kwargs,
+                            const char** pathToLog, cFTLogOpts_t* opts);
+void _log_msg(cFTLogDesc_t* d, const char* msg, Py_ssize_t len);
+void _log_msgs(cFTLogDesc_t* d, const char** msgs, const Py_ssize_t* lens,
+                                                        Py_ssize_t n);
+int  _log_msg_seq(const int ndx, PyObject* iterable);
+PyObject* _log_stats(const int ndx);
+int  _flush_cft_log(cFTLogDesc_t* d, const bool wait, const bool sync);
+int  _close_cft_log(cFTLogDesc_t* d);
+cFTLogDesc_t* _get_log(const int ndx);
+cFTLogDesc_t* _use_log(const int ndx);
+void _release_log(cFTLogDesc_t* d);
+Py_ssize_t _msg_len(const Py_buffer* msg, Py_ssize_t nbytes);
 
 
 #endif /* _C_FT_LOG_FOR_PY_H_ */
@@ -2,101 +2,774 @@
 
 #include "cFTLogForPy.h"
 
+#include <endian.h>     // htole64
+
 // DATA /////////////////////////////////////////////////////////////
 
 // EVENT LOOP /////////////////////////////////////////////
-struct ev_loop* loop;
+// Each manager has its own loop, wakeup watcher and stop flag, in its
+// cFTLogMgr_t; a log's watchers are on the loop of its manager.
 
 
-// CALLBACKS ////////////////////////////////////////////////////////
+// FLUSHING /////////////////////////////////////////////////////////
+/**
+ * Write out iovcnt buffers with as few writev() calls as possible,
+ * coping with short writes and interrupted calls.  The iovec array is
+ * consumed in the process.  Returns the number of calls made or -1.
+ */
+int
+writeAll(int fd, struct iovec* iov, int iovcnt) {
+    int calls = 0;
+    while (iovcnt > 0) {
+        ssize_t n = writev(fd, iov, iovcnt < IOV_MAX ? iovcnt : IOV_MAX);
+        if (n < 0) {
+            if (errno == EINTR)
+                continue;
+            return -1;
+        }
+        calls++;
+        // skip the buffers written in full ...
+        while (iovcnt > 0 && (size_t)n >= iov->iov_len) {
+            n -= iov->iov_len;
+            iov++;
+            iovcnt--;
+        }
+        // ... and then any part of the next one
+        if (iovcnt > 0) {
+            iov->iov_base  = (char*)iov->iov_base + n;
+            iov->iov_len  -= n;
+        }
+    }
+    return calls;
+}
+
+/** Return the nanoseconds from a to b. */
+int64_t
+nanosBetween(const struct timespec* a, const struct timespec* b) {
+    return (int64_t)(b->tv_sec - a->tv_sec) * 1000000000
+                                        + (b->tv_nsec - a->tv_nsec);
+}
+
+/**
+ * Get the bytes written so far to disk, or on their way there, as the
+ * log's durability mode requires.  written is the number of bytes just
+ * written; final is set when the log is being closed, when a group
+ * commit is always made.  Runs in the writer thread.  Returns 0 or -1.
+ */
+static int
+syncLog(cFTLogDesc_t* d, size_t written, bool final) {
+    int status = 0;
+    struct timespec now;
+
+    d->unsyncedBytes += written;
+    if (d->unsyncedBytes == 0)
+        return 0;
+    switch (d->durability) {
+        case SYNC_FSYNC:
+            status = fsync(d->fd);
+            break;
+        case SYNC_FDATASYNC:
+            status = fdatasync(d->fd);
+            break;
+        case SYNC_ASYNC:
+#ifdef SYNC_FILE_RANGE_WRITE
+            // start writeback of the whole file without waiting for it
+            status = sync_file_range(d->fd, 0, 0, SYNC_FILE_RANGE_WRITE);
+            break;
+#else
+            d->unsyncedBytes = 0;       // no way to ask; leave it to the OS
+            return 0;
+#endif
+        case SYNC_GROUP:
+            clock_gettime(CLOCK_MONOTONIC, &now);
+            if (!final && d->unsyncedBytes < d->groupBytes &&
+                    nanosBetween(&d->lastSync, &now) <
+                                    (int64_t)d->groupMs * 1000000)
+                return 0;
+            status = fdatasync(d->fd);
+            break;
+        default:                        // SYNC_NONE
+            d->unsyncedBytes = 0;
+            return 0;
+    }
+    if (status)
+        perror("syncing log file");
+    d->syncCalls++;
+    d->unsyncedBytes = 0;
+    clock_gettime(CLOCK_MONOTONIC, &d->lastSync);
+    return status ? -1 : 0;
+}
+
 /**
- * Expect to enter this with the WRITE_PENDING flag set.
+ * Keep a preallocated log's file at least half an extent ahead of its
+ * logical end, so that the writes of a flush land in space already
+ * allocated and the syncs after them have only data to commit.  The
+ * file is extended a whole extent at a time, to the next multiple of
+ * the extent size past a full extent ahead.  Should the filesystem
+ * refuse, preallocation is given up and the file grows as it is
+ * written.  Runs in the writer thread.
  */
 static void
-timedWriterCB(EV_P_ struct ev_timer *w, int revents) {
-    cFTLogDesc_t* d = logDescs[logNdx];
+keepAllocated(cFTLogDesc_t* d) {
+    u_int64_t extent = d->preallocBytes;
+    if (extent == 0 || d->allocEnd >= d->fileBytes + extent / 2)
+        return;
+    u_int64_t from = d->allocEnd > d->fileBytes ? d->allocEnd : d->fileBytes;
+    u_int64_t to   = (d->fileBytes + extent) / extent * extent + extent;
+    int err = posix_fallocate(d->fd, from, to - from);
+    if (err) {
+        errno = err;
+        perror("preallocating log file");
+        d->preallocBytes = 0;
+        return;
+    }
+    d->allocEnd = to;
+}
+
+/**
+ * Cut a preallocated log's file back to its logical end, before it is
+ * closed or rotated.  That is where the file offset is: each write
+ * moves it on, including any a child process forked while the file was
+ * open makes through its own writer.  Returns 0 or -1.
+ */
+static int
+trimLog(cFTLogDesc_t* d) {
+    if (d->allocEnd == 0)
+        return 0;
+    off_t end = lseek(d->fd, 0, SEEK_CUR);
+    if (end < 0 || ftruncate(d->fd, end)) {
+        perror("trimming log file");
+        return -1;
+    }
+    d->allocEnd = 0;
+    return 0;
+}
+
+/**
+ * Record a preallocated log's logical end, the file offset, in its end
+ * file, so that if we die before the file is cut back the next open
+ * knows where to write.  Called after each flush, before the sync, and
+ * when the file is rotated.
+ */
+static void
+recordEnd(cFTLogDesc_t* d) {
+    if (d->endFd < 0)
+        return;
+    off_t end = lseek(d->fd, 0, SEEK_CUR);
+    u_int64_t word = htole64((u_int64_t)end);
+    if (end < 0 || pwrite(d->endFd, &word, sizeof(word), 0) != sizeof(word))
+        perror("recording end of log file");
+}
+
+/**
+ * Write all of a buffer, as writeAll() does.  Returns 0 or -1.
+ */
+static int
+writeBuf(int fd, const void* buf, size_t len) {
+    struct iovec iov;
+    iov.iov_base = (void*) buf;
+    iov.iov_len  = len;
+    return writeAll(fd, &iov, 1) < 0 ? -1 : 0;
+}
+
+// on_rotate callbacks are called by the writer thread, which must
+// take the GIL to do so; once the interpreter has begun to finalize it
+// must not.  stopCallbacks(), run by atexit before that, stops new
+// calls and waits for those in progress, counted in callbacksRunning.
+static pthread_mutex_t callbackLock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t  callbackDone = PTHREAD_COND_INITIALIZER;
+static bool            callbacksStopped = false;
+static int             callbacksRunning = 0;
+
+#if PY_VERSION_HEX >= 0x030D0000
+#   define PY_FINALIZING()  Py_IsFinalizing()
+#elif PY_VERSION_HEX >= 0x03070000
+#   define PY_FINALIZING()  _Py_IsFinalizing()
+#else
+#   define PY_FINALIZING()  (_Py_Finalizing != NULL)
+#endif
+
+/**
+ * Stop calling on_rotate callbacks, and wait for any being called to
+ * return.  Rotation goes on, without them.  Called without the GIL.
+ */
+void
+stopCallbacks(void) {
+    pthread_mutex_lock(&callbackLock);
+    callbacksStopped = true;
+    while (callbacksRunning > 0)
+        pthread_cond_wait(&callbackDone, &callbackLock);
+    pthread_mutex_unlock(&callbackLock);
+}
 
-    /* XXX THIS IMPLEMENTATION does not handle FULL pages */
+/**
+ * In a child process, remake the lock and forget callbacks which the
+ * parent's writer threads were in the middle of.  Called from the
+ * pthread_atfork() child handler.
+ */
+void
+resetCallbacks(void) {
+    pthread_mutex_init(&callbackLock, NULL);
+    pthread_cond_init (&callbackDone, NULL);
+    callbacksRunning = 0;
+}
+
+/**
+ * Ask the Python callback set for the log what the first record of a
+ * new file should be, and write it.  old is the path the previous file
+ * was renamed to, path that of the new one.  The callback is run
+ * holding the GIL, and the record copied, framed if the log is framed,
+ * so that it is written after the GIL is released.  Any exception the
+ * callback raises is reported and ignored.  Nothing is called once
+ * stopCallbacks() has been, or the interpreter is finalizing.
+ */
+static void
+callOnRotate(cFTLogDesc_t* d, const char* old, const char* path) {
+    pthread_mutex_lock(&callbackLock);
+    bool run = !callbacksStopped && !PY_FINALIZING();
+    if (run)
+        callbacksRunning++;
+    pthread_mutex_unlock(&callbackLock);
+    if (!run)
+        return;
+
+    unsigned char* buf  = NULL;
+    size_t         len  = 0;
+    bool           lost = false;
+    PyGILState_STATE gil = PyGILState_Ensure();
+    PyObject* rec = PyObject_CallFunction(d->onRotate, "ss", old, path);
+    if (rec == NULL) {
+        PyErr_WriteUnraisable(d->onRotate);
+    } else if (rec != Py_None) {
+        Py_buffer view;
+        if (PyObject_GetBuffer(rec, &view, PyBUF_SIMPLE) < 0) {
+            PyErr_WriteUnraisable(d->onRotate);
+        } else {
+            buf  = malloc(FRAME_HDR_SIZE + view.len);
+            lost = buf == NULL;
+            if (buf != NULL && d->framed)
+                len = frameMsg(buf, view.buf, (u_int32_t)view.len);
+            else if (buf != NULL) {
+                memcpy(buf, view.buf, view.len);
+                len = view.len;
+            }
+            PyBuffer_Release(&view);
+        }
+    }
+    Py_XDECREF(rec);
+    PyGILState_Release(gil);
+
+    pthread_mutex_lock(&callbackLock);
+    if (--callbacksRunning == 0)
+        pthread_cond_broadcast(&callbackDone);
+    pthread_mutex_unlock(&callbackLock);
+
+    if (lost || (buf != NULL && writeBuf(d->fd, buf, len) < 0))
+        perror("writing first record of rotated log");
+    else if (buf != NULL) {
+        d->fileBytes     += len;
+        d->unsyncedBytes += len;
+    }
+    free(buf);
+}
+
+/**
+ * Rotate the log if its file has reached rotateBytes or is rotateSecs
+ * old: sync and close it, give it the next free numeric suffix, and
+ * open a new file under the original name.  Runs in the writer thread
+ * after a flush, so producers never wait for it; they go on filling
+ * the buffers.  A file is never rotated in the middle of a message,
+ * and a preallocated one is first cut back to its logical end.
+ * Returns 0 or -1.
+ */
+static int
+maybeRotate(cFTLogDesc_t* d) {
+    struct timespec now;
+    if (d->midMessage)
+        return 0;
+    bool due = d->rotateBytes && d->fileBytes >= d->rotateBytes;
+    if (!due && d->rotateSecs) {
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        due = nanosBetween(&d->fileOpened, &now) >=
+                                    (int64_t)d->rotateSecs * 1000000000;
+    }
+    if (!due || d->fileBytes == 0)
+        return 0;
+
+    char path[2 * MAX_PATH_LEN + 2];
+    char old [2 * MAX_PATH_LEN + 16];
+    snprintf(path, sizeof(path), "%s%c%s", d->logDir, PATH_SEP, d->logName);
+
+    int status = trimLog(d);
+    if (syncLog(d, 0, true))
+        status = -1;
+    // link() rather than rename() so that we never replace an older
+    // segment, say one left by an earlier run
+    for (;;) {
+        snprintf(old, sizeof(old), "%s.%u", path, ++d->segment);
+        if (link(path, old) == 0)
+            break;
+        if (errno != EEXIST) {
+            perror("rotating log file");
+            return -1;
+        }
+    }
+    unlink(path);
+    int fd = open(path, O_CREAT | O_WRONLY |
+                                (d->preallocBytes ? 0 : O_APPEND),
+                                S_IRUSR | S_IWUSR | S_IRGRP | S_IROTH);
+    if (fd < 0) {
+        // carry on with the old file; it will be rotated again later
+        perror("opening rotated log file");
+        rename(old, path);
+        d->segment--;
+        return -1;
+    }
+    close(d->fd);
+    d->fd        = fd;
+    d->fileBytes = 0;
+    clock_gettime(CLOCK_MONOTONIC, &d->fileOpened);
+    d->rotations++;
+    if (d->onRotate != NULL)
+        callOnRotate(d, old, path);
+    recordEnd(d);
+    return status;
+}
+
+/**
+ * Write out what has been logged other than into the pages: the
+ * messages in the lock-free byte ring or staged by each thread, and
+ * those in the shared-memory ring.  Sets *bytes to the number of bytes
+ * written.  Returns 0 or -1.
+ */
+static int
+drainOthers(cFTLogDesc_t* d, size_t* bytes) {
+    size_t ring, staged, shared;
+    int status = drainMpscRing(d, &ring);
+    if (harvestStaged(d, &staged))
+        status = -1;
+    if (drainShmRing(d, &shared))
+        status = -1;
+    *bytes = ring + staged + shared;
+    return status;
+}
+
+/**
+ * Write every FULL page of a log to disk, followed by the active page,
+ * in the order in which the pages were filled.  The pages are gathered
+ * into a single writev(), normally one syscall per flush.  Then come
+ * the messages in the log's byte ring or staged by each thread, and
+ * those waiting in its shared-memory ring, if it has them, and whatever
+ * sync the log's durability mode calls for.  Pages written are marked
+ * READY and any producer waiting for a free page is woken.  A
+ * recoverable log's ring file is told where in the log the pages are
+ * to go first, and a preallocated log's file extended if it is running
+ * short of space.
+ *
+ * The active page is only taken if there is a READY page to replace
+ * it, unless final is set, in which case it is taken anyway: that is
+ * what close_cft_logger does once the writer thread has stopped.  If
+ * sync is not set, no sync is made: the bytes written are left for the
+ * next flush to sync.
+ *
+ * Normally runs in the writer thread.  Returns 0 or -1 if a write or
+ * sync failed.
+ */
+int
+flushLog(cFTLogDesc_t* d, bool final, bool sync) {
+    u_int32_t*  toWrite = d->flushOrder;
+    u_int32_t   n = 0;
+    u_int32_t   i, j;
+    int         status = 0;
+
+    keepAllocated(d);
 
     // get a lock on the descriptor
     pthread_mutex_lock(&d->logBufLock);         // LOCK LOCK LOCK 
     d->writeFlags &= ~WRITE_PENDING; 
 
+    // collect the FULL pages, sorted by the order in which they filled
+    d->fullCount = 0;
+    for (i = 0; i < d->bufCount; i++) {
+        logBufDesc_t* p = d->logBufDescs + i;
+        if (p->flags != FULL_BUF)
+            continue;
+        for (j = n; j > 0 &&
+                (int32_t)(d->logBufDescs[toWrite[j-1]].seq - p->seq) > 0; j--)
+            toWrite[j] = toWrite[j-1];
+        toWrite[j] = i;
+        n++;
+    }
     // bufInUse is a logical pointer to the buffer currently in use
-    logBufDesc_t* p = d->logBufDescs + d->bufInUse;
-    if ( p->offset > 0 ) {
-        p->flags        = BEING_WRITTEN;
-        d->writeFlags  |= WRITE_IN_PROGRESS; 
-        pthread_mutex_unlock(&d->logBufLock);   // UNLOCK UNLOCK  
-
-//      // DEBUG
-//      char msg[512];
-//      sprintf(msg, "callback flushing %d bytes to disk\n", p->offset);
-//      int msgLen = strlen(msg);
-//      write (d->fd, msg, msgLen);
-//      // END
-
-        d->bufInUse = (d->bufInUse + 1) % C_FT_LOG_BUF_COUNT;
-
-        // XXX if next page isn't READY, we are in serious trouble
-
-        // write buffer to disk - this blocks, of course
-        int bytesWritten = write(d->fd, p->data, p->offset);
-        if (bytesWritten == -1)
-            perror ("timedWriterCB, flushing to disk");
-
-        int status  = fsync(d->fd);
-        if (status)
-            perror("fsync, flushing log buffer in callback");
-
-        // mark the page as ready for re-use
-        pthread_mutex_lock(&d->logBufLock);    // LOCK LOCK
+    logBufDesc_t* active = d->logBufDescs + d->bufInUse;
+    if (active->flags == ACTIVE_BUF && active->offset > 0) {
+        // move producers on to a READY page before dropping the lock,
+        // so that nothing is copied into the page while it is written
+        int next = -1;
+        for (i = 0; i < d->bufCount; i++)
+            if (d->logBufDescs[i].flags == READY_BUF) {
+                next = i;
+                break;
+            }
+        if (next >= 0) {
+            d->bufInUse = next;
+            d->logBufDescs[next].flags = ACTIVE_BUF;
+            d->logBufDescs[next].seq   = d->nextSeq++;
+        }
+        if (next >= 0 || final)
+            toWrite[n++] = active - d->logBufDescs;
+    }
+    if (n == 0) {
+        // just release the lock; there are no pages to write, but there
+        // may be messages in the ring and a group commit may be due
+        pthread_mutex_unlock(&d->logBufLock);  // UNLOCK UNLOCK UNLOCK //
+        size_t extra;
+        status = drainOthers(d, &extra);
+        recordEnd(d);
+        if (!sync)
+            d->unsyncedBytes += extra;
+        else if (syncLog(d, extra, final))
+            status = -1;
+        return status;
+    }
+    size_t bytes = 0;
+    for (i = 0; i < n; i++)
+        bytes += d->logBufDescs[toWrite[i]].offset;
+    if (d->ringFile != NULL) {
+        // say where the write will go before the pages say they are
+        // being written, in case we die in between
+        d->ringFile->flushStart = d->fileBytes;
+        d->ringFile->flushEnd   = d->fileBytes + bytes;
+        atomic_signal_fence(memory_order_seq_cst);
+    }
+    for (i = 0; i < n; i++)
+        d->logBufDescs[toWrite[i]].flags = BEING_WRITTEN;
+    bool split = d->logBufDescs[toWrite[n - 1]].split;
+    d->writeFlags |= WRITE_IN_PROGRESS; 
+    pthread_mutex_unlock(&d->logBufLock);   // UNLOCK UNLOCK  
+
+    // write buffers to disk - this blocks, of course
+    struct timespec t0, t1;
+    clock_gettime(CLOCK_MONOTONIC, &t0);
+    for (i = 0; i < n; i++) {
+        logBufDesc_t* p = d->logBufDescs + toWrite[i];
+        d->flushIov[i].iov_base = p->data;
+        d->flushIov[i].iov_len  = p->offset;
+    }
+    int calls = writeAll(d->fd, d->flushIov, n);
+    if (calls < 0) {
+        perror ("flushLog, flushing to disk");
+        status = -1;
+    }
+    d->fileBytes  += bytes;
+    d->midMessage  = split;
+    size_t extra;
+    if (drainOthers(d, &extra))
+        status = -1;
+    recordEnd(d);
+    if (!sync)
+        d->unsyncedBytes += bytes + extra;
+    else if (syncLog(d, bytes + extra, final))
+        status = -1;
+    clock_gettime(CLOCK_MONOTONIC, &t1);
+
+    // mark the pages as ready for re-use
+    pthread_mutex_lock(&d->logBufLock);    // LOCK LOCK
+    for (i = 0; i < n; i++) {
+        logBufDesc_t* p = d->logBufDescs + toWrite[i];
         p->flags    = READY_BUF;
         p->offset   = 0;
+        p->split    = false;
+    }
+    d->flushCount++;
+    d->flushNanos += nanosBetween(&t0, &t1);
+    if (calls > 0)
+        d->writeCalls += calls;
+    if (!status)
+        d->bytesWritten += bytes;
 
-        // CLEAR THE WRITE-IN_PROGRESS FLAG
-        d->writeFlags &= ~WRITE_IN_PROGRESS; 
-        pthread_mutex_unlock(&d->logBufLock);  // UNLOCK UNLOCK
-    } else {
-        // DEBUG
-        // printf("callback: nothing to do, zero offset\n");
-        // END
-        // just release the lock; there is nothing to do
-        pthread_mutex_unlock(&d->logBufLock);  // UNLOCK UNLOCK UNLOCK //
+    // CLEAR THE WRITE-IN_PROGRESS FLAG and wake any blocked producers
+    d->writeFlags &= ~WRITE_IN_PROGRESS; 
+    pthread_cond_broadcast(&d->bufFreed);
+    pthread_mutex_unlock(&d->logBufLock);  // UNLOCK UNLOCK
+    return status;
+}
+
+/**
+ * Wake the writer thread serving a log.  A shared log used by a child
+ * process has its writer in another process, which we cannot wake; it
+ * sees the log's flags at its next tick instead.  Nor can a child
+ * whose writer has not yet been restarted after fork() wake it.
+ */
+static void
+wakeManager(cFTLogDesc_t* d) {
+    if (LOG_OWNED(d) && d->mgr->running && !d->mgr->forked)
+        ev_async_send(d->mgr->loop, &d->mgr->wakeupWatcher);
+}
+
+/**
+ * Ask the writer thread to flush a log now rather than at its next
+ * tick.  The caller must hold the descriptor's logBufLock.
+ */
+void
+wakeWriter(cFTLogDesc_t* d) {
+    if (!(d->writeFlags & WRITE_PENDING)) {
+        d->writeFlags |= WRITE_PENDING;
+        wakeManager(d);
     }
+}
+
+/**
+ * Ask the writer thread to write out everything buffered for a log,
+ * including the partly filled active page, and, if sync is set, to get
+ * it onto the disk whatever the log's durability mode; otherwise it is
+ * only written, and synced later as the mode calls for.  Returns the
+ * number of the request, which is complete when flushDone reaches it.
+ * The caller must hold the descriptor's logBufLock.
+ *
+ * Unlike wakeWriter() this always wakes the writer: it may already
+ * have cleared WRITE_PENDING without yet having seen this request.
+ */
+u_int64_t
+requestFlush(cFTLogDesc_t* d, bool sync) {
+    d->writeFlags |= WRITE_PENDING | FLUSH_REQUESTED |
+                                                (sync ? SYNC_REQUESTED : 0);
+    wakeManager(d);
+    return ++d->flushRequested;
+}
 
-    // schedule the next callback   XXX DROP THIS CODE XXX
-    ev_timer_init(&d->t_watcher, 
-                                    timedWriterCB, WRITE_INTERVAL, 0);
-    ev_timer_start(loop, &d->t_watcher);
+/**
+ * Record that explicit flushes up to number done have completed with
+ * the given status, waking anyone waiting for them.
+ */
+static void
+flushCompleted(cFTLogDesc_t* d, u_int64_t done, int status) {
+    pthread_mutex_lock(&d->logBufLock);
+    d->flushDone   = done;
+    d->flushStatus = status;
+    pthread_cond_broadcast(&d->bufFreed);
+    pthread_mutex_unlock(&d->logBufLock);
+}
+
+/**
+ * Flush a log which has a write pending.  If a flush was requested
+ * explicitly, the active page is written as well, and if any request
+ * asked for a sync the data is made durable even if the log's
+ * durability mode would not otherwise sync.  Runs in the writer thread.
+ */
+static void
+flushPending(cFTLogDesc_t* d) {
+    pthread_mutex_lock(&d->logBufLock);
+    bool      forced = d->writeFlags & FLUSH_REQUESTED;
+    bool      sync   = d->writeFlags & SYNC_REQUESTED;
+    u_int64_t upTo   = d->flushRequested;
+    d->writeFlags &= ~(FLUSH_REQUESTED | SYNC_REQUESTED);
+    pthread_mutex_unlock(&d->logBufLock);
+
+    if (!forced) {
+        if (flushLog(d, false, true) == 0)
+            maybeRotate(d);
+        return;
+    }
+    int status = flushLog(d, true, sync);
+    if (sync && (d->durability == SYNC_ASYNC ||
+                                    d->durability == SYNC_NONE)) {
+        if (fdatasync(d->fd)) {
+            perror("syncing log file on request");
+            status = -1;
+        }
+        d->syncCalls++;
+    }
+    if (status == 0)
+        status = maybeRotate(d);
+    flushCompleted(d, upTo, status);
+}
+
+// CALLBACKS ////////////////////////////////////////////////////////
+/**
+ * Each log has its own timer, whose data field points back to the
+ * log's descriptor, so every open log is drained on every tick.
+ */
+static void
+timedWriterCB(EV_P_ struct ev_timer *w, int revents) {
+    cFTLogDesc_t* d = (cFTLogDesc_t*) w->data;
+    // a child process sharing the log cannot wake us to flush it
+    if (d->writeFlags & FLUSH_REQUESTED) {
+        flushPending(d);
+        return;
+    }
+    if (flushLog(d, false, true) == 0)
+        maybeRotate(d);
 }  
 
+/**
+ * Stop a log's timer, write out everything left in its buffers, cut a
+ * preallocated file back to its logical end, and close it, removing
+ * its end file if the file was cut back.  Runs in the writer thread,
+ * so that all file IO is done in the one thread.  Returns 0 or -1.
+ */
+static int
+drainAndClose(EV_P_ cFTLogDesc_t* d) {
+    ev_timer_stop(EV_A_ &d->t_watcher);
+    if (d->shmRing != NULL)
+        atomic_store(&d->shmRing->closed, 1);   // no more, please
+    int status = flushLog(d, true, true);
+    if (d->fd >= 0 && trimLog(d))
+        status = -1;
+    if (d->fd >= 0) {
+        if (close(d->fd)) {
+            perror("closing log file");
+            status = -1;
+        }
+        d->fd = -1;
+    }
+    // the ring file's pages are all in the log now, and its end is the
+    // end of the file
+    if (!status)
+        removeRingFile(d);
+    if (d->endFd >= 0) {
+        if (!status && d->endPath[0] != '\0')
+            unlink(d->endPath);
+        close(d->endFd);
+        d->endFd = -1;
+    }
+    // anyone still waiting on a flush has had it
+    flushCompleted(d, d->flushRequested, status);
+    return status;
+}
+
+/**
+ * Ask the writer thread to drain and close a single log and take it
+ * out of the descriptor table.  When it has, it sets the descriptor's
+ * closed flag and broadcasts bufFreed.  The caller must hold the
+ * descriptor's logBufLock.
+ */
+void
+requestClose(cFTLogDesc_t* d) {
+    d->writeFlags |= CLOSE_REQUESTED;
+    wakeManager(d);
+}
+
+/**
+ * Close a log on request: drain it and close its file, take it out of
+ * the table, and tell the thread waiting in close_cft_log() that it
+ * may free the descriptor.  Runs in the writer thread.
+ */
+static void
+closeRequested(EV_P_ cFTLogDesc_t* d) {
+    int status = drainAndClose(EV_A_ d);
+    setLogDesc(d->ndx, NULL);
+    pthread_mutex_lock(&d->logBufLock);
+    d->flushStatus = status;
+    d->closed      = true;
+    pthread_cond_broadcast(&d->bufFreed);
+    pthread_mutex_unlock(&d->logBufLock);
+}
+
+/**
+ * Runs in the writer thread whenever another thread calls
+ * ev_async_send() on wakeupWatcher.  Starts the timers of newly opened
+ * logs, closes those whose close has been requested, and flushes any
+ * log with a write pending.  On request it instead drains and closes
+ * every log, then stops the watcher and breaks out of the event loop,
+ * leaving the result in the manager's closeStatus.  Each manager's
+ * watcher points back to it.
+ */
+static void
+wakeupCB(EV_P_ ev_async *w, int revents) {
+    cFTLogMgr_t* mgr = (cFTLogMgr_t*) w->data;
+    // read the flag just once: a stop requested while we are part way
+    // through the loop below must not skip the drain
+    bool stopping = mgr->stopRequested;
+    int  last     = lastLogSlot(mgr);
+    int ndx;
+    for (ndx = LOG_HANDLE(mgr, 0); ndx <= last; ndx++) {
+        cFTLogDesc_t* d = logDescAt(ndx);
+        if (d == NULL || !LOG_OWNED(d))
+            continue;
+        pthread_mutex_lock(&d->logBufLock);
+        bool closing = d->writeFlags & CLOSE_REQUESTED;
+        pthread_mutex_unlock(&d->logBufLock);
+        if (closing) {
+            closeRequested(EV_A_ d);
+            continue;
+        }
+        if (stopping) {
+            if (drainAndClose(EV_A_ d))
+                mgr->closeStatus = -1;
+            continue;
+        }
+        if (!ev_is_active(&d->t_watcher))
+            ev_timer_start(EV_A_ &d->t_watcher);
+        if (d->writeFlags & WRITE_PENDING)
+            flushPending(d);
+    }
+    if (stopping) {
+        ev_async_stop(EV_A_ w);
+        ev_break(EV_A_ EVBREAK_ALL);
+    }
+}
+
 // INITIALIZATION CODE //////////////////////////////////////////////
 
-int setupLibEvAndCallbacks(int ndx) {
-    ev_timer_init(&logDescs[ndx]->t_watcher, timedWriterCB, 0.1, 0);
-    ev_timer_start(loop, &logDescs[ndx]->t_watcher);
+/**
+ * Prepare a log's timer, to be started by the writer thread, which
+ * leaves it alone until then.
+ */
+void initLogTimer(cFTLogDesc_t* d) {
+    ev_timer_init(&d->t_watcher, timedWriterCB, d->mgr->writeInterval,
+                                                d->mgr->writeInterval);
+    d->t_watcher.data = d;
+}
+
+/**
+ * Called in a manager's writer thread before its event loop is started.
+ */
+void setupWakeupWatcher(cFTLogMgr_t* mgr) {
+    mgr->stopRequested = false;
+    mgr->closeStatus   = 0;
+    ev_async_init(&mgr->wakeupWatcher, wakeupCB);
+    mgr->wakeupWatcher.data = mgr;
+    ev_async_start(mgr->loop, &mgr->wakeupWatcher);
+}
+
+/**
+ * Prepare the timer for a newly opened log, which must be otherwise
+ * ready for use, put the log in its slot in the table, and ask the
+ * writer thread to start the timer.
+ */
+int setupLibEvAndCallbacks(cFTLogDesc_t* d) {
+    initLogTimer(d);
+    setLogDesc(d->ndx, d);
+    wakeManager(d);
     // DEBUG
     // printf ("setup watcher for libNdx %d\n", ndx);
     // END
     return 0;
 } 
 
+/**
+ * Ask a manager's writer thread to drain and close every log, stop its
+ * watchers and leave the event loop.  The caller should then join the
+ * writer thread and check the manager's closeStatus.
+ */
+void stopWriter(cFTLogMgr_t* mgr) {
+    mgr->stopRequested = true;
+    ev_async_send(mgr->loop, &mgr->wakeupWatcher);
+}
+
 // HACKING ABOUT ////////////////////////////////////////////////////
 
+/**
+ * Ask the writer thread to flush log ndx as soon as it can, rather
+ * than at the next tick of the log's timer.
+ */
 int scheduleWrite(int ndx) {
-    cFTLogDesc_t* d = logDescs[logNdx];
+    cFTLogDesc_t* d = logDescAt(ndx);
+    if (d == NULL)
+        return -1;
     pthread_mutex_lock(&d->logBufLock);  // get a lock on the descriptor
-
-    if (!(d->writeFlags & WRITE_PENDING)) {
-        // no write pending, so schedule one
-        ev_timer_init(&d->t_watcher, timedWriterCB, 0.1, 0);
-        ev_timer_start(loop, &d->t_watcher);
-        // DEBUG
-        // printf ("setup watcher for libNdx %d\n", ndx);
-        // END
-        d->writeFlags |= WRITE_PENDING; 
-    }
+    wakeWriter(d);
     pthread_mutex_unlock(&d->logBufLock);   // unlock the descriptor
     return 0;
 }
@@ -0,0 +1,136 @@
+/* ~/dev/py/xlutil_py/src/extsrc/frames.c */
+
+#include "cFTLogForPy.h"
+
+#include <endian.h>     // htole32
+
+// FRAMED RECORDS ///////////////////////////////////////////////////
+// A framed log writes each message as a record: its length and the
+// CRC32C of that length and the message, each four bytes little-
+// endian, then the message itself.  The CRC covers the length, so that
+// a run of zero bytes never reads as a good record.
+
+#define CRC32C_POLY     (0x82f63b78)    // Castagnoli, reflected
+
+static u_int32_t crcTable[8][256];
+static bool      crcHardware;
+static pthread_once_t crcOnce = PTHREAD_ONCE_INIT;
+
+/** Build the tables for slicing by 8, and see whether SSE4.2 is here. */
+static void
+initCrc(void) {
+    u_int32_t i, j;
+    for (i = 0; i < 256; i++) {
+        u_int32_t crc = i;
+        for (j = 0; j < 8; j++)
+            crc = crc & 1 ? (crc >> 1) ^ CRC32C_POLY : crc >> 1;
+        crcTable[0][i] = crc;
+    }
+    for (i = 0; i < 256; i++)
+        for (j = 1; j < 8; j++)
+            crcTable[j][i] = (crcTable[j-1][i] >> 8) ^
+                                        crcTable[0][crcTable[j-1][i] & 0xff];
+#if defined(__x86_64__) && defined(__GNUC__)
+    __builtin_cpu_init();
+    crcHardware = __builtin_cpu_supports("sse4.2");
+#endif
+}
+
+#if defined(__x86_64__) && defined(__GNUC__)
+/** The SSE4.2 crc32 instruction, eight bytes at a time. */
+__attribute__((target("sse4.2")))
+static u_int32_t
+crcSse42(u_int32_t crc, const unsigned char* p, size_t len) {
+    u_int64_t c = crc;
+    while (len > 0 && ((uintptr_t)p & 7)) {
+        c = __builtin_ia32_crc32qi((u_int32_t)c, *p++);
+        len--;
+    }
+    while (len >= 8) {
+        c = __builtin_ia32_crc32di(c, *(const u_int64_t*)p);
+        p   += 8;
+        len -= 8;
+    }
+    while (len-- > 0)
+        c = __builtin_ia32_crc32qi((u_int32_t)c, *p++);
+    return (u_int32_t)c;
+}
+#endif
+
+/** Slicing by 8, for hosts without the instruction. */
+static u_int32_t
+crcTables(u_int32_t crc, const unsigned char* p, size_t len) {
+#if __BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__
+    while (len >= 8) {
+        u_int64_t w;
+        memcpy(&w, p, 8);
+        w ^= crc;
+        crc = crcTable[7][ w        & 0xff] ^ crcTable[6][(w >>  8) & 0xff] ^
+              crcTable[5][(w >> 16) & 0xff] ^ crcTable[4][(w >> 24) & 0xff] ^
+              crcTable[3][(w >> 32) & 0xff] ^ crcTable[2][(w >> 40) & 0xff] ^
+              crcTable[1][(w >> 48) & 0xff] ^ crcTable[0][ w >> 56        ];
+        p   += 8;
+        len -= 8;
+    }
+#endif
+    while (len-- > 0)
+        crc = (crc >> 8) ^ crcTable[0][(crc ^ *p++) & 0xff];
+    return crc;
+}
+
+/**
+ * Return the CRC32C of len bytes at buf, continuing from crc, the
+ * CRC32C of whatever came before them, or 0.
+ */
+u_int32_t
+crc32c(u_int32_t crc, const void* buf, size_t len) {
+    pthread_once(&crcOnce, initCrc);
+    crc = ~crc;
+#if defined(__x86_64__) && defined(__GNUC__)
+    if (crcHardware)
+        return ~crcSse42(crc, buf, len);
+#endif
+    return ~crcTables(crc, buf, len);
+}
+
+/**
+ * Write the record framing a message of len bytes into out, which must
+ * have room for FRAME_HDR_SIZE more bytes than that.  Returns the
+ * length of the record.
+ */
+size_t
+frameMsg(unsigned char* out, const char* msg, u_int32_t len) {
+    u_int32_t word = htole32(len);
+    memcpy(out, &word, 4);
+    memcpy(out + FRAME_HDR_SIZE, msg, len);
+    word = htole32(crc32c(crc32c(0, out, 4), msg, len));
+    memcpy(out + 4, &word, 4);
+    return FRAME_HDR_SIZE + (size_t)len;
+}
+
+/**
+ * Check the records in the len bytes at buf, from offset start, in
+ * order, stopping at the first which is torn, running past the end of
+ * the buffer, or whose CRC does not match.  Sets *records to the number
+ * of good records.  Returns the offset just past the last of them.
+ */
+size_t
+scanFrames(const unsigned char* buf, size_t len, size_t start,
+                                                    u_int64_t* records) {
+    size_t at = start;
+    *records  = 0;
+    while (len - at >= FRAME_HDR_SIZE) {
+        u_int32_t size, crc;
+        memcpy(&size, buf + at, 4);
+        memcpy(&crc,  buf + at + 4, 4);
+        size = le32toh(size);
+        if (size > len - at - FRAME_HDR_SIZE)
+            break;
+        if (crc32c(crc32c(0, buf + at, 4), buf + at + FRAME_HDR_SIZE, size)
+                                                        != le32toh(crc))
+            break;
+        at += FRAME_HDR_SIZE + (size_t)size;
+        (*records)++;
+    }
+    return at;
+}
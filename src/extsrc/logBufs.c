@@ -2,26 +2,89 @@
 
 #include "cFTLogForPy.h"
 
+#include <endian.h>     // le64toh
+#include <sys/file.h>   // flock
+
 // local prototypes 
-static cFTLogDesc_t* cLogAllocInit(const char* logDir, const char* logName);
+static cFTLogDesc_t* cLogAllocInit(const char* logDir, const char* logName,
+                                                const cFTLogOpts_t* opts);
 
-int initLogBuffers(ndx) {
-    memset(logDescs[ndx]->logBufDescs, 0, 
-                                C_FT_LOG_BUF_COUNT * sizeof(logBufDesc_t));
+/**
+ * Allocate zeroed memory shared with any child processes forked later,
+ * or return NULL.
+ */
+static void* sharedAlloc(size_t bytes) {
+    void* p = mmap(NULL, bytes, PROT_READ | PROT_WRITE,
+                                        MAP_SHARED | MAP_ANONYMOUS, -1, 0);
+    return p == MAP_FAILED ? NULL : p;
+}
+
+/**
+ * Allocate a log's ring of pages.  A shared log's page descriptors and
+ * pages are in shared memory, all its pages in one block; the ring
+ * cannot grow, since children would not see the new pages.  Nor can a
+ * recoverable log's, which are in its ring file: see mapRingFile().
+ */
+int initLogBuffers(cFTLogDesc_t* d) {
+    d->bufCapacity  = d->bufCount > C_FT_LOG_MAX_BUF_COUNT || d->shared ||
+                    d->recoverable ? d->bufCount : C_FT_LOG_MAX_BUF_COUNT;
+    u_int32_t count = d->bufCount;
+    unsigned char* pages = NULL;
+    d->bufCount     = 0;
+    if (d->shared) {
+        d->logBufDescs = sharedAlloc(d->bufCapacity * sizeof(logBufDesc_t));
+        pages          = sharedAlloc((size_t)count * d->bufSize);
+        if (d->logBufDescs == NULL || pages == NULL)
+            return -1;
+    } else if (d->recoverable) {
+        if (mapRingFile(d, count, &pages))
+            return -1;
+    } else
+        d->logBufDescs = calloc(d->bufCapacity, sizeof(logBufDesc_t));
+    d->flushOrder   = calloc(d->bufCapacity, sizeof(u_int32_t));
+    d->flushIov     = calloc(d->bufCapacity, sizeof(struct iovec));
+    if (d->logBufDescs == NULL || d->flushOrder == NULL ||
+                                                    d->flushIov == NULL)
+        return -1;
 
     // paranoia is good for the soul
-    pthread_mutex_lock(&logDescs[ndx]->logBufLock);
-    int i;
-    for (i = 0; i < C_FT_LOG_BUF_COUNT; i++) {
-        logBufDesc_t* p = logDescs[ndx]->logBufDescs + i;
-        p->flags = i == 0 ? ACTIVE_BUF : READY_BUF;
-        p->pageBytes = LOG_BUFFER_SIZE;
-        p->data      = logDescs[ndx]->logBuffers + i * LOG_BUFFER_SIZE;
+    pthread_mutex_lock(&d->logBufLock);
+    u_int32_t i;
+    int status = 0;
+    for (i = 0; i < count; i++) {
+        logBufDesc_t* p = d->logBufDescs + i;
+        p->data = pages ? pages + (size_t)i * d->bufSize : malloc(d->bufSize);
+        if (p->data == NULL) {
+            status = -1;
+            break;
+        }
+        p->flags     = i == 0 ? ACTIVE_BUF : READY_BUF;
+        p->pageBytes = d->bufSize;
+        d->bufCount++;
     }
-
     // ndx of page in use has already been set to zero
-    pthread_mutex_unlock(&logDescs[ndx]->logBufLock);
-    return 0;
+    d->logBufDescs[0].seq = d->nextSeq++;
+    pthread_mutex_unlock(&d->logBufLock);
+    return status;
+}
+
+/**
+ * Add a READY page to the ring.  The caller must hold logBufLock.
+ * Returns the index of the new page, or -1 if the ring is already at
+ * its maximum size or memory is exhausted.
+ */
+int growLogBuffers(cFTLogDesc_t* d) {
+    if (d->bufCount >= d->bufCapacity)
+        return -1;
+    logBufDesc_t* p = d->logBufDescs + d->bufCount;
+    p->data = malloc(d->bufSize);
+    if (p->data == NULL)
+        return -1;
+    p->flags     = READY_BUF;
+    p->offset    = 0;
+    p->pageBytes = d->bufSize;
+    d->grownCount++;
+    return d->bufCount++;
 }
 
 // we extract the name of the log directory from s and write it into logDir
@@ -107,39 +170,382 @@ int checkDirs(const char* pathToLog) {
 }
 
 
-/** Deallocates a single descriptor */
-// static 
-void cLogDealloc(int ndx) {
-    cFTLogDesc_t* cLog = logDescs[ndx];
+/**
+ * Deallocates a single descriptor, which must already have been taken
+ * out of the table.  The caller must hold the GIL.
+ */
+void cLogDealloc(cFTLogDesc_t* cLog) {
     if (cLog != NULL) {
+        u_int32_t i;
+        closeShmRing(cLog);
+        freeThreadBufs(cLog);
+        freeMpscRing(cLog);
+        free(cLog->flushOrder);
+        free(cLog->flushIov);
+        Py_XDECREF(cLog->onRotate);     // we are called holding the GIL
+        if (cLog->shared) {
+            // unmapped only in this process; the owner destroys the locks
+            if (cLog->logBufDescs != NULL) {
+                if (cLog->bufCount > 0)
+                    munmap(cLog->logBufDescs[0].data,
+                                (size_t)cLog->bufCount * cLog->bufSize);
+                munmap(cLog->logBufDescs,
+                                cLog->bufCapacity * sizeof(logBufDesc_t));
+            }
+            if (cLog->owner == getpid()) {
+                pthread_cond_destroy (&cLog->bufFreed);
+                pthread_mutex_destroy(&cLog->logBufLock);
+            }
+            munmap(cLog, sizeof(cFTLogDesc_t));
+            return;
+        }
+        if (cLog->endFd >= 0)
+            close(cLog->endFd);
+        if (cLog->ringFile != NULL)
+            unmapRingFile(cLog);
+        else {
+            if (cLog->logBufDescs != NULL)
+                for (i = 0; i < cLog->bufCount; i++)
+                    free(cLog->logBufDescs[i].data);
+            free(cLog->logBufDescs);
+        }
+        pthread_cond_destroy (&cLog->bufFreed);
+        pthread_mutex_destroy(&cLog->logBufLock);
         free(cLog);
-        // printf("*** cLog deallocated desc %d successfully ***\n", ndx);
-        logDescs[ndx] = NULL;
     }
 
 }
 
-void initLogDescs(void) {
+// MANAGERS /////////////////////////////////////////////////////////
+
+// The registry of managers, by id.  It is only changed holding the GIL,
+// but the writer threads read it, so under mgrLock.
+static cFTLogMgr_t*     mgrTable[CLOG_MAX_MGR];
+static pthread_mutex_t  mgrLock = PTHREAD_MUTEX_INITIALIZER;
+
+/**
+ * Allocate and register a manager with the given id, which must be
+ * free, and the given interval between timed flushes.  Its writer
+ * thread is not started.  Returns NULL if memory is exhausted.
+ */
+cFTLogMgr_t* newLogMgr(int id, double writeInterval) {
+    cFTLogMgr_t* mgr = calloc(1, sizeof(cFTLogMgr_t));
+    if (mgr == NULL)
+        return NULL;
+    mgr->id            = id;
+    mgr->writeInterval = writeInterval;
+    mgr->logNdx        = -1;
+    pthread_mutex_init(&mgr->descLock,  NULL);
+    pthread_mutex_init(&mgr->readyLock, NULL);
+    pthread_cond_init (&mgr->readyCond, NULL);
+    pthread_mutex_lock(&mgrLock);
+    mgrTable[id] = mgr;
+    pthread_mutex_unlock(&mgrLock);
+    return mgr;
+}
+
+/**
+ * Unregister and free a manager whose writer thread has been stopped
+ * and whose logs have all been deallocated.
+ */
+void freeLogMgr(cFTLogMgr_t* mgr) {
+    int i;
+    pthread_mutex_lock(&mgrLock);
+    if (mgrTable[mgr->id] == mgr)
+        mgrTable[mgr->id] = NULL;
+    pthread_mutex_unlock(&mgrLock);
+    for (i = 0; i < LOG_TABLE_CHUNKS && mgr->descChunks[i] != NULL; i++)
+        free(mgr->descChunks[i]);
+    free(mgr->freeSlots);
+    pthread_cond_destroy (&mgr->readyCond);
+    pthread_mutex_destroy(&mgr->readyLock);
+    pthread_mutex_destroy(&mgr->descLock);
+    free(mgr);
+}
+
+/** Return the manager with the given id, or NULL. */
+cFTLogMgr_t* logMgrAt(int id) {
+    cFTLogMgr_t* mgr = NULL;
+    if (id < 0 || id >= CLOG_MAX_MGR)
+        return NULL;
+    pthread_mutex_lock(&mgrLock);
+    mgr = mgrTable[id];
+    pthread_mutex_unlock(&mgrLock);
+    return mgr;
+}
+
+/**
+ * Return the lowest id, other than that of the default manager, not
+ * in use, or -1 if there is none.
+ */
+int freeLogMgrId(void) {
+    int id;
+    for (id = DEFAULT_MGR_ID + 1; id < CLOG_MAX_MGR; id++)
+        if (logMgrAt(id) == NULL)
+            return id;
+    return -1;
+}
+
+// DESCRIPTOR TABLES ////////////////////////////////////////////////
+
+// Slots are added a chunk at a time and chunks are never moved, so a
+// descriptor stays put while it is in use.
+
+/** Empty a manager's table and its free list, keeping the chunks. */
+void clearLogDescs(cFTLogMgr_t* mgr) {
     int i;
-    for (i = 0; i < CLOG_MAX_LOG; i++)
-        logDescs[i] = NULL;
+    pthread_mutex_lock(&mgr->descLock);
+    for (i = 0; i < LOG_TABLE_CHUNKS && mgr->descChunks[i] != NULL; i++)
+        memset(mgr->descChunks[i], 0,
+                                LOG_TABLE_CHUNK * sizeof(cFTLogDesc_t*));
+    mgr->logNdx = -1;
+    pthread_mutex_unlock(&mgr->descLock);
+    mgr->freeCount = 0;
 } 
 
+/** Return the descriptor of the log with the given handle, or NULL. */
+cFTLogDesc_t* logDescAt(int handle) {
+    cFTLogDesc_t* d = NULL;
+    if (handle < 0)
+        return NULL;
+    cFTLogMgr_t* mgr = logMgrAt(LOG_MGR_ID(handle));
+    if (mgr == NULL)
+        return NULL;
+    int ndx = LOG_SLOT(handle);
+    pthread_mutex_lock(&mgr->descLock);
+    cFTLogDesc_t** chunk = mgr->descChunks[ndx / LOG_TABLE_CHUNK];
+    if (chunk != NULL)
+        d = chunk[ndx % LOG_TABLE_CHUNK];
+    pthread_mutex_unlock(&mgr->descLock);
+    return d;
+}
+
+/**
+ * Return the handle of the highest slot in a manager's table ever
+ * used, for its writer to scan up to, or -1 if there is none.
+ */
+int lastLogSlot(cFTLogMgr_t* mgr) {
+    pthread_mutex_lock(&mgr->descLock);
+    int ndx = mgr->logNdx;
+    pthread_mutex_unlock(&mgr->descLock);
+    return ndx < 0 ? -1 : LOG_HANDLE(mgr, ndx);
+}
+
+/**
+ * Reserve an empty slot in a manager's table, reusing one freed by a
+ * closed log if there is one, otherwise taking the next, adding a
+ * chunk to the table if need be.  Returns the handle of the slot or -1
+ * if the table is full or memory is exhausted.
+ */
+int allocLogSlot(cFTLogMgr_t* mgr) {
+    if (mgr->freeCount > 0)
+        return LOG_HANDLE(mgr, mgr->freeSlots[--mgr->freeCount]);
+    int ndx = mgr->logNdx + 1;
+    if (ndx >= CLOG_MAX_LOG)
+        return -1;
+    if (mgr->descChunks[ndx / LOG_TABLE_CHUNK] == NULL) {
+        cFTLogDesc_t** chunk = calloc(LOG_TABLE_CHUNK,
+                                                sizeof(cFTLogDesc_t*));
+        if (chunk == NULL)
+            return -1;
+        pthread_mutex_lock(&mgr->descLock);
+        mgr->descChunks[ndx / LOG_TABLE_CHUNK] = chunk;
+        pthread_mutex_unlock(&mgr->descLock);
+    }
+    pthread_mutex_lock(&mgr->descLock);
+    mgr->logNdx = ndx;
+    pthread_mutex_unlock(&mgr->descLock);
+    return LOG_HANDLE(mgr, ndx);
+}
+
+/**
+ * Fill or, if d is NULL, empty a slot.  Called by the main thread to
+ * add a log once it is ready to use, and by the writer thread to take
+ * one out of use when it is closed.
+ */
+void setLogDesc(int handle, cFTLogDesc_t* d) {
+    cFTLogMgr_t* mgr = logMgrAt(LOG_MGR_ID(handle));
+    int          ndx = LOG_SLOT(handle);
+    pthread_mutex_lock(&mgr->descLock);
+    mgr->descChunks[ndx / LOG_TABLE_CHUNK][ndx % LOG_TABLE_CHUNK] = d;
+    pthread_mutex_unlock(&mgr->descLock);
+}
+
+/**
+ * Return an empty slot, reserved by allocLogSlot(), to the free list.
+ */
+void freeLogSlot(int handle) {
+    cFTLogMgr_t* mgr = logMgrAt(LOG_MGR_ID(handle));
+    if (mgr->freeCount == mgr->freeCapacity) {
+        int  capacity = mgr->freeCapacity ? 2 * mgr->freeCapacity
+                                          : LOG_TABLE_CHUNK;
+        int* slots    = realloc(mgr->freeSlots, capacity * sizeof(int));
+        if (slots == NULL)
+            return;                     // the slot is simply not reused
+        mgr->freeSlots    = slots;
+        mgr->freeCapacity = capacity;
+    }
+    mgr->freeSlots[mgr->freeCount++] = LOG_SLOT(handle);
+}
+
+// FORKING //////////////////////////////////////////////////////////
+
+// A child process has only the thread which called fork().  Any lock
+// another thread held at that moment would stay locked in the child,
+// so before the fork we take every lock the extension uses, the
+// registry's, each manager's and each unshared log's, in that order,
+// and let go of them again afterwards in the parent.  In the child the
+// locks are made anew instead.  Shared logs' locks are shared with the
+// child, so are left alone.
+
+/**
+ * Call fn for each unshared log of a manager.  The caller holds the
+ * locks needed, so the table is read directly.
+ */
+static void eachPrivateLog(cFTLogMgr_t* mgr, void (*fn)(cFTLogDesc_t*)) {
+    int ndx;
+    for (ndx = 0; ndx <= mgr->logNdx; ndx++) {
+        cFTLogDesc_t* d =
+            mgr->descChunks[ndx / LOG_TABLE_CHUNK][ndx % LOG_TABLE_CHUNK];
+        if (d != NULL && !d->shared)
+            fn(d);
+    }
+}
+
+static void lockLog(cFTLogDesc_t* d) {
+    pthread_mutex_lock(&d->logBufLock);
+}
+static void unlockLog(cFTLogDesc_t* d) {
+    pthread_mutex_unlock(&d->logBufLock);
+}
+
+/**
+ * Remake a log's locks in a child process and forget what was in its
+ * buffers: that is the parent's, which writes it out itself.  The
+ * pages of a recoverable log are the parent's ring file, so the child
+ * is given a private copy of them first.
+ */
+static void resetLog(cFTLogDesc_t* d) {
+    u_int32_t i;
+    privatizeRingFile(d);
+    pthread_mutex_init(&d->logBufLock, NULL);
+    pthread_cond_init (&d->bufFreed,   NULL);
+    for (i = 0; i < d->bufCount; i++) {
+        logBufDesc_t* p = d->logBufDescs + i;
+        p->flags  = i == d->bufInUse ? ACTIVE_BUF : READY_BUF;
+        p->offset = 0;
+        p->split  = false;
+    }
+    d->logBufDescs[d->bufInUse].seq = d->nextSeq++;
+    d->writeFlags    = 0;
+    d->fullCount     = 0;
+    d->spanning      = false;
+    d->flushDone     = d->flushRequested;
+    d->unsyncedBytes = 0;
+    d->users         = 0;           // the parent's threads are gone
+    d->endPath[0]    = '\0';        // the parent's to remove
+    resetThreadBufs(d);
+    resetMpscRing(d);
+}
+
+/** pthread_atfork() prepare handler: take every lock. */
+void lockForFork(void) {
+    int id;
+    pthread_mutex_lock(&mgrLock);
+    for (id = 0; id < CLOG_MAX_MGR; id++) {
+        cFTLogMgr_t* mgr = mgrTable[id];
+        if (mgr == NULL)
+            continue;
+        pthread_mutex_lock(&mgr->descLock);
+        eachPrivateLog(mgr, lockLog);
+    }
+}
+
+/** pthread_atfork() parent handler: let go of them again. */
+void unlockAfterFork(void) {
+    int id;
+    for (id = CLOG_MAX_MGR - 1; id >= 0; id--) {
+        cFTLogMgr_t* mgr = mgrTable[id];
+        if (mgr == NULL)
+            continue;
+        eachPrivateLog(mgr, unlockLog);
+        pthread_mutex_unlock(&mgr->descLock);
+    }
+    pthread_mutex_unlock(&mgrLock);
+}
+
+/**
+ * pthread_atfork() child handler: remake the locks, empty the unshared
+ * logs' buffers, and note that each running manager has lost its
+ * writer thread.  Its event loop belonged to that thread and is simply
+ * abandoned; restartWriters() gives it a new one.
+ */
+void resetInChild(void) {
+    int id;
+    pthread_mutex_init(&mgrLock, NULL);
+    resetCallbacks();
+    for (id = 0; id < CLOG_MAX_MGR; id++) {
+        cFTLogMgr_t* mgr = mgrTable[id];
+        if (mgr == NULL)
+            continue;
+        pthread_mutex_init(&mgr->descLock,  NULL);
+        pthread_mutex_init(&mgr->readyLock, NULL);
+        pthread_cond_init (&mgr->readyCond, NULL);
+        eachPrivateLog(mgr, resetLog);
+        if (mgr->running) {
+            mgr->forked = true;
+            mgr->loop   = NULL;
+        }
+    }
+}
+
 
 /**
- * This is called once for each log file added.  It returns an index
- * into the logDescs table.
+ * This is called once for each log file added.  It returns a new
+ * descriptor, not yet in the table.
  */
 static 
-cFTLogDesc_t* cLogAllocInit(const char* logDir, const char* logName) {
+cFTLogDesc_t* cLogAllocInit(const char* logDir, const char* logName,
+                                                const cFTLogOpts_t* opts) {
     // XXX CHECK FOR NULL OR OUTSIZED PARAMETERS XXX
-    cFTLogDesc_t* cLog = calloc(1, sizeof(cFTLogDesc_t));
+    cFTLogDesc_t* cLog = opts->shared ? sharedAlloc(sizeof(cFTLogDesc_t))
+                                      : calloc(1, sizeof(cFTLogDesc_t));
     if (cLog != NULL) {
         // this cannot be set with PTHREAD_MUTEX_INITIALIZER because it isn't
-        // static; and similarly for the next two fields
+        // static; and similarly for the next two fields.  A shared log's
+        // are used by several processes.
 //      pthread_mutex_init  (&cLog->readyLock,  NULL);
 //      pthread_cond_init   (&cLog->readyCond,  NULL);
-        pthread_mutex_init  (&cLog->logBufLock, NULL);
+        pthread_mutexattr_t mutexAttr;
+        pthread_condattr_t  condAttr;
+        pthread_mutexattr_init(&mutexAttr);
+        pthread_condattr_init (&condAttr);
+        if (opts->shared) {
+            pthread_mutexattr_setpshared(&mutexAttr, PTHREAD_PROCESS_SHARED);
+            pthread_condattr_setpshared (&condAttr,  PTHREAD_PROCESS_SHARED);
+        }
+        pthread_mutex_init  (&cLog->logBufLock, &mutexAttr);
+        pthread_cond_init   (&cLog->bufFreed,   &condAttr);
+        pthread_mutexattr_destroy(&mutexAttr);
+        pthread_condattr_destroy (&condAttr);
+        cLog->shared   = opts->shared;
+        cLog->recoverable = opts->recoverable;
+        cLog->framed      = opts->framed;
+        cLog->preallocBytes = opts->preallocBytes;
+        cLog->endFd       = -1;
+        cLog->policy   = opts->policy;
+        cLog->bufSize  = opts->bufSize;
+        cLog->bufCount = opts->bufCount;    // allocated by initLogBuffers
+        cLog->durability = opts->durability;
+        cLog->groupMs    = opts->groupMs;
+        cLog->groupBytes = opts->groupBytes;
+        cLog->highWater  = opts->highWater;
+        cLog->rotateBytes = opts->rotateBytes;
+        cLog->rotateSecs  = opts->rotateSecs;
+        cLog->onRotate    = opts->onRotate;
+        Py_XINCREF(cLog->onRotate);
+        clock_gettime(CLOCK_MONOTONIC, &cLog->fileOpened);
+        clock_gettime(CLOCK_MONOTONIC, &cLog->lastSync);
 
         memcpy( cLog->logDir,  logDir,  strlen(logDir) );
         memcpy( cLog->logName, logName, strlen(logName) );
@@ -149,33 +555,112 @@ cFTLogDesc_t* cLogAllocInit(const char* logDir, const char* logName) {
     return cLog;            // which may be NULL
 }
 
+/**
+ * Open, creating it if need be, the file in which the preallocated log
+ * at path, open on fd and size bytes long, records its logical end,
+ * and lock it.  Sets *end to the logical end: the size of the log if
+ * nothing is recorded, as when it was last closed and cut back to it,
+ * otherwise what was recorded, or past that the last byte which is not
+ * zero, which the writer wrote but had not recorded when it died.
+ * Returns the end file's descriptor, or -1 if it cannot be opened or
+ * locked, as when another process has the log open.
+ */
+static int openEndFile(const char* path, int fd, off_t size, off_t* end) {
+    unsigned char buf[64 * 1024];
+    int endFd = open(path, O_CREAT | O_RDWR,
+                                S_IRUSR | S_IWUSR | S_IRGRP | S_IROTH);
+    if (endFd < 0)
+        return -1;
+    if (flock(endFd, LOCK_EX | LOCK_NB)) {
+        close(endFd);
+        return -1;
+    }
+    u_int64_t recorded;
+    if (pread(endFd, &recorded, sizeof(recorded), 0) != sizeof(recorded)) {
+        *end = size;
+        return endFd;
+    }
+    off_t from, to = size;
+    off_t least = le64toh(recorded) < (u_int64_t)size ?
+                                        (off_t)le64toh(recorded) : size;
+    for (*end = least; to > least; to = from) {
+        from = to - least > (off_t)sizeof(buf) ? to - sizeof(buf) : least;
+        ssize_t n = pread(fd, buf, to - from, from);
+        if (n != to - from) {
+            close(endFd);
+            return -1;
+        }
+        while (n > 0 && buf[n - 1] == 0)
+            n--;
+        if (n > 0) {
+            *end = from + n;
+            break;
+        }
+    }
+    return endFd;
+}
+
 /**
  * Split the pathToLog to get the path to the directory and the name of
  * the log file.  Verifies that the log directory exists and then opens
  * the log file.
  *
- * If the log file can be opened, returns its
- * (fd).  Otherwise returns -1 and sets errno.
+ * If the log file can be opened, returns a new descriptor for it,
+ * which the caller adds to the table.  Otherwise returns NULL and sets
+ * errno.
+ *
+ * opts holds the options the log was opened with.  A preallocated log
+ * is opened for writing at its logical end rather than for appending,
+ * and gets an end file: see openEndFile().
  */
 // static
-int openLogFile(const char* pathToLog) {
+cFTLogDesc_t* openLogFile(const char* pathToLog, const cFTLogOpts_t* opts) {
     char logDir [MAX_PATH_LEN + 1];
     char logName[MAX_PATH_LEN + 1];
     int  logFD = -1;
     if (pathToLog == NULL)
-        return -1;
+        return NULL;
     int status = splitPath(logDir, logName, pathToLog);
     if (!status)
         status = checkDirs(logDir);
-    if (!status) {
-        // O_APPEND _must_ be accompanied by O_WRONLY or O_RDWR
-        status  = logFD
-                = open(pathToLog, O_CREAT | O_APPEND | O_WRONLY,
-                                S_IRUSR | S_IWUSR | S_IRGRP | S_IROTH);
-        cFTLogDesc_t* sd   = cLogAllocInit(logDir, logName);
-        sd->fd           = logFD;
-        logDescs[logNdx] = sd;
-
+    if (status)
+        return NULL;
+    // O_APPEND _must_ be accompanied by O_WRONLY or O_RDWR
+    logFD = open(pathToLog, O_CREAT | (opts->preallocBytes ? O_RDWR
+                                                : O_APPEND | O_WRONLY),
+                            S_IRUSR | S_IWUSR | S_IRGRP | S_IROTH);
+    if (logFD < 0)
+        return NULL;
+    struct stat info;
+    off_t end   = 0;
+    int   endFd = -1;
+    char  endPath[2 * MAX_PATH_LEN + 8];
+    if (opts->preallocBytes) {
+        snprintf(endPath, sizeof(endPath), "%s%s", pathToLog, END_FILE_EXT);
+        if (fstat(logFD, &info) ||
+                (endFd = openEndFile(endPath, logFD, info.st_size, &end)) < 0
+                || lseek(logFD, end, SEEK_SET) < 0) {
+            if (endFd >= 0)
+                close(endFd);
+            close(logFD);
+            return NULL;
+        }
     }
-    return status;
+    cFTLogDesc_t* sd   = cLogAllocInit(logDir, logName, opts);
+    if (sd == NULL) {
+        if (endFd >= 0)
+            close(endFd);
+        close(logFD);
+        return NULL;
+    }
+    sd->fd           = logFD;
+    sd->endFd        = endFd;
+    if (opts->preallocBytes) {
+        strcpy(sd->endPath, endPath);
+        // what lies beyond the logical end is free to write over
+        sd->fileBytes = end;
+        sd->allocEnd  = info.st_size;
+    } else if (fstat(logFD, &info) == 0)
+        sd->fileBytes = info.st_size;
+    return sd;
 }
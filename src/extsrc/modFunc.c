@@ -2,207 +2,1275 @@
 
 #include "cFTLogForPy.h"
 
+/**
+ * Start the default manager's writer thread, with an empty descriptor
+ * table.  If the default manager is already running, it is closed
+ * first, as by close_cft_logger().  Other managers are unaffected.
+ */
 PyObject* init_cft_logger(PyObject* self, PyObject* args) {
     // INIT GLOBALS
-    logNdx              = -1;           // 0-based current index
     secondThreadStarted = false;        // XXX SHOULD NOT NEED THIS
 
     // init local variables
     int status = 0;
-    initLogDescs();         // clears descriptor table
+    cFTLogMgr_t* mgr = logMgrAt(DEFAULT_MGR_ID);
+    if (mgr != NULL) {
+        _close_cft_logger(mgr);
+        freeLogMgr(mgr);
+    }
+    mgr = newLogMgr(DEFAULT_MGR_ID, WRITE_INTERVAL);
+    if (mgr == NULL)
+        return PyErr_NoMemory();
 
-    status = writerInitThreaded();
+    status = writerInitThreaded(mgr);
     if (!status)
         secondThreadStarted = true;
     return Py_BuildValue("i", status);
 }
 
+/** Return whether any of a manager's logs is open. */
+static bool hasOpenLogs(cFTLogMgr_t* mgr) {
+    int handle;
+    int last = lastLogSlot(mgr);
+    for (handle = LOG_HANDLE(mgr, 0); handle <= last; handle++) {
+        cFTLogDesc_t* d = logDescAt(handle);
+        if (d != NULL && !d->closed)
+            return true;
+    }
+    return false;
+}
+
+/**
+ * Free a manager when the last reference to its capsule goes.  A
+ * manager still running is first stopped, as by close_cft_logger(),
+ * if none of its logs is open; otherwise it is left alone, writer
+ * thread and all: its logs may still be in use through their handles.
+ */
+static void freeMgrCapsule(PyObject* capsule) {
+    cFTLogMgr_t* mgr = PyCapsule_GetPointer(capsule, LOG_MGR_CAPSULE);
+    if (mgr == NULL || (mgr->running && hasOpenLogs(mgr)))
+        return;
+    _close_cft_logger(mgr);
+    freeLogMgr(mgr);
+}
+
 /**
- * Open a log file given a path to it.  Returns a negative error code
- * or a non-negative log index.
+ * Create a log manager, independent of the default one and of any
+ * other, with its own writer thread, event loop and descriptor table,
+ * and return it wrapped in a capsule.  write_interval is the time in
+ * seconds between timed flushes of each of its logs, by default 0.1.
+ * Pass the capsule as mgr to open_cft_log() to open a log it manages,
+ * and to close_cft_logger() to close its logs and stop it.
+ */
+PyObject* new_cft_logger(PyObject* self, PyObject* args, PyObject* kwargs) {
+    static char* kwlist[] = {"write_interval", NULL};
+    double interval = WRITE_INTERVAL;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|d", kwlist, &interval))
+        return NULL;
+    if (!(interval > 0)) {
+        PyErr_SetString(PyExc_ValueError, "write_interval must be positive");
+        return NULL;
+    }
+    int id = freeLogMgrId();
+    if (id < 0) {
+        PyErr_Format(PyExc_RuntimeError,
+                        "no more than %d loggers may exist", CLOG_MAX_MGR);
+        return NULL;
+    }
+    cFTLogMgr_t* mgr = newLogMgr(id, interval);
+    if (mgr == NULL)
+        return PyErr_NoMemory();
+    if (writerInitThreaded(mgr) < 0) {
+        freeLogMgr(mgr);
+        PyErr_SetString(PyExc_RuntimeError, "cannot start writer thread");
+        return NULL;
+    }
+    PyObject* capsule = PyCapsule_New(mgr, LOG_MGR_CAPSULE, freeMgrCapsule);
+    if (capsule == NULL) {
+        _close_cft_logger(mgr);
+        freeLogMgr(mgr);
+    }
+    return capsule;
+}
+
+/**
+ * Set *mgr to the manager obj stands for: the default manager, which
+ * may not exist, if obj is NULL or None, otherwise the manager in the
+ * capsule obj.  Returns 0, or -1 with a Python exception set if obj is
+ * neither.
+ */
+int _get_mgr(PyObject* obj, cFTLogMgr_t** mgr) {
+    if (obj == NULL || obj == Py_None) {
+        *mgr = logMgrAt(DEFAULT_MGR_ID);
+        return 0;
+    }
+    if (!PyCapsule_IsValid(obj, LOG_MGR_CAPSULE)) {
+        PyErr_SetString(PyExc_TypeError,
+                        "mgr must be a logger made by new_cft_logger()");
+        return -1;
+    }
+    *mgr = PyCapsule_GetPointer(obj, LOG_MGR_CAPSULE);
+    return 0;
+}
+
+/**
+ * Open a log file managed by mgr given a path to it and the options
+ * chosen for it: the policy to follow when its buffers are all full
+ * and the size and number of those buffers.  Returns a negative error
+ * code or a non-negative log handle: that of the slot in the manager's
+ * table last freed by closing a log, if any, otherwise of the next.
  *
  * NOTE that the name begins with an underscore (_).
  */
-int _open_cft_log(const char* pathToLog) {
+int _open_cft_log(cFTLogMgr_t* mgr, const char* pathToLog,
+                                            const cFTLogOpts_t* opts) {
     int status = 0;
-    logNdx++;                               // USED in openLogFile
-    int fd = openLogFile(pathToLog);
-    if (fd < 0) {
+    if (mgr == NULL || !mgr->running)
+        return -1;
+    int ndx = allocLogSlot(mgr);
+    if (ndx < 0)
+        return -1;
+    cFTLogDesc_t* d = openLogFile(pathToLog, opts);
+    if (d == NULL) {
         status = -1;
         char str[512];
         sprintf(str, "openClog: opening log file '%s'", pathToLog);
         perror(str);
+    } else {
+        d->ndx   = ndx;
+        d->mgr   = mgr;
+        d->owner = mgr->pid;
     }
     if (!status)
-        status = initLogBuffers(logNdx);
+        status = initLogBuffers(d);
+    if (!status && opts->shmName != NULL)
+        status = openShmRing(d, opts);
+    if (!status)
+        status = initThreadBufs(d, opts);
+    if (!status)
+        status = initMpscRing(d, opts);
     if(!status)
-        status = setupLibEvAndCallbacks(logNdx);
+        status = setupLibEvAndCallbacks(d);
     if (status < 0) {
-        logNdx--;
+        if (d != NULL) {
+            close(d->fd);
+            cLogDealloc(d);
+        }
+        freeLogSlot(ndx);
         return status;
-    } else {
-        return logNdx;
     }
+    return ndx;
+}
+
+/**
+ * Check options parsed by _parse_log_opts(): each must be in range,
+ * and they must be able to go together.  Returns 0 or -1 with a
+ * ValueError set.
+ */
+static int _check_log_opts(const cFTLogOpts_t* opts) {
+    if (opts->policy < BLOCK_ON_FULL || opts->policy > DROP_ON_FULL) {
+        PyErr_Format(PyExc_ValueError, "unknown policy %d", opts->policy);
+        return -1;
+    }
+    if (opts->durability < SYNC_FSYNC || opts->durability > SYNC_NONE) {
+        PyErr_Format(PyExc_ValueError,
+                "unknown durability %d", opts->durability);
+        return -1;
+    }
+    if (opts->bufSize < MIN_LOG_BUFFER_SIZE ||
+                                    opts->bufSize > MAX_LOG_BUFFER_SIZE) {
+        PyErr_Format(PyExc_ValueError,
+                "buf_size %u is not from %d to %d bytes", opts->bufSize,
+                MIN_LOG_BUFFER_SIZE, MAX_LOG_BUFFER_SIZE);
+        return -1;
+    }
+    if (opts->bufCount < MIN_LOG_BUF_COUNT ||
+                                    opts->bufCount > MAX_LOG_BUF_COUNT) {
+        PyErr_Format(PyExc_ValueError, "buf_count %u is not from %d to %d",
+                opts->bufCount, MIN_LOG_BUF_COUNT, MAX_LOG_BUF_COUNT);
+        return -1;
+    }
+    if (opts->engine != ENGINE_PAGES && opts->engine != ENGINE_MPSC) {
+        PyErr_Format(PyExc_ValueError, "unknown engine %d", opts->engine);
+        return -1;
+    }
+    if (opts->engine == ENGINE_MPSC && (opts->ringSize < MIN_MPSC_RING_SIZE
+                                || opts->ringSize > MAX_MPSC_RING_SIZE)) {
+        PyErr_Format(PyExc_ValueError,
+                "ring_size %u is not from %d to %d bytes", opts->ringSize,
+                MIN_MPSC_RING_SIZE, MAX_MPSC_RING_SIZE);
+        return -1;
+    }
+    if (opts->threadBufs && (opts->threadBufSize < MIN_STAGE_BUF_SIZE ||
+                                opts->threadBufSize > MAX_STAGE_BUF_SIZE)) {
+        PyErr_Format(PyExc_ValueError,
+                "thread_buf_size %u is not from %d to %d bytes",
+                opts->threadBufSize, MIN_STAGE_BUF_SIZE, MAX_STAGE_BUF_SIZE);
+        return -1;
+    }
+    // our writer sees neither a child's threads nor its ring
+    if (opts->shared && (opts->threadBufs || opts->engine != ENGINE_PAGES)) {
+        PyErr_SetString(PyExc_ValueError,
+                "a shared log can use neither thread_bufs nor ENGINE_MPSC");
+        return -1;
+    }
+    if (opts->threadBufs && opts->engine != ENGINE_PAGES) {
+        PyErr_SetString(PyExc_ValueError,
+                "thread_bufs cannot be used with ENGINE_MPSC");
+        return -1;
+    }
+    // only the pages can be recovered
+    if (opts->recoverable && (opts->shared || opts->threadBufs ||
+                                        opts->engine != ENGINE_PAGES)) {
+        PyErr_SetString(PyExc_ValueError, "only a log which is not shared, "
+                "staging nothing per thread, and using ENGINE_PAGES "
+                "can be recoverable");
+        return -1;
+    }
+    if (opts->shmName != NULL) {
+        u_int32_t slots = opts->shmSlots;
+        if (slots < 2 || slots > (1u << 20) || (slots & (slots - 1))) {
+            PyErr_Format(PyExc_ValueError,
+                    "shm_slots %u is not a power of two from 2 to %u",
+                    slots, 1u << 20);
+            return -1;
+        }
+        if (opts->shmSlotSize <= SHM_SLOT_HDR ||
+                    ((opts->shmSlotSize + 63) & ~63u) > MAX_LOG_BUFFER_SIZE) {
+            PyErr_Format(PyExc_ValueError,
+                    "shm_slot_size %u is not from %d to %d bytes",
+                    opts->shmSlotSize, SHM_SLOT_HDR + 1, MAX_LOG_BUFFER_SIZE);
+            return -1;
+        }
+        // other processes log into a shared-memory ring unframed
+        if (opts->framed) {
+            PyErr_SetString(PyExc_ValueError,
+                    "a log with a shared-memory ring cannot be framed");
+            return -1;
+        }
+    }
+    if (opts->preallocBytes && opts->preallocBytes < MIN_PREALLOC_BYTES) {
+        PyErr_Format(PyExc_ValueError,
+                "prealloc_bytes must be 0 or at least %d", MIN_PREALLOC_BYTES);
+        return -1;
+    }
+    // a page size and count each in range may still be too much memory
+    u_int64_t pages = opts->bufCount;
+    if (opts->policy == GROW_ON_FULL && pages < C_FT_LOG_MAX_BUF_COUNT &&
+                                    !opts->shared && !opts->recoverable)
+        pages = C_FT_LOG_MAX_BUF_COUNT;         // as the ring may grow
+    if (opts->bufSize * pages > MAX_LOG_POOL_BYTES) {
+        PyErr_Format(PyExc_ValueError,
+                "%llu pages of %u bytes take more than %llu bytes",
+                (unsigned long long)pages, opts->bufSize,
+                (unsigned long long)MAX_LOG_POOL_BYTES);
+        return -1;
+    }
+    return 0;
 }
-PyObject* open_cft_log(PyObject* self, PyObject* args) {
-    char* pathToLog;
-    if (!PyArg_ParseTuple(args, "s", &pathToLog))
+
+/**
+ * Parse the arguments common to open_cft_log() and LogForPy.init():
+ * the path to the log and then, optionally and possibly by keyword,
+ * policy, buf_size, buf_count, durability, group_ms, group_bytes,
+ * high_water, rotate_bytes, rotate_secs, on_rotate, mgr, the manager
+ * made by new_cft_logger() to open the log in, by default the default
+ * one, shared, whether child processes forked later log into the
+ * same buffers, and shm_name, shm_slots and shm_slot_size, the name
+ * and shape of a shared-memory ring for other processes to log into
+ * (see attach_cft_shm()), thread_bufs, whether each thread stages its
+ * messages in a buffer of its own of thread_buf_size bytes, and
+ * merge_stamps, whether the writer merges what it harvests from them
+ * into timestamp order; and engine, ENGINE_PAGES or ENGINE_MPSC, with
+ * ring_size, the size of the lock-free byte ring of the latter; and
+ * recoverable, whether the pages are kept in a file next to the log,
+ * from which what a crashed run left unwritten is recovered; and
+ * framed, whether each message is written as a record with its length
+ * and CRC32C (see scan_frames()); and prealloc_bytes, if not 0, the
+ * extent in which the log's file is preallocated.  on_rotate and mgr
+ * are borrowed.  Raises ValueError for an option out of range, options
+ * which cannot go together, or pages which would take more than
+ * MAX_LOG_POOL_BYTES.  Returns 0 or -1 with a Python exception set.
+ */
+int _parse_log_opts(PyObject* args, PyObject* kwargs,
+                            const char** pathToLog, cFTLogOpts_t* opts) {
+    static char* kwlist[] = {"path", "policy", "buf_size", "buf_count",
+                    "durability", "group_ms", "group_bytes", "high_water",
+                    "rotate_bytes", "rotate_secs", "on_rotate", "mgr", "shared",
+                    "shm_name", "shm_slots", "shm_slot_size",
+                    "thread_bufs", "thread_buf_size", "merge_stamps",
+                    "engine", "ring_size", "recoverable", "framed",
+                    "prealloc_bytes", NULL};
+    opts->policy     = BLOCK_ON_FULL;
+    opts->bufSize    = LOG_BUFFER_SIZE;
+    opts->bufCount   = C_FT_LOG_BUF_COUNT;
+    opts->durability = SYNC_FSYNC;
+    opts->groupMs    = GROUP_COMMIT_MS;
+    opts->groupBytes = GROUP_COMMIT_BYTES;
+    opts->highWater  = 0;
+    opts->rotateBytes = 0;
+    opts->rotateSecs  = 0;
+    opts->onRotate    = NULL;
+    opts->mgr         = NULL;
+    opts->shared      = false;
+    opts->shmName     = NULL;
+    opts->shmSlots    = SHM_RING_SLOTS;
+    opts->shmSlotSize = SHM_SLOT_SIZE;
+    opts->threadBufs  = false;
+    opts->threadBufSize = STAGE_BUF_SIZE;
+    opts->mergeStamps = false;
+    opts->engine      = ENGINE_PAGES;
+    opts->ringSize    = MPSC_RING_SIZE;
+    opts->recoverable = false;
+    opts->framed      = false;
+    opts->preallocBytes = 0;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s|iIIiIIIKIOOpzIIpIpiIppK",
+                kwlist, pathToLog, &opts->policy, &opts->bufSize,
+                &opts->bufCount, &opts->durability, &opts->groupMs,
+                &opts->groupBytes, &opts->highWater, &opts->rotateBytes,
+                &opts->rotateSecs, &opts->onRotate, &opts->mgr,
+                &opts->shared, &opts->shmName, &opts->shmSlots,
+                &opts->shmSlotSize, &opts->threadBufs, &opts->threadBufSize,
+                &opts->mergeStamps, &opts->engine, &opts->ringSize,
+                &opts->recoverable, &opts->framed, &opts->preallocBytes))
+        return -1;
+    if (_check_log_opts(opts) < 0)
+        return -1;
+    if (opts->onRotate == Py_None)
+        opts->onRotate = NULL;
+    if (opts->onRotate != NULL && !PyCallable_Check(opts->onRotate)) {
+        PyErr_SetString(PyExc_TypeError, "on_rotate must be callable");
+        return -1;
+    }
+    return 0;
+}
+
+PyObject* open_cft_log(PyObject* self, PyObject* args, PyObject* kwargs) {
+    const char*  pathToLog;
+    cFTLogOpts_t opts;
+    cFTLogMgr_t* mgr;
+    if (_parse_log_opts(args, kwargs, &pathToLog, &opts) < 0)
+        return NULL;
+    if (_get_mgr(opts.mgr, &mgr) < 0)
         return NULL;
-    int status = _open_cft_log(pathToLog);
+    int status = _open_cft_log(mgr, pathToLog, &opts);
     return Py_BuildValue("i", status);
 }
 
+/**
+ * Mark each of a manager's logs closing and wait until no call is
+ * using any of them.  Called without the GIL: a call which took a log
+ * before it was marked is waited for, and none can take it after.
+ */
+static void waitForUsers(cFTLogMgr_t* mgr) {
+    int handle;
+    int last = lastLogSlot(mgr);
+    for (handle = LOG_HANDLE(mgr, 0); handle <= last; handle++) {
+        cFTLogDesc_t* d = logDescAt(handle);
+        if (d == NULL || !LOG_OWNED(d))
+            continue;
+        pthread_mutex_lock(&d->logBufLock);
+        d->closing = true;
+        while (d->users > 0)
+            pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+        pthread_mutex_unlock(&d->logBufLock);
+    }
+}
+
+/**
+ * Close every log of a manager and stop its writer thread.
+ *
+ * The argument, if any, is a manager made by new_cft_logger(); any
+ * other argument, or none, means the default manager, which is then
+ * freed.  A manager which is not running is left alone.
+ *
+ * The writer is woken through its async watcher; in its own thread it
+ * writes out whatever is left in each log's buffers, closes the files
+ * and leaves the event loop.  We join it with the GIL released, so the
+ * call takes as long as that final flush and no longer.  Returns 0 or
+ * -1 if any write, sync or close failed.
+ */
 PyObject* close_cft_logger(PyObject* self, PyObject* args) {
+    PyObject*    which = NULL;
+    cFTLogMgr_t* mgr;
 
-    // we'll just ignore any arguments
+    // anything but a manager means the default one, as it always has
+    if (!PyArg_ParseTuple(args, "|O", &which))
+        return NULL;
+    bool byDefault = which == NULL ||
+                                !PyCapsule_IsValid(which, LOG_MGR_CAPSULE);
+    _get_mgr(byDefault ? NULL : which, &mgr);
+    int status = _close_cft_logger(mgr);
+    if (byDefault && mgr != NULL)
+        freeLogMgr(mgr);
+
+    // the PY_BuildValue should convert a plain old C int to a Python integer
+    return Py_BuildValue("i", status);
+}
+int _close_cft_logger(cFTLogMgr_t* mgr) {
     int status = 0;
+    if (mgr == NULL || !mgr->running)
+        return 0;
+    if (mgr->forked) {
+        // a child whose writer was never restarted: there is nothing
+        // to stop, and what was buffered is the parent's
+        mgr->running = false;
+        goto dealloc;
+    }
 
-    // shut down any watchers ---------------------------------------
-    int ndx;
-    for (ndx = 0; ndx <= logNdx; ndx++)
-        ev_timer_stop(loop, &logDescs[ndx]->t_watcher);
+    // let calls logging with the GIL released finish first ----------
+    Py_BEGIN_ALLOW_THREADS
+    waitForUsers(mgr);
+    Py_END_ALLOW_THREADS
 
-    // if write is in progress, wait for it to complete -------------
-    // LATER: we will just wait two WRITE_INTERVAL; this may or may
-    // not make sense !
-    double twoWrites = 4 * WRITE_INTERVAL;      // HACK: 4 INSTEAD OF TWO
-    struct timespec ts;
-    ts.tv_sec  = (int)twoWrites;        // integer part; this will be zero
-    // the next line converts the fractional part of twoWrites to ns
-    ts.tv_nsec = ( twoWrites - ts.tv_sec ) * 1000000000;
+    // ask the writer thread to drain and close the logs and stop -----
+    stopWriter(mgr);
 
-    //printf ("sleeping %lds, %ldns\n", ts.tv_sec, ts.tv_nsec); fflush(stdout);
+    // wait for the logger thread to stop ----------------------------
+    int e;
+    Py_BEGIN_ALLOW_THREADS
+    e = pthread_join(mgr->writerThread, NULL); // returns error number
+    Py_END_ALLOW_THREADS
+    mgr->running = false;
+    if (e) {
+        errno = e;
+        perror("join with writer thread");
+        status = -1;
+    }
 
-    nanosleep(&ts, NULL);
+    // the loop is no longer running, so it is safe to destroy it ---
+    ev_loop_destroy(mgr->loop);     // we created it, so this is safe
+    mgr->loop = NULL;
+    if (mgr->closeStatus)
+        status = mgr->closeStatus;
 
-    // stop the background event loop -------------------------------
-    // printf("  DESTROYING event loop\n"); fflush(stdout);
-    ev_loop_destroy(loop);          // we created it, so this is safe
-    // printf("  ... event loop destroyed\n"); fflush(stdout);
+    // release any resources allocated
+dealloc: ;
+    int handle;
+    int last = lastLogSlot(mgr);
+    for (handle = LOG_HANDLE(mgr, 0); handle <= last; handle++) {
+        cFTLogDesc_t* d = logDescAt(handle);
+        if (d != NULL) {
+            setLogDesc(handle, NULL);
+            cLogDealloc(d);
+        }
+    }
+    clearLogDescs(mgr);     // the free list too
+    return status;
+}
 
-    // we get (25% of the time with twoWrites = 3; 10% with 6; 20% with 10)
-    //     (libev) epoll_wait: Bad file descriptor
-    // and some point after this
 
-    // wait for the logger thread to stop ----------------------------
-    int e = pthread_join(writerThread, NULL); // returns error number
-    if (e)
-        perror("join with writer thread");
+/**
+ * Close a single log, leaving the others and the writer thread running.
+ *
+ * The writer is asked to write out whatever is left in the log's
+ * buffers and close the file, and to take the log out of the table;
+ * we wait for that with the GIL released, then free the descriptor and
+ * make its slot available to the next log opened.  The log is marked
+ * closing first, so that no call logs to it or flushes it once this
+ * has begun, and those already doing so with the GIL released are
+ * waited for.  A shared log may only be closed by the process which
+ * opened it, once its children have stopped logging to it.  Returns 0
+ * or -1 if the final write, sync or close failed; raises ValueError if
+ * there is no open log ndx.
+ */
+PyObject* close_cft_log(PyObject* self, PyObject* args) {
+    int ndx;
+    if (!PyArg_ParseTuple(args, "i", &ndx))
+        return NULL;
+    cFTLogDesc_t* d = _get_log(ndx);
+    if (d == NULL)
+        return NULL;
+    if (!LOG_OWNED(d)) {
+        PyErr_Format(PyExc_ValueError,
+                "shared log %d belongs to process %d", ndx, (int)d->owner);
+        return NULL;
+    }
+    // holding the GIL, so that no other call can get in between
+    pthread_mutex_lock(&d->logBufLock);
+    d->closing = true;
+    pthread_mutex_unlock(&d->logBufLock);
+    int status;
+    Py_BEGIN_ALLOW_THREADS
+    status = _close_cft_log(d);
+    Py_END_ALLOW_THREADS
+    // the writer has finished with it and no one else can find it
+    cLogDealloc(d);
+    freeLogSlot(ndx);
+    return Py_BuildValue("i", status);
+}
+int _close_cft_log(cFTLogDesc_t* d) {
+    int status;
+    pthread_mutex_lock(&d->logBufLock);
+    d->closing = true;
+    while (d->users > 0)
+        pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+    requestClose(d);
+    while (!d->closed)
+        pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+    status = d->flushStatus;
+    pthread_mutex_unlock(&d->logBufLock);
+    return status;
+}
 
-    // printf("JOIN COMPLETE\n");      fflush(stdout);
-
-    //===============================================================
-    // XXX SEGFAULT but empty log file if we return here ============
-    // If you use gdb python and then run testLogMgr.py you can see
-    // that the segfault is related to a 'no such file or directory'
-    // error, which gdb connects to line 4439 in malloc.c
-    //
-    // Review of the code shows that the log file is opened in the main
-    // thread, written in the writerThread, and then flushed and closed
-    // back in the main thread.  It would seem cleaner to do all file
-    // IO in one thread, the writerThread.  This might also get rid
-    // of this strange bug!!
-    //===============================================================
-
-
-    // POSSIBLE WRITE TO DISK FROM MAIN THREAD //////////////////////
-
-    // flush any pending messages to disk ---------------------------
-    for (ndx = 0; ndx <= logNdx; ndx++) {
-        logBufDesc_t* p = &logDescs[ndx]->logBufDescs[logDescs[ndx]->bufInUse];
-
-        if ( p->offset > 0 ) {
-            // write buffer to disk
-            p->flags         = BEING_WRITTEN;
-            int bytesWritten = write(logDescs[ndx]->fd, p->data, p->offset);
-            if (bytesWritten == -1) {
-                perror ("closeLog, writing log buffer to disk");
-            }
-            status  = fsync(logDescs[ndx]->fd);
-            if (status)
-                perror("fsync to fd");
-        }
-        // printf("ABOUT TO ACTUALLY CLOSE LOG FILE %d\n", ndx);
-        // close the log file -------------------------------------------
-        if (!status && (logDescs[ndx]->fd >= 0)) {
-            status = close(logDescs[ndx]->fd);
-        }
+/**
+ * Return the descriptor of open log ndx or, with ValueError set, NULL
+ * if there is none or it is being closed.  Called holding the GIL,
+ * without which the descriptor may be freed.
+ */
+cFTLogDesc_t* _get_log(const int ndx) {
+    cFTLogDesc_t* d = logDescAt(ndx);
+    if (d != NULL) {
+        pthread_mutex_lock(&d->logBufLock);
+        bool open = !d->closed && !d->closing;
+        pthread_mutex_unlock(&d->logBufLock);
+        if (open)
+            return d;
     }
-    // release any resources allocated
-    // HACK - the twoWrites sleep above considerably reduced the number of
-    // bad FD faults; adding this back in appears to have eliminated them
-    usleep(5000*1000);
-    // END`
+    PyErr_Format(PyExc_ValueError, "no open log with index %d", ndx);
+    return NULL;
+}
 
-    // if the status is non-zero we nevertheless close all files
-    for ( ; logNdx >= 0; logNdx--)
-        cLogDealloc(logNdx);
+/**
+ * Like _get_log(), but count the caller as a user of the log, so that
+ * it is not freed while the caller uses it with the GIL released.
+ * The caller must call _release_log() when it is done.  Only the
+ * owner's own threads are counted: close_cft_log() cannot wait for
+ * another process.
+ */
+cFTLogDesc_t* _use_log(const int ndx) {
+    cFTLogDesc_t* d = logDescAt(ndx);
+    if (d != NULL) {
+        pthread_mutex_lock(&d->logBufLock);
+        bool open = !d->closed && !d->closing;
+        if (open && LOG_OWNED(d))
+            d->users++;
+        pthread_mutex_unlock(&d->logBufLock);
+        if (open)
+            return d;
+    }
+    PyErr_Format(PyExc_ValueError, "no open log with index %d", ndx);
+    return NULL;
+}
 
-    // the PY_BuildValue should convert a plain old C int to a Python integer
+/**
+ * Stop using a log taken with _use_log(), waking close_cft_log() if it
+ * is waiting for the last user.  May be called without the GIL.
+ */
+void _release_log(cFTLogDesc_t* d) {
+    if (!LOG_OWNED(d))
+        return;
+    pthread_mutex_lock(&d->logBufLock);
+    if (--d->users == 0 && d->closing)
+        pthread_cond_broadcast(&d->bufFreed);
+    pthread_mutex_unlock(&d->logBufLock);
+}
+
+/**
+ * Prepare for fork(): have every running manager's writer write out
+ * what is buffered for the logs it drains, so that the child, which
+ * discards its copy of the buffers, loses nothing the parent will not
+ * write.  Nothing is synced: that is left to each log's durability
+ * mode, so that a fork does not wait for the disk.  Registered with
+ * os.register_at_fork() when the module is loaded; may also be called
+ * before any other fork.  Returns 0 or -1 if any write failed.
+ */
+PyObject* quiesce_cft_loggers(PyObject* self, PyObject* args) {
+    int status = 0;
+    int id;
+    for (id = 0; id < CLOG_MAX_MGR; id++) {
+        cFTLogMgr_t* mgr = logMgrAt(id);
+        if (mgr == NULL || !mgr->running || mgr->forked)
+            continue;
+        int handle;
+        int last = lastLogSlot(mgr);
+        for (handle = LOG_HANDLE(mgr, 0); handle <= last; handle++) {
+            cFTLogDesc_t* d = logDescAt(handle);
+            if (d == NULL || !LOG_OWNED(d))
+                continue;
+            if ((d = _use_log(handle)) == NULL) {
+                PyErr_Clear();          // closed or being closed
+                continue;
+            }
+            int e;
+            Py_BEGIN_ALLOW_THREADS
+            e = _flush_cft_log(d, true, false);
+            _release_log(d);
+            Py_END_ALLOW_THREADS
+            if (e)
+                status = -1;
+        }
+    }
     return Py_BuildValue("i", status);
 }
 
+/**
+ * In a child process, start a new writer thread for each manager which
+ * was running when the process was forked.  Registered with
+ * os.register_at_fork() when the module is loaded; call it after any
+ * other fork before logging in the child.
+ */
+PyObject* restart_cft_loggers(PyObject* self, PyObject* args) {
+    restartWriters();
+    Py_RETURN_NONE;
+}
+
+/**
+ * Stop the writer threads calling on_rotate callbacks, waiting with the
+ * GIL released for any they are in the middle of; files go on being
+ * rotated without them.  Registered with atexit when the module is
+ * loaded, so that no writer thread takes the GIL once the interpreter
+ * has begun to finalize.
+ */
+PyObject* stop_rotate_callbacks(PyObject* self, PyObject* args) {
+    Py_BEGIN_ALLOW_THREADS
+    stopCallbacks();
+    Py_END_ALLOW_THREADS
+    Py_RETURN_NONE;
+}
 
 /**
  * Write a log message.
  *
- * Parameters are buffer index (ndx) and a properly terminated message
- * (msg), one with a newline and a terminating null byte.  These are
+ * Parameters are buffer index (ndx), the message (msg) and optionally
+ * the number of bytes of the message to log (nbytes).  The message may
+ * be a str, which is logged in UTF-8, or any object supporting the
+ * buffer protocol, such as bytes, bytearray or memoryview; bytes-like
+ * messages are copied straight into the log buffers, so they may carry
+ * binary framing, including null bytes.  If nbytes is given, only that
+ * many leading bytes are logged, which lets a producer reuse one large
+ * bytearray.  Text messages should end with a newline.  These are
  * packaged up Pythonically and dissected here using PyArg_ParseTuple,
- * with a format string "is" used to guide the parse.  We trust that
- * the Python code has vetted the parameters.
+ * with a format string "is*|n" used to guide the parse.
+ *
+ * The GIL is released while we wait for the buffer lock and copy the
+ * message, so other Python threads are not stalled by a writer thread
+ * holding logBufLock.
  *
- * Pathological cases, such as the message being larger than any buffer,
- * may cause unpredictable behavior.
+ * A message larger than a buffer page is spread over several pages.
  */
 
 PyObject* log_msg(PyObject* self, PyObject* args) {
-    int     ndx;
-    const   char* msg;
+    int         ndx;
+    Py_buffer   msg;
+    Py_ssize_t  nbytes = -1;
 
     // logNdx is now first parameter
-    if (!PyArg_ParseTuple(args, "is", &ndx, &msg))
+    if (!PyArg_ParseTuple(args, "is*|n", &ndx, &msg, &nbytes))
         return NULL;
-    if (msg)
-        _log_msg(ndx, msg);
+    Py_ssize_t len = _msg_len(&msg, nbytes);
+    if (len < 0) {
+        PyBuffer_Release(&msg);
+        return NULL;
+    }
+    cFTLogDesc_t* d = _use_log(ndx);
+    if (d == NULL) {
+        PyBuffer_Release(&msg);
+        return NULL;
+    }
+    // the exported buffer cannot be resized or freed until we release
+    // it, so it is safe to copy from without the GIL
+    Py_BEGIN_ALLOW_THREADS
+    _log_msg(d, msg.buf, len);
+    _release_log(d);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&msg);
     Py_RETURN_NONE;
 }
+
 /**
- * Low-level write a log message function.  ndx is an index into the
- * logDescs descriptor table.  msg is a null-terminated C string.
+ * Return the number of bytes of msg to log: all of it if nbytes is
+ * negative, otherwise nbytes, which must not exceed the length of the
+ * buffer.  Returns -1 with a Python exception set if it does.
  */
-void _log_msg(const int ndx, const char* msg) {
-    // XXX should make sure that ndx value is sensible
-    int len = strlen(msg);
+Py_ssize_t _msg_len(const Py_buffer* msg, Py_ssize_t nbytes) {
+    if (msg->len > UINT32_MAX) {
+        PyErr_Format(PyExc_ValueError,
+                "message length %zd is too large to log", msg->len);
+        return -1;
+    }
+    if (nbytes < 0)
+        return msg->len;
+    if (nbytes > msg->len) {
+        PyErr_Format(PyExc_ValueError,
+                "nbytes %zd exceeds message length %zd", nbytes, msg->len);
+        return -1;
+    }
+    return nbytes;
+}
 
+/**
+ * Return a dict of counters for log ndx: messages logged, how often
+ * producers found every page full and blocked, pages added to the
+ * ring, messages dropped, the number of pages in the ring, and the
+ * number of flushes, write syscalls, bytes written and syncs made by
+ * the writer, the seconds it spent writing and syncing, and the number
+ * of times it has rotated the log file.
+ */
+PyObject* log_stats(PyObject* self, PyObject* args) {
+    int ndx;
+    if (!PyArg_ParseTuple(args, "i", &ndx))
+        return NULL;
+    return _log_stats(ndx);
+}
+PyObject* _log_stats(const int ndx) {
+    cFTLogDesc_t* d = _get_log(ndx);
+    if (d == NULL)
+        return NULL;
+    pthread_mutex_lock(&d->logBufLock);
+    unsigned long long count   = d->count;
+    unsigned long long blocked = d->blockedCount;
+    unsigned long long grown   = d->grownCount;
+    unsigned long long dropped = d->droppedCount;
+    unsigned long      pages   = d->bufCount;
+    unsigned long long flushes = d->flushCount;
+    unsigned long long writes  = d->writeCalls;
+    unsigned long long bytes   = d->bytesWritten;
+    unsigned long long syncs   = d->syncCalls;
+    double             seconds = d->flushNanos / 1e9;
+    unsigned long long rotated = d->rotations;
+    unsigned long long recovered = d->recovered;
+    pthread_mutex_unlock(&d->logBufLock);
+    unsigned long long shmDropped = d->shmRing == NULL ? 0 :
+                                        atomic_load(&d->shmRing->dropped);
+    return Py_BuildValue(
+            "{s:K,s:K,s:K,s:K,s:k,s:K,s:K,s:K,s:K,s:d,s:K,s:K,s:K}",
+            "count", count, "blocked", blocked, "grown", grown,
+            "dropped", dropped, "pages", pages,
+            "flushes", flushes, "writes", writes, "bytes_written", bytes,
+            "syncs", syncs, "flush_time", seconds, "rotations", rotated,
+            "shm_dropped", shmDropped, "recovered", recovered);
+}
+
+/**
+ * Flush a log: wake the writer thread to write out everything buffered
+ * for log ndx, including the partly filled active page, and get it
+ * onto the disk.  If wait is true, the default, we block, with the GIL
+ * released, until that is done, and return 0 or -1 if a write or sync
+ * failed; otherwise we return 0 at once.
+ */
+PyObject* flush_cft_log(PyObject* self, PyObject* args, PyObject* kwargs) {
+    static char* kwlist[] = {"ndx", "wait", NULL};
+    int ndx;
+    int wait = true;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|p", kwlist,
+                                                            &ndx, &wait))
+        return NULL;
+    cFTLogDesc_t* d = _use_log(ndx);
+    if (d == NULL)
+        return NULL;
+    int status;
+    Py_BEGIN_ALLOW_THREADS
+    status = _flush_cft_log(d, wait, true);
+    _release_log(d);
+    Py_END_ALLOW_THREADS
+    return Py_BuildValue("i", status);
+}
+int _flush_cft_log(cFTLogDesc_t* d, const bool wait, const bool sync) {
+    int status = 0;
+    if (d->mgr->forked)
+        return -1;                      // no writer to wait for
+
+    pthread_mutex_lock(&d->logBufLock);
+    u_int64_t request = requestFlush(d, sync);
+    if (wait) {
+        while ((int64_t)(d->flushDone - request) < 0)
+            pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+        status = d->flushStatus;
+    }
+    pthread_mutex_unlock(&d->logBufLock);
+    return status;
+}
+
+/**
+ * Write a batch of log messages.
+ *
+ * Parameters are the log index (ndx) and an iterable of properly
+ * terminated messages.  The whole batch is appended to the log's
+ * buffers under a single acquisition of the buffer lock, with the GIL
+ * released while the messages are copied.
+ */
+PyObject* log_msgs(PyObject* self, PyObject* args) {
+    int         ndx;
+    PyObject*   iterable;
+
+    if (!PyArg_ParseTuple(args, "iO", &ndx, &iterable))
+        return NULL;
+    if (_log_msg_seq(ndx, iterable) < 0)
+        return NULL;
+    Py_RETURN_NONE;
+}
+
+/**
+ * Convert an iterable of messages into a C array and hand it to
+ * _log_msgs() for log ndx.  Each message may be a str, logged in UTF-8,
+ * or any bytes-like object.  Returns 0 on success; on failure returns
+ * -1 with a Python exception set.
+ *
+ * We take our own list of the messages and hold a buffer view of each,
+ * so that they stay alive and unresized while the GIL is released,
+ * whatever other threads do to the iterable.  The log is taken only
+ * once they are gathered: consuming the iterable runs Python code,
+ * which may close the log, and close_cft_log() waits for its users.
+ */
+int _log_msg_seq(const int ndx, PyObject* iterable) {
+    PyObject* seq = PySequence_List(iterable);
+    if (seq == NULL)
+        return -1;
+    Py_ssize_t   n     = PyList_GET_SIZE(seq);
+    Py_buffer*   views = PyMem_New(Py_buffer, n + 1);
+    const char** msgs  = PyMem_New(const char*, n + 1);
+    Py_ssize_t*  lens  = PyMem_New(Py_ssize_t, n + 1);
+    Py_ssize_t   i     = 0;
+    int          status = -1;
+    if (views == NULL || msgs == NULL || lens == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    for (i = 0; i < n; i++) {
+        PyObject* item = PyList_GET_ITEM(seq, i);
+        if (PyUnicode_Check(item)) {
+            Py_ssize_t size;
+            const char* utf8 = PyUnicode_AsUTF8AndSize(item, &size);
+            if (utf8 == NULL ||
+                    PyBuffer_FillInfo(&views[i], item, (void*)utf8, size,
+                                                    1, PyBUF_SIMPLE) < 0)
+                goto done;
+        } else if (PyObject_GetBuffer(item, &views[i], PyBUF_SIMPLE) < 0) {
+            PyErr_Format(PyExc_TypeError,
+                    "log message must be str or bytes-like, not %.200s",
+                    Py_TYPE(item)->tp_name);
+            goto done;
+        }
+        msgs[i] = views[i].buf;
+        lens[i] = views[i].len;
+    }
+    cFTLogDesc_t* d = _use_log(ndx);
+    if (d == NULL)
+        goto done;
+    Py_BEGIN_ALLOW_THREADS
+    _log_msgs(d, msgs, lens, n);
+    _release_log(d);
+    Py_END_ALLOW_THREADS
+    status = 0;
+
+done:
+    // i is the number of views successfully acquired
+    while (i-- > 0)
+        PyBuffer_Release(&views[i]);
+    PyMem_Free(views);
+    PyMem_Free(msgs);
+    PyMem_Free(lens);
+    Py_DECREF(seq);
+    return status;
+}
+
+/**
+ * Make some READY page the active page.  Returns a pointer to the new
+ * active page or NULL if no page is READY.  The caller must hold
+ * logBufLock.
+ */
+static logBufDesc_t* nextActivePage(cFTLogDesc_t* d) {
+    u_int32_t i;
+    for (i = 0; i < d->bufCount; i++) {
+        // start with the page after the one in use
+        u_int32_t n = (d->bufInUse + 1 + i) % d->bufCount;
+        logBufDesc_t* p = &d->logBufDescs[n];
+        if (p->flags == READY_BUF) {
+            p->flags    = ACTIVE_BUF;
+            p->seq      = d->nextSeq++;
+            d->bufInUse = n;
+            return p;
+        }
+    }
+    return NULL;
+}
+
+/**
+ * Return the number of bytes which could be copied into the ring
+ * without waiting for the writer thread.  The caller must hold
+ * logBufLock.
+ */
+static u_int64_t freeBytes(cFTLogDesc_t* d) {
+    u_int64_t free = 0;
+    u_int32_t i;
+    for (i = 0; i < d->bufCount; i++) {
+        logBufDesc_t* p = &d->logBufDescs[i];
+        if (p->flags == READY_BUF)
+            free += p->pageBytes;
+        else if (p->flags == ACTIVE_BUF && i == d->bufInUse)
+            free += p->pageBytes - p->offset;
+    }
+    return free;
+}
+
+/**
+ * Copy a message into the active page of the descriptor, moving on to
+ * the next page if it will not fit.  The caller must hold logBufLock.
+ *
+ * A message larger than a page is spread over as many pages as it
+ * needs; other producers wait until it has been copied in full, so
+ * that the pages, written out in order, hold it unbroken.
+ *
+ * If no page is free, what happens depends on the log's policy: we
+ * wait on bufFreed until the writer thread has written some pages out,
+ * add a page to the ring, or drop the message.  Returns 0 if the
+ * message was copied, -1 if it was dropped.
+ */
+static int appendMsg(cFTLogDesc_t* d, const char* msg, u_int32_t len) {
+    // wait for any message spanning several pages to be completed
+    while (d->spanning)
+        pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+
+    if (len > d->bufSize) {
+        // a message which can never be completed is dropped whole
+        if (d->policy == DROP_ON_FULL && freeBytes(d) < len) {
+            d->droppedCount++;
+            wakeWriter(d);
+            return -1;
+        }
+        d->spanning = true;
+        d->spanner  = pthread_self();
+    }
+    logBufDesc_t* p = &d->logBufDescs[d->bufInUse];
+    while (len > 0) {
+        u_int32_t room = p->flags == ACTIVE_BUF ? p->pageBytes - p->offset
+                                                : 0;
+        if (room > 0 && (len <= room || d->spanning)) {
+            // write msg to active page and update offset; NOT null-terminated
+            u_int32_t n = len < room ? len : room;
+            memcpy(p->data + p->offset, msg, n);
+            p->offset += n;
+            msg       += n;
+            len       -= n;
+            p->split   = len > 0;
+            continue;
+        }
+        // if msg will not fit, mark current page as FULL, find next
+        // available page, and mark that ACTIVE.
+        if (p->flags == ACTIVE_BUF) {
+            p->flags = FULL_BUF;
+            if (++d->fullCount == d->highWater)
+                wakeWriter(d);
+        }
+        logBufDesc_t* next = nextActivePage(d);
+        if (next != NULL) {
+            p = next;
+            continue;
+        }
+        // there is no free page: the writer has fallen behind
+        if (d->policy == DROP_ON_FULL && !d->spanning) {
+            d->droppedCount++;
+            wakeWriter(d);
+            return -1;
+        }
+        if (d->policy == GROW_ON_FULL && growLogBuffers(d) >= 0)
+            continue;
+        // BLOCK_ON_FULL, or the ring cannot grow any further
+        d->blockedCount++;
+        wakeWriter(d);
+        pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+        // a message spanning pages which another producer started
+        // while we waited must be completed first
+        while (d->spanning && !pthread_equal(d->spanner, pthread_self()))
+            pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+        p = &d->logBufDescs[d->bufInUse];
+    }
+    if (d->spanning) {
+        d->spanning = false;
+        pthread_cond_broadcast(&d->bufFreed);
+    }
+    return 0;
+}
+
+/** Copy a message into a log's pages, holding its lock. */
+static void _log_msg_locked(cFTLogDesc_t* d, const char* msg, u_int32_t len) {
     // get the mutex
-    pthread_mutex_lock(&logDescs[ndx]->logBufLock);
-
-    // if msg will not fit, mark current page as FULL, find next
-    // available page, and mark that ACTIVE.
-    logBufDesc_t* p = &logDescs[ndx]->logBufDescs[logDescs[ndx]->bufInUse];
-    if (p->offset + len >= p->pageBytes) {
-        p->flags    = FULL_BUF;
-//          // DEBUG
-//          printf("buffer %d at offset %d is FULL\n",
-//                      logDescs[ndx]->bufInUse, p->offset);
-//          fflush(stdout);
-//          // END
-        logDescs[ndx]->bufInUse =
-                    (logDescs[ndx]->bufInUse + 1) % C_FT_LOG_BUF_COUNT;
-        /* RISK OF INFINITE LOOP */
-        // XXX This risk is real: we sometimes get an infinite loop
-        for (p = &logDescs[ndx]->logBufDescs[logDescs[ndx]->bufInUse];
-                    p->flags != READY_BUF;
-                    p = &logDescs[ndx]->logBufDescs[logDescs[ndx]->bufInUse] )
-            logDescs[ndx]->bufInUse =
-                    (logDescs[ndx]->bufInUse + 1) % C_FT_LOG_BUF_COUNT;
-    }
-    // write msg to active page and update offset; NOT null-terminated
-    memcpy(p->data + p->offset, msg, len);
-    p->offset += len;
+    pthread_mutex_lock(&d->logBufLock);
 
     // step the message count and release the mutex
-    logDescs[ndx]->count++;
-    pthread_mutex_unlock(&logDescs[ndx]->logBufLock);
+    if (appendMsg(d, msg, len) == 0)
+        d->count++;
+    pthread_mutex_unlock(&d->logBufLock);
+}
+
+/** Count a message dropped for want of memory to frame it in. */
+static void _frame_dropped(cFTLogDesc_t* d) {
+    pthread_mutex_lock(&d->logBufLock);
+    d->droppedCount++;
+    pthread_mutex_unlock(&d->logBufLock);
+}
+
+/**
+ * Copy a message into a log by whichever path takes it: a log with a
+ * lock-free byte ring or per-thread staging buffers takes the lock
+ * only for a message too large for them.
+ */
+static void _log_one(cFTLogDesc_t* d, const char* msg, u_int32_t len) {
+    if (d->mpsc != NULL && mpscPut(d, msg, len) >= 0)
+        return;
+    if (d->threadBufs && stageMsg(d, msg, len) >= 0)
+        return;
+    _log_msg_locked(d, msg, len);
+}
+
+/**
+ * Low-level write a log message function.  d is the descriptor of the
+ * log, which the caller is using.  msg is a message of len bytes, which
+ * need not be null-terminated.  A framed log's message is first framed
+ * as a record, on the stack if it is small enough.
+ */
+void _log_msg(cFTLogDesc_t* d, const char* msg, Py_ssize_t len) {
+    if (!d->framed) {
+        _log_one(d, msg, (u_int32_t)len);
+        return;
+    }
+    unsigned char  stack[FRAME_ON_STACK];
+    unsigned char* frame = FRAME_HDR_SIZE + len <= FRAME_ON_STACK ?
+                                stack : malloc(FRAME_HDR_SIZE + len);
+    if (frame == NULL) {
+        _frame_dropped(d);
+        return;
+    }
+    _log_one(d, (const char*)frame,
+                        (u_int32_t)frameMsg(frame, msg, (u_int32_t)len));
+    if (frame != stack)
+        free(frame);
+}
+
+/** Log a batch of messages, as _log_msgs() describes below. */
+static void _log_batch(cFTLogDesc_t* d, const char** msgs,
+                                const Py_ssize_t* lens, Py_ssize_t n) {
+    Py_ssize_t i;
+
+    if (d->mpsc != NULL) {
+        for (i = 0; i < n; i++)
+            if (mpscPut(d, msgs[i], (u_int32_t)lens[i]) < 0)
+                _log_msg_locked(d, msgs[i], (u_int32_t)lens[i]);
+        return;
+    }
+    if (d->threadBufs) {
+        for (i = 0; i < n; i++)
+            if (stageMsg(d, msgs[i], (u_int32_t)lens[i]) < 0)
+                _log_msg_locked(d, msgs[i], (u_int32_t)lens[i]);
+        return;
+    }
+
+    pthread_mutex_lock(&d->logBufLock);
+    for (i = 0; i < n; i++)
+        if (appendMsg(d, msgs[i], (u_int32_t)lens[i]) == 0)
+            d->count++;
+    pthread_mutex_unlock(&d->logBufLock);
+}
+
+/**
+ * Frame a batch of messages for a framed log, end to end in one block,
+ * and log them as a batch.  If the block cannot be had, they are
+ * framed and logged one by one instead.
+ */
+static void _log_framed(cFTLogDesc_t* d, const char** msgs,
+                                const Py_ssize_t* lens, Py_ssize_t n) {
+    size_t total = 0;
+    Py_ssize_t i;
+    for (i = 0; i < n; i++)
+        total += FRAME_HDR_SIZE + lens[i];
+    unsigned char* frames = malloc(total);
+    const char**   fmsgs  = malloc(n * sizeof(const char*));
+    Py_ssize_t*    flens  = malloc(n * sizeof(Py_ssize_t));
+    if (frames != NULL && fmsgs != NULL && flens != NULL) {
+        unsigned char* at = frames;
+        for (i = 0; i < n; i++) {
+            fmsgs[i] = (const char*)at;
+            flens[i] = frameMsg(at, msgs[i], (u_int32_t)lens[i]);
+            at      += flens[i];
+        }
+        _log_batch(d, fmsgs, flens, n);
+    } else
+        for (i = 0; i < n; i++)
+            _log_msg(d, msgs[i], lens[i]);
+    free(frames);
+    free(fmsgs);
+    free(flens);
+}
+
+/**
+ * Low-level write of n messages with a single acquisition of the
+ * buffer lock.  msgs[i] is a message of lens[i] bytes, which need not
+ * be null-terminated.  A log with a lock-free byte ring or per-thread
+ * staging buffers takes them one by one instead.
+ */
+void _log_msgs(cFTLogDesc_t* d, const char** msgs, const Py_ssize_t* lens,
+                                                        Py_ssize_t n) {
+    if (d->framed)
+        _log_framed(d, msgs, lens, n);
+    else
+        _log_batch(d, msgs, lens, n);
+}
+
+// SHARED-MEMORY RINGS //////////////////////////////////////////////
+
+/** Unmap a producer's ring when the last reference to it goes. */
+static void freeShmCapsule(PyObject* capsule) {
+    shmRingRef_t* ref = PyCapsule_GetPointer(capsule, SHM_RING_CAPSULE);
+    if (ref != NULL) {
+        munmap(ref->hdr, ref->bytes);
+        PyMem_Free(ref);
+    }
+}
+
+/**
+ * Return the ring in the capsule obj, or NULL with a Python exception
+ * set if it is not one made by attach_cft_shm().
+ */
+static shmRingRef_t* _get_shm(PyObject* obj) {
+    if (!PyCapsule_IsValid(obj, SHM_RING_CAPSULE)) {
+        PyErr_SetString(PyExc_TypeError,
+                            "expected a ring made by attach_cft_shm()");
+        return NULL;
+    }
+    return PyCapsule_GetPointer(obj, SHM_RING_CAPSULE);
+}
+
+/**
+ * Attach to the shared-memory ring of a log opened, perhaps by another
+ * process, with shm_name name, and return it wrapped in a capsule for
+ * shm_log_msg().  policy is what to do when the ring is full: wait for
+ * the log's writer to empty it, BLOCK_ON_FULL, the default, or drop the
+ * message, DROP_ON_FULL.  Raises OSError if there is no such ring.
+ */
+PyObject* attach_cft_shm(PyObject* self, PyObject* args, PyObject* kwargs) {
+    static char* kwlist[] = {"name", "policy", NULL};
+    const char* name;
+    int policy = BLOCK_ON_FULL;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s|i", kwlist,
+                                                        &name, &policy))
+        return NULL;
+    if (policy != BLOCK_ON_FULL && policy != DROP_ON_FULL) {
+        PyErr_SetString(PyExc_ValueError,
+                        "policy must be BLOCK_ON_FULL or DROP_ON_FULL");
+        return NULL;
+    }
+    shmRingRef_t* ref = PyMem_Malloc(sizeof(shmRingRef_t));
+    if (ref == NULL)
+        return PyErr_NoMemory();
+    ref->hdr = attachShmRing(name, &ref->bytes);
+    if (ref->hdr == NULL) {
+        PyMem_Free(ref);
+        return PyErr_SetFromErrnoWithFilename(PyExc_OSError, name);
+    }
+    ref->policy = policy;
+    PyObject* capsule = PyCapsule_New(ref, SHM_RING_CAPSULE, freeShmCapsule);
+    if (capsule == NULL) {
+        munmap(ref->hdr, ref->bytes);
+        PyMem_Free(ref);
+    }
+    return capsule;
+}
+
+/**
+ * Log a message through a ring made by attach_cft_shm(): msg, any
+ * bytes-like object, or its first nbytes bytes.  The message is copied
+ * into the ring with the GIL released, without taking any lock.
+ * Returns True if it was logged, False if it was dropped because the
+ * ring was full.  Raises ValueError if it will not fit in a slot or the
+ * log has been closed.
+ */
+PyObject* shm_log_msg(PyObject* self, PyObject* args) {
+    PyObject*   obj;
+    Py_buffer   msg;
+    Py_ssize_t  nbytes = -1;
+    if (!PyArg_ParseTuple(args, "Os*|n", &obj, &msg, &nbytes))
+        return NULL;
+    shmRingRef_t* ref = _get_shm(obj);
+    Py_ssize_t len = ref == NULL ? -1 : _msg_len(&msg, nbytes);
+    if (len < 0) {
+        PyBuffer_Release(&msg);
+        return NULL;
+    }
+    int status;
+    Py_BEGIN_ALLOW_THREADS
+    status = shmPut(ref->hdr, msg.buf, len, ref->policy);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&msg);
+    if (status == -2) {
+        PyErr_Format(PyExc_ValueError,
+                "message length %zd exceeds the ring's slots of %u bytes",
+                len, ref->hdr->slotSize - SHM_SLOT_HDR);
+        return NULL;
+    }
+    if (status == -1) {
+        PyErr_SetString(PyExc_ValueError, "log has been closed");
+        return NULL;
+    }
+    return PyBool_FromLong(status == 0);
+}
+
+/**
+ * Return a dict describing a ring made by attach_cft_shm(): its
+ * 'slots' and the most a slot will hold, 'slot_bytes'; the messages
+ * logged into it so far, 'head', and written out, 'tail'; those
+ * 'dropped' and the times producers have had to wait, 'waits', because
+ * it was full; and whether its log has been 'closed'.
+ */
+PyObject* shm_stats(PyObject* self, PyObject* args) {
+    PyObject* obj;
+    if (!PyArg_ParseTuple(args, "O", &obj))
+        return NULL;
+    shmRingRef_t* ref = _get_shm(obj);
+    if (ref == NULL)
+        return NULL;
+    shmRingHdr_t* h = ref->hdr;
+    return Py_BuildValue("{s:I,s:I,s:K,s:K,s:K,s:K,s:K,s:O}",
+            "slots", h->slotCount, "slot_bytes", h->slotSize - SHM_SLOT_HDR,
+            "head", (unsigned long long)atomic_load(&h->head),
+            "tail", (unsigned long long)atomic_load(&h->tail),
+            "dropped", (unsigned long long)atomic_load(&h->dropped),
+            "waits", (unsigned long long)atomic_load(&h->waits),
+            "errors", (unsigned long long)atomic_load(&h->errors),
+            "closed", atomic_load(&h->closed) ? Py_True : Py_False);
+}
+
+// FRAMED RECORDS ///////////////////////////////////////////////////
+
+/**
+ * Return the CRC32C of a bytes-like object, continuing from crc, the
+ * CRC32C of whatever came before it, by default 0.
+ */
+PyObject* crc32c_of(PyObject* self, PyObject* args) {
+    Py_buffer    data;
+    unsigned int crc = 0;
+    if (!PyArg_ParseTuple(args, "y*|I", &data, &crc))
+        return NULL;
+    Py_BEGIN_ALLOW_THREADS
+    crc = crc32c(crc, data.buf, data.len);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&data);
+    return PyLong_FromUnsignedLong(crc);
+}
+
+/**
+ * Check the records of a framed log, held in a bytes-like object such
+ * as an mmap, from offset, by default 0: each is checked against its
+ * CRC in turn, without the GIL, until one is found torn or corrupt, or
+ * the data runs out.  Returns a tuple of the offset just past the last
+ * good record and the number of good records.
+ */
+PyObject* scan_frames(PyObject* self, PyObject* args) {
+    Py_buffer  data;
+    Py_ssize_t start = 0;
+    if (!PyArg_ParseTuple(args, "y*|n", &data, &start))
+        return NULL;
+    if (start < 0 || start > data.len) {
+        PyBuffer_Release(&data);
+        PyErr_SetString(PyExc_ValueError, "offset out of range");
+        return NULL;
+    }
+    size_t    end;
+    u_int64_t records;
+    Py_BEGIN_ALLOW_THREADS
+    end = scanFrames(data.buf, data.len, start, &records);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&data);
+    return Py_BuildValue("(nK)", (Py_ssize_t)end,
+                                            (unsigned long long)records);
 }
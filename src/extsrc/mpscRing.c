@@ -0,0 +1,193 @@
+/* ~/dev/py/xlutil_py/src/extsrc/mpscRing.c */
+
+#include "cFTLogForPy.h"
+
+// LOCK-FREE BYTE RING //////////////////////////////////////////////
+// The ENGINE_MPSC alternative to a log's pages: producers reserve
+// space with a fetch-and-add and commit each record by storing its
+// header; only the writer thread consumes: see mpscRing_t.
+
+#define MPSC_ROUND(n)   (((n) + MPSC_ALIGN - 1) & ~(u_int64_t)(MPSC_ALIGN - 1))
+
+// a record's header: never zero, so that a zeroed header means that
+// the record has not been committed
+#define MPSC_HEADER(len)    (((u_int64_t)(len) << 1) | 1)
+#define MPSC_LEN(header)    ((u_int32_t)((header) >> 1))
+
+/** Return the header of the record at ring position pos. */
+static inline atomic_uint_least64_t*
+headerAt(mpscRing_t* r, u_int64_t pos) {
+    return (atomic_uint_least64_t*)(r->data + (pos & (r->size - 1)));
+}
+
+/**
+ * Give a newly opened log a byte ring instead of pages, if its options
+ * ask for ENGINE_MPSC.  The ring's size is rounded up to a power of
+ * two.  A log shared with child processes, or staging messages per
+ * thread, cannot have one.  Returns 0 or -1.
+ */
+int
+initMpscRing(cFTLogDesc_t* d, const cFTLogOpts_t* opts) {
+    if (opts->engine == ENGINE_PAGES)
+        return 0;
+    if (opts->engine != ENGINE_MPSC || d->shared || d->threadBufs ||
+                opts->ringSize < MIN_MPSC_RING_SIZE ||
+                opts->ringSize > MAX_MPSC_RING_SIZE)
+        return -1;
+    u_int32_t size = MIN_MPSC_RING_SIZE;
+    while (size < opts->ringSize)
+        size <<= 1;
+    mpscRing_t* r = aligned_alloc(64, (sizeof(mpscRing_t) + 63) & ~(size_t)63);
+    if (r == NULL)
+        return -1;
+    memset(r, 0, sizeof(mpscRing_t));
+    r->size    = size;
+    r->data    = calloc(size, 1);       // every header uncommitted
+    r->scratch = malloc(size);
+    d->mpsc    = r;
+    return r->data == NULL || r->scratch == NULL ? -1 : 0;
+}
+
+/** Free a log's byte ring, if it has one.  Called holding the GIL. */
+void
+freeMpscRing(cFTLogDesc_t* d) {
+    if (d->mpsc != NULL) {
+        free(d->mpsc->data);
+        free(d->mpsc->scratch);
+        free(d->mpsc);
+        d->mpsc = NULL;
+    }
+}
+
+/**
+ * In a child process, empty a log's byte ring, if it has one.  What
+ * was committed to it before the fork is the parent's to write, and a
+ * record reserved by another of the parent's threads would never be
+ * committed here, stopping the child's drain for good.  Called from
+ * the pthread_atfork() child handler.
+ */
+void
+resetMpscRing(cFTLogDesc_t* d) {
+    mpscRing_t* r = d->mpsc;
+    if (r == NULL)
+        return;
+    memset(r->data, 0, r->size);
+    atomic_store_explicit(&r->reserve, 0, memory_order_relaxed);
+    atomic_store_explicit(&r->tail,    0, memory_order_relaxed);
+}
+
+/**
+ * Copy a message into a log's byte ring without taking a lock.  The
+ * space is reserved first; if the ring cannot yet hold it, because the
+ * writer has fallen behind, the producer takes logBufLock, wakes the
+ * writer and waits on bufFreed.  A producer whose log's policy is
+ * DROP_ON_FULL instead drops a message which it sees will not fit
+ * before reserving space for it.  Returns 0 if the message was
+ * committed, 1 if it was dropped, or -1 if it is more than half the
+ * size of the ring and should go into the log's pages instead.
+ */
+int
+mpscPut(cFTLogDesc_t* d, const char* msg, u_int32_t len) {
+    mpscRing_t* r = d->mpsc;
+    u_int64_t need = MPSC_ALIGN + MPSC_ROUND((u_int64_t)len);
+    if (need > r->size / 2)
+        return -1;
+    if (d->policy == DROP_ON_FULL &&
+            atomic_load_explicit(&r->reserve, memory_order_relaxed) + need -
+            atomic_load_explicit(&r->tail, memory_order_acquire) > r->size) {
+        pthread_mutex_lock(&d->logBufLock);
+        d->droppedCount++;
+        wakeWriter(d);
+        pthread_mutex_unlock(&d->logBufLock);
+        return 1;
+    }
+    u_int64_t pos = atomic_fetch_add_explicit(&r->reserve, need,
+                                                    memory_order_relaxed);
+    if (pos + need - atomic_load_explicit(&r->tail, memory_order_acquire)
+                                                                > r->size) {
+        pthread_mutex_lock(&d->logBufLock);
+        d->blockedCount++;
+        while (pos + need - atomic_load_explicit(&r->tail,
+                                    memory_order_acquire) > r->size) {
+            wakeWriter(d);
+            pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+        }
+        pthread_mutex_unlock(&d->logBufLock);
+    }
+    // the header never straddles the end of the ring; the message may
+    u_int32_t off  = (pos + MPSC_ALIGN) & (r->size - 1);
+    u_int32_t part = len < r->size - off ? len : r->size - off;
+    memcpy(r->data + off, msg, part);
+    memcpy(r->data, msg + part, len - part);
+    atomic_store_explicit(headerAt(r, pos), MPSC_HEADER(len),
+                                                    memory_order_release);
+    return 0;
+}
+
+/**
+ * Consume the records committed to a log's byte ring, in order, up to
+ * the first not yet committed and at most one lap of the ring: copy
+ * their messages end to end into the scratch buffer and write that
+ * out in one call.  Then zero the space consumed, so that its headers
+ * read as uncommitted on the next lap, hand it back to the producers
+ * and wake any waiting for it.  Like drainShmRing(), skipped while the
+ * file is in the middle of a message split across pages.  Sets *bytes
+ * to the number of bytes written, for syncLog().  Runs in the writer
+ * thread.  Returns 0 or -1 if the write failed.
+ */
+int
+drainMpscRing(cFTLogDesc_t* d, size_t* bytes) {
+    mpscRing_t* r = d->mpsc;
+    *bytes = 0;
+    if (r == NULL || d->midMessage)
+        return 0;
+
+    u_int32_t mask  = r->size - 1;
+    u_int64_t start = atomic_load_explicit(&r->tail, memory_order_relaxed);
+    u_int64_t tail  = start;
+    u_int64_t msgs  = 0;
+    size_t    out   = 0;
+    while (tail - start < r->size) {
+        u_int64_t header = atomic_load_explicit(headerAt(r, tail),
+                                                    memory_order_acquire);
+        if (header == 0)
+            break;
+        u_int32_t len  = MPSC_LEN(header);
+        u_int32_t off  = (tail + MPSC_ALIGN) & mask;
+        u_int32_t part = len < r->size - off ? len : r->size - off;
+        memcpy(r->scratch + out, r->data + off, part);
+        memcpy(r->scratch + out + part, r->data, len - part);
+        out  += len;
+        tail += MPSC_ALIGN + MPSC_ROUND((u_int64_t)len);
+        msgs++;
+    }
+    if (msgs == 0)
+        return 0;
+
+    int status = 0;
+    struct iovec iov = {r->scratch, out};
+    int calls = writeAll(d->fd, &iov, 1);
+    if (calls < 0) {
+        perror("drainMpscRing, writing to disk");
+        status = -1;
+        calls  = 0;
+    }
+    // clear what was consumed before the producers may reuse it
+    u_int32_t off  = start & mask;
+    u_int64_t used = tail - start;
+    u_int32_t part = used < r->size - off ? used : r->size - off;
+    memset(r->data + off, 0, part);
+    memset(r->data, 0, used - part);
+    atomic_store_explicit(&r->tail, tail, memory_order_release);
+    *bytes = out;
+    d->fileBytes += out;
+
+    pthread_mutex_lock(&d->logBufLock);
+    d->count      += msgs;
+    d->writeCalls += calls;
+    if (!status)
+        d->bytesWritten += out;
+    pthread_cond_broadcast(&d->bufFreed);
+    pthread_mutex_unlock(&d->logBufLock);
+    return status;
+}
@@ -0,0 +1,214 @@
+/* ~/dev/py/xlutil_py/src/extsrc/ringFile.c */
+
+#include "cFTLogForPy.h"
+
+#include <sys/file.h>   // flock
+
+// RECOVERABLE PAGES ////////////////////////////////////////////////
+// A recoverable log keeps its pages, and their descriptors, in a file
+// mapped MAP_SHARED next to the log: see ringFileHdr_t.  Producers and
+// the writer change them in memory, as they would on the heap, and
+// the kernel keeps what they wrote if the process dies, so that the
+// next open of the log can append whatever was not yet written out.
+
+/** Round n up to a multiple of the system page size. */
+static size_t
+roundToPage(size_t n) {
+    size_t page = sysconf(_SC_PAGESIZE);
+    return (n + page - 1) / page * page;
+}
+
+/** Return where in a ring file of count descriptors the pages start. */
+static size_t
+pagesOffset(u_int32_t count) {
+    return roundToPage(RING_FILE_HDR_SIZE +
+                                    (size_t)count * sizeof(logBufDesc_t));
+}
+
+/**
+ * Append to a log what an earlier run left unwritten in its ring file,
+ * mapped at hdr, bytes long: the pages which were FULL, ACTIVE or
+ * being written when it died, in the order in which they were filled.
+ * If the log is shorter than the end of the write that was in progress,
+ * that write did not complete, and the log is first cut back to where
+ * it began; otherwise the pages being written are already in the log.
+ * Sets d->recovered.  Returns 0 or -1.
+ */
+static int
+recoverPages(cFTLogDesc_t* d, const ringFileHdr_t* hdr, size_t bytes) {
+    if (bytes < RING_FILE_HDR_SIZE || hdr->magic != RING_FILE_MAGIC ||
+            hdr->version != RING_FILE_VERSION ||
+            hdr->descSize != sizeof(logBufDesc_t) ||
+            hdr->bufCount > MAX_LOG_BUF_COUNT ||
+            bytes < pagesOffset(hdr->bufCount) +
+                                (size_t)hdr->bufCount * hdr->bufSize)
+        return 0;                       // nothing we can use
+    const logBufDesc_t* descs =
+                (const logBufDesc_t*)((const char*)hdr + RING_FILE_HDR_SIZE);
+    const unsigned char* pages =
+                (const unsigned char*)hdr + pagesOffset(hdr->bufCount);
+
+    // the log's logical end, which is its size unless it is preallocated
+    u_int64_t size = d->fileBytes;
+    bool rewrite = size < hdr->flushEnd;
+
+    u_int32_t* order = calloc(hdr->bufCount + 1, sizeof(u_int32_t));
+    struct iovec* iov = calloc(hdr->bufCount + 1, sizeof(struct iovec));
+    if (order == NULL || iov == NULL) {
+        free(order);
+        free(iov);
+        return -1;
+    }
+    u_int32_t i, j, n = 0;
+    bool cut = false;
+    for (i = 0; i < hdr->bufCount; i++) {
+        const logBufDesc_t* p = descs + i;
+        if (p->offset == 0 || p->offset > hdr->bufSize ||
+                (p->flags != FULL_BUF && p->flags != ACTIVE_BUF &&
+                 p->flags != BEING_WRITTEN))
+            continue;
+        if (p->flags == BEING_WRITTEN) {
+            if (!rewrite)
+                continue;
+            cut = true;
+        }
+        for (j = n; j > 0 &&
+                    (int32_t)(descs[order[j-1]].seq - p->seq) > 0; j--)
+            order[j] = order[j-1];
+        order[j] = i;
+        n++;
+    }
+    size_t total = 0;
+    for (i = 0; i < n; i++) {
+        iov[i].iov_base = (void*)(pages + (size_t)order[i] * hdr->bufSize);
+        iov[i].iov_len  = descs[order[i]].offset;
+        total += iov[i].iov_len;
+    }
+    int status = 0;
+    // a log shorter than where the write began is another file
+    if (cut && size > hdr->flushStart) {
+        if (ftruncate(d->fd, hdr->flushStart) ||
+                lseek(d->fd, hdr->flushStart, SEEK_SET) < 0)
+            status = -1;
+        size = hdr->flushStart;
+        if (d->allocEnd > size)
+            d->allocEnd = size;
+    }
+    // and what was recovered must be on the disk before the ring file,
+    // the only other copy, is emptied
+    if (!status && n > 0 &&
+            (writeAll(d->fd, iov, n) < 0 || fdatasync(d->fd)))
+        status = -1;
+    if (!status && n > 0) {
+        d->fileBytes = size + total;
+        d->recovered = total;
+    }
+    free(order);
+    free(iov);
+    return status;
+}
+
+/**
+ * Give a recoverable log its pages and descriptors in a file named for
+ * the log with RING_FILE_EXT added, count pages of d->bufSize bytes,
+ * first appending to the log anything a crashed run left in it.  The
+ * file is locked, so that a second process cannot open the log
+ * recoverably while the first has it open.  Sets d->logBufDescs and
+ * *pages.  Called before the writer thread knows of the log.  Returns
+ * 0 or -1.
+ */
+int
+mapRingFile(cFTLogDesc_t* d, u_int32_t count, unsigned char** pages) {
+    snprintf(d->ringPath, sizeof(d->ringPath), "%s%c%s%s",
+                        d->logDir, PATH_SEP, d->logName, RING_FILE_EXT);
+    int fd = open(d->ringPath, O_CREAT | O_RDWR,
+                                S_IRUSR | S_IWUSR | S_IRGRP | S_IROTH);
+    if (fd < 0)
+        return -1;
+    if (flock(fd, LOCK_EX | LOCK_NB)) {
+        close(fd);
+        return -1;
+    }
+    struct stat info;
+    int status = fstat(fd, &info);
+    if (!status && info.st_size > 0) {
+        void* old = mmap(NULL, info.st_size, PROT_READ, MAP_SHARED, fd, 0);
+        if (old == MAP_FAILED)
+            status = -1;
+        else {
+            status = recoverPages(d, old, info.st_size);
+            munmap(old, info.st_size);
+        }
+    }
+    // start afresh, every byte zero, in the shape asked for
+    size_t bytes = pagesOffset(count) + (size_t)count * d->bufSize;
+    if (!status && (ftruncate(fd, 0) || ftruncate(fd, bytes)))
+        status = -1;
+    ringFileHdr_t* hdr = MAP_FAILED;
+    if (!status)
+        hdr = mmap(NULL, bytes, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    if (hdr == MAP_FAILED) {
+        close(fd);
+        return -1;
+    }
+    hdr->version   = RING_FILE_VERSION;
+    hdr->bufSize   = d->bufSize;
+    hdr->bufCount  = count;
+    hdr->descSize  = sizeof(logBufDesc_t);
+    hdr->magic     = RING_FILE_MAGIC;
+    d->ringFile    = hdr;
+    d->ringBytes   = bytes;
+    d->ringFd      = fd;
+    d->logBufDescs = (logBufDesc_t*)((char*)hdr + RING_FILE_HDR_SIZE);
+    *pages         = (unsigned char*)hdr + pagesOffset(count);
+    return 0;
+}
+
+/** Unmap a log's ring file and let go of its lock. */
+void
+unmapRingFile(cFTLogDesc_t* d) {
+    if (d->ringFile != NULL) {
+        munmap(d->ringFile, d->ringBytes);
+        close(d->ringFd);
+        d->ringFile    = NULL;
+        d->logBufDescs = NULL;
+    }
+}
+
+/**
+ * In a child process, replace the mapping of a log's ring file with
+ * private memory holding the same descriptors, so that what the child
+ * logs does not land in the parent's pages.  The child's pages are not
+ * recoverable, and it never removes the file.  Called from the
+ * pthread_atfork() child handler.
+ */
+void
+privatizeRingFile(cFTLogDesc_t* d) {
+    if (d->ringFile == NULL || d->ringPath[0] == '\0')
+        return;
+    size_t keep = pagesOffset(d->ringFile->bufCount);
+    void* copy = malloc(keep);
+    if (copy != NULL)
+        memcpy(copy, d->ringFile, keep);
+    if (copy == NULL || mmap(d->ringFile, d->ringBytes, PROT_READ |
+                PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS | MAP_FIXED, -1, 0)
+                                                        == MAP_FAILED) {
+        perror("privatizeRingFile");
+        abort();                        // we would corrupt the parent's
+    }
+    memcpy(d->ringFile, copy, keep);
+    free(copy);
+    close(d->ringFd);
+    d->ringFd      = -1;
+    d->ringPath[0] = '\0';
+}
+
+/**
+ * Remove a log's ring file once everything in it has been written out,
+ * when the log is closed.  Runs in the writer thread.
+ */
+void
+removeRingFile(cFTLogDesc_t* d) {
+    if (d->ringFile != NULL && d->ringPath[0] != '\0')
+        unlink(d->ringPath);
+}
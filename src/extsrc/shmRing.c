@@ -0,0 +1,333 @@
+/* ~/dev/py/xlutil_py/src/extsrc/shmRing.c */
+
+#include "cFTLogForPy.h"
+
+// SHARED-MEMORY RINGS ///////////////////////////////////////////////
+// A log opened with a shm_name also has a ring of slots in a POSIX
+// shared-memory object of that name, which any process may attach to
+// and log into without taking a lock or waking anyone: see shmRingHdr_t.
+// Only the writer thread of the process which opened the log reads the
+// ring, so there is a single consumer and any number of producers.
+
+// how many slots the writer gathers into one writev()
+#define SHM_IOV_BATCH   (256)
+
+/** Return the slot a position in the ring maps to. */
+static inline shmSlot_t*
+slotAt(shmRingHdr_t* h, u_int64_t pos) {
+    return (shmSlot_t*)((unsigned char*)h + SHM_RING_HDR_SIZE +
+                        (size_t)(pos & (h->slotCount - 1)) * h->slotSize);
+}
+
+/**
+ * Copy the name of a ring, with or without its leading slash, into buf as
+ * shm_open() wants it.  Returns 0, or -1 if the name is empty, too
+ * long or contains another slash.
+ */
+static int
+shmPath(const char* name, char* buf) {
+    if (*name == '/')
+        name++;
+    size_t len = strlen(name);
+    if (len == 0 || len > MAX_SHM_NAME || strchr(name, '/') != NULL)
+        return -1;
+    buf[0] = '/';
+    memcpy(buf + 1, name, len + 1);
+    return 0;
+}
+
+/**
+ * Create the shared-memory ring named in the options for a newly
+ * opened log and map it.  There must be no object of that name: it may
+ * be another log's ring, with producers attached, or one a crashed run
+ * left, which it is for the caller to remove.  The number of slots
+ * must be a power of two; the slot size, which includes the slot
+ * header, is rounded up to a whole number of cache lines.  Returns 0,
+ * or -1 if there is no ring to create or it cannot be.
+ */
+int
+openShmRing(cFTLogDesc_t* d, const cFTLogOpts_t* opts) {
+    u_int32_t slots = opts->shmSlots;
+    u_int32_t size  = (opts->shmSlotSize + 63) & ~63u;
+    if (slots < 2 || slots > (1u << 20) || (slots & (slots - 1)) ||
+            opts->shmSlotSize <= SHM_SLOT_HDR || size > MAX_LOG_BUFFER_SIZE)
+        return -1;
+    if (shmPath(opts->shmName, d->shmName) < 0)
+        return -1;
+    size_t bytes = SHM_RING_HDR_SIZE + (size_t)slots * size;
+
+    int fd = shm_open(d->shmName, O_CREAT | O_EXCL | O_RDWR, S_IRUSR | S_IWUSR);
+    if (fd < 0) {
+        perror("creating shared-memory ring");
+        return -1;
+    }
+    void* p = MAP_FAILED;
+    if (ftruncate(fd, bytes) == 0)
+        p = mmap(NULL, bytes, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (p == MAP_FAILED) {
+        perror("mapping shared-memory ring");
+        shm_unlink(d->shmName);
+        return -1;
+    }
+    // the object starts out zeroed
+    shmRingHdr_t* h = p;
+    h->slotCount = slots;
+    h->slotSize  = size;
+    u_int32_t i;
+    for (i = 0; i < slots; i++)
+        atomic_init(&slotAt(h, i)->seq, i);
+    h->version   = SHM_RING_VERSION;
+    // producers refuse the ring until this is seen
+    atomic_thread_fence(memory_order_release);
+    h->magic     = SHM_RING_MAGIC;
+    d->shmRing   = h;
+    d->shmBytes  = bytes;
+    return 0;
+}
+
+/**
+ * Unmap a log's shared-memory ring.  In the process which created it,
+ * the ring is also marked closed, so that producers stop logging into it, and
+ * unlinked.  Called holding the GIL, when the log is freed.
+ */
+void
+closeShmRing(cFTLogDesc_t* d) {
+    if (d->shmRing == NULL)
+        return;
+    if (d->owner == getpid()) {
+        atomic_store(&d->shmRing->closed, 1);
+        shm_unlink(d->shmName);
+    }
+    munmap(d->shmRing, d->shmBytes);
+    d->shmRing = NULL;
+}
+
+/**
+ * Decide whether pos, the first slot of a ring not yet published, was
+ * claimed by a producer which will never publish it, as one which died
+ * in between: whether the writer has seen it claimed and unpublished
+ * for SHM_STALL_NANOS.  If so, take it back for the producers' next
+ * lap, counting an error.  A producer which was only slow then finds
+ * its slot gone and drops its message, but one stalled that long in
+ * the middle of copying it in may spoil the message of the producer
+ * which claims the slot next.  Returns true if the slot was skipped.
+ */
+static bool
+skipStalled(cFTLogDesc_t* d, shmRingHdr_t* h, u_int64_t pos) {
+    if (atomic_load_explicit(&h->head, memory_order_relaxed) <= pos) {
+        d->shmStalled = false;          // not claimed: simply empty
+        return false;
+    }
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    if (!d->shmStalled || d->shmStallPos != pos) {
+        d->shmStalled    = true;
+        d->shmStallPos   = pos;
+        d->shmStallSince = now;
+        return false;
+    }
+    if (nanosBetween(&d->shmStallSince, &now) < SHM_STALL_NANOS)
+        return false;
+    u_int64_t claimed = pos;
+    if (!atomic_compare_exchange_strong(&slotAt(h, pos)->seq, &claimed,
+                                                    pos + h->slotCount))
+        return false;                   // published after all
+    atomic_fetch_add(&h->errors, 1);
+    d->shmStalled = false;
+    return true;
+}
+
+/**
+ * Write out, in order, the messages published in a log's shared-memory
+ * ring since the last drain, at most one lap of the ring, gathering them into as
+ * few writev() calls as possible, and hand their slots back to the
+ * producers.  A length too large for its slot, which no producer of
+ * ours writes, is cut down to the slot and counted as an error; a slot
+ * claimed by a producer which died before publishing it is skipped,
+ * once it has stalled the ring long enough: see skipStalled().  Skipped while the file is in the middle of a message
+ * split across pages, so that the two never interleave, and in any
+ * process but the owner, such as a child forked since.  Sets *bytes
+ * to the number of bytes written, for syncLog().  Runs in the writer
+ * thread.  Returns 0, or -1 if a write failed, in which case the
+ * messages are lost but the slots are still freed.
+ */
+int
+drainShmRing(cFTLogDesc_t* d, size_t* bytes) {
+    shmRingHdr_t* h = d->shmRing;
+    *bytes = 0;
+    if (h == NULL || d->midMessage || d->owner != getpid())
+        return 0;
+
+    struct iovec iov[SHM_IOV_BATCH];
+    u_int32_t most = h->slotSize - SHM_SLOT_HDR;
+    u_int64_t tail = atomic_load_explicit(&h->tail, memory_order_relaxed);
+    u_int64_t msgs = 0;
+    u_int64_t seen = 0;                 // msgs and slots skipped
+    int calls  = 0;
+    int status = 0;
+    while (seen < h->slotCount) {
+        // gather the slots published, in order, up to the first gap
+        int n = 0;
+        size_t batch = 0;
+        while (n < SHM_IOV_BATCH && seen + n < h->slotCount) {
+            shmSlot_t* s = slotAt(h, tail + n);
+            if (atomic_load_explicit(&s->seq, memory_order_acquire) !=
+                                                            tail + n + 1)
+                break;
+            u_int32_t len = s->len;
+            if (len > most) {
+                len = most;
+                atomic_fetch_add(&h->errors, 1);
+            }
+            iov[n].iov_base = s->data;
+            iov[n].iov_len  = len;
+            batch += len;
+            n++;
+        }
+        if (n == 0) {
+            if (!skipStalled(d, h, tail))
+                break;
+            tail++;
+            seen++;
+            atomic_store_explicit(&h->tail, tail, memory_order_release);
+            continue;
+        }
+        int c = writeAll(d->fd, iov, n);
+        if (c < 0) {
+            perror("drainShmRing, writing to disk");
+            status = -1;
+        } else {
+            calls  += c;
+            *bytes += batch;
+        }
+        // free the slots for the producers' next lap
+        int k;
+        for (k = 0; k < n; k++)
+            atomic_store_explicit(&slotAt(h, tail + k)->seq,
+                        tail + k + h->slotCount, memory_order_release);
+        tail += n;
+        msgs += n;
+        seen += n;
+        atomic_store_explicit(&h->tail, tail, memory_order_release);
+    }
+    if (msgs == 0)
+        return 0;
+    d->fileBytes += *bytes;
+
+    pthread_mutex_lock(&d->logBufLock);
+    d->count        += msgs;
+    d->writeCalls   += calls;
+    d->bytesWritten += *bytes;
+    pthread_mutex_unlock(&d->logBufLock);
+    return status;
+}
+
+// PRODUCERS ////////////////////////////////////////////////////////
+
+/**
+ * Map the shared-memory ring called name, which the process which opened its log
+ * created, setting *bytes to the length mapped.  Returns NULL, with
+ * errno set, if there is no such ring or it is not one of ours.
+ */
+shmRingHdr_t*
+attachShmRing(const char* name, size_t* bytes) {
+    char path[MAX_SHM_NAME + 2];
+    struct stat st;
+    if (shmPath(name, path) < 0) {
+        errno = EINVAL;
+        return NULL;
+    }
+    int fd = shm_open(path, O_RDWR, 0);
+    if (fd < 0)
+        return NULL;
+    void* p = MAP_FAILED;
+    if (fstat(fd, &st) == 0 && st.st_size >= SHM_RING_HDR_SIZE)
+        p = mmap(NULL, st.st_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    else
+        errno = EINVAL;
+    close(fd);
+    if (p == MAP_FAILED)
+        return NULL;
+    shmRingHdr_t* h = p;
+    if (h->magic != SHM_RING_MAGIC || h->version != SHM_RING_VERSION ||
+            SHM_RING_HDR_SIZE + (size_t)h->slotCount * h->slotSize >
+                                                    (size_t)st.st_size) {
+        munmap(p, st.st_size);
+        errno = EINVAL;
+        return NULL;
+    }
+    atomic_thread_fence(memory_order_acquire);
+    *bytes = st.st_size;
+    return h;
+}
+
+/**
+ * Log a message through a shared-memory ring: claim the next slot, copy the
+ * message into it and publish it.  If the ring is full, a producer
+ * whose policy is DROP_ON_FULL counts the message as dropped and
+ * returns; otherwise it sleeps briefly and tries again, until the
+ * writer frees a slot, or drops the message once the ring's tail has
+ * not moved for SHM_GIVE_UP_SECS, as when its writer has died.  A
+ * message whose slot the writer took back before it was published,
+ * thinking its producer dead, is dropped too.  Called without the GIL.
+ * Returns 0, 1 if the message was dropped, -1 if the log has been
+ * closed or -2 if the message will not fit in a slot.
+ */
+int
+shmPut(shmRingHdr_t* h, const void* msg, size_t len, int policy) {
+    static const struct timespec pause = {0, 50000};   // 50 us
+    if (len > h->slotSize - SHM_SLOT_HDR)
+        return -2;
+    u_int64_t  pos = atomic_load_explicit(&h->head, memory_order_relaxed);
+    u_int64_t  seenTail = 0;
+    bool       waiting  = false;
+    struct timespec since = {0, 0}, now;
+    shmSlot_t* s;
+    for (;;) {
+        if (atomic_load_explicit(&h->closed, memory_order_relaxed))
+            return -1;
+        s = slotAt(h, pos);
+        int64_t diff = (int64_t)(atomic_load_explicit(&s->seq,
+                                        memory_order_acquire) - pos);
+        if (diff == 0) {
+            // free on this lap: try to claim it; on failure pos is
+            // reloaded with the current head
+            if (atomic_compare_exchange_weak_explicit(&h->head, &pos,
+                        pos + 1, memory_order_relaxed, memory_order_relaxed))
+                break;
+        } else if (diff < 0) {
+            // still holding the message from the last lap: the ring
+            // is full
+            if (policy == DROP_ON_FULL) {
+                atomic_fetch_add(&h->dropped, 1);
+                return 1;
+            }
+            atomic_fetch_add(&h->waits, 1);
+            u_int64_t tail = atomic_load_explicit(&h->tail,
+                                                    memory_order_relaxed);
+            clock_gettime(CLOCK_MONOTONIC, &now);
+            if (!waiting || tail != seenTail) {
+                waiting  = true;
+                seenTail = tail;
+                since    = now;
+            } else if (now.tv_sec - since.tv_sec >= SHM_GIVE_UP_SECS) {
+                atomic_fetch_add(&h->dropped, 1);
+                return 1;
+            }
+            nanosleep(&pause, NULL);
+            pos = atomic_load_explicit(&h->head, memory_order_relaxed);
+        } else
+            // another producer claimed it first
+            pos = atomic_load_explicit(&h->head, memory_order_relaxed);
+    }
+    memcpy(s->data, msg, len);
+    s->len = len;
+    u_int64_t claimed = pos;
+    if (!atomic_compare_exchange_strong_explicit(&s->seq, &claimed, pos + 1,
+                                memory_order_release, memory_order_relaxed)) {
+        atomic_fetch_add(&h->dropped, 1);       // the writer gave up on us
+        return 1;
+    }
+    return 0;
+}
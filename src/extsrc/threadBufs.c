@@ -0,0 +1,410 @@
+/* ~/dev/py/xlutil_py/src/extsrc/threadBufs.c */
+
+#include "cFTLogForPy.h"
+
+// PER-THREAD STAGING BUFFERS ///////////////////////////////////////
+// A log opened with thread_bufs set gives each thread logging to it a
+// staging buffer of its own, which it fills without taking logBufLock;
+// the writer thread harvests them all at each flush: see stageBuf_t.
+
+// the head of the calling thread's list of staging buffers
+static pthread_key_t    stageKey;
+static pthread_once_t   stageOnce = PTHREAD_ONCE_INIT;
+
+// serial numbers distinguish logs, whose handles and descriptors are
+// reused once they are closed
+static atomic_uint_least64_t nextSerial = 1;
+
+#define STAGE_ROUND(n)  (((n) + STAGE_ALIGN - 1) & ~(u_int64_t)(STAGE_ALIGN - 1))
+
+/** Drop a reference to a staging buffer, freeing it with the last. */
+static void
+unrefStageBuf(stageBuf_t* b) {
+    if (atomic_fetch_sub(&b->refs, 1) == 1) {
+        free(b->data);
+        free(b);
+    }
+}
+
+/**
+ * Let go of the staging buffers of a thread as it exits.  The writer
+ * frees each once it has harvested what is left in it.
+ */
+static void
+releaseThreadBufs(void* first) {
+    stageBuf_t* b = first;
+    while (b != NULL) {
+        stageBuf_t* next = b->threadNext;
+        atomic_store(&b->abandoned, 1);
+        unrefStageBuf(b);
+        b = next;
+    }
+}
+
+static void
+makeStageKey(void) {
+    if (pthread_key_create(&stageKey, releaseThreadBufs))
+        perror("creating staging buffer key");
+}
+
+/**
+ * Set a newly opened log up to stage messages per thread, if the
+ * options ask for that.  The buffer size is rounded up to a power of
+ * two.  A log shared with child processes cannot: their threads'
+ * buffers would be invisible to our writer.  Returns 0 or -1.
+ */
+int
+initThreadBufs(cFTLogDesc_t* d, const cFTLogOpts_t* opts) {
+    if (!opts->threadBufs)
+        return 0;
+    if (d->shared || opts->threadBufSize < MIN_STAGE_BUF_SIZE ||
+                            opts->threadBufSize > MAX_STAGE_BUF_SIZE)
+        return -1;
+    u_int32_t size = MIN_STAGE_BUF_SIZE;
+    while (size < opts->threadBufSize)
+        size <<= 1;
+    pthread_once(&stageOnce, makeStageKey);
+    d->threadBufs  = true;
+    d->mergeStamps = opts->mergeStamps;
+    d->stageSize   = size;
+    d->serial      = atomic_fetch_add(&nextSerial, 1);
+    return 0;
+}
+
+/**
+ * Let go of a log's staging buffers as it is freed.  Threads which
+ * still refer to theirs free them when next they look for one, or
+ * when they exit.  Called holding the GIL, after the final flush.
+ */
+void
+freeThreadBufs(cFTLogDesc_t* d) {
+    stageBuf_t* b = d->stageBufs;
+    while (b != NULL) {
+        stageBuf_t* next = b->next;
+        atomic_store(&b->detached, 1);
+        unrefStageBuf(b);
+        b = next;
+    }
+    d->stageBufs = NULL;
+    free(d->stageEntries);
+    free(d->stageIov);
+    d->stageEntries  = NULL;
+    d->stageIov      = NULL;
+    d->stageCapacity = 0;
+}
+
+/**
+ * In a child process, drop a log's staging buffers: what they hold is
+ * the parent's to write, and the threads which filled them are gone.
+ * The log is given a new serial number, so that the forking thread,
+ * which alone survives, leaves its old buffer behind and stages into
+ * a fresh one.  Called from the pthread_atfork() child handler.
+ */
+void
+resetThreadBufs(cFTLogDesc_t* d) {
+    if (!d->threadBufs)
+        return;
+    stageBuf_t* b = d->stageBufs;
+    while (b != NULL) {
+        stageBuf_t* next = b->next;
+        atomic_store(&b->tail, atomic_load(&b->head));
+        atomic_store(&b->detached, 1);
+        unrefStageBuf(b);
+        b = next;
+    }
+    d->stageBufs = NULL;
+    d->serial    = atomic_fetch_add(&nextSerial, 1);
+}
+
+/**
+ * Return the calling thread's staging buffer for a log, creating it if
+ * this is the first time the thread has logged to it, or NULL if it
+ * cannot be allocated.  Buffers of logs since freed are dropped from
+ * the thread's list on the way.
+ */
+static stageBuf_t*
+myStageBuf(cFTLogDesc_t* d) {
+    stageBuf_t* first = pthread_getspecific(stageKey);
+    stageBuf_t* b;
+    for (b = first; b != NULL; b = b->threadNext)
+        if (b->serial == d->serial)
+            return b;
+
+    stageBuf_t** pp = &first;
+    while (*pp != NULL) {
+        b = *pp;
+        if (atomic_load(&b->detached)) {
+            *pp = b->threadNext;
+            unrefStageBuf(b);
+        } else
+            pp = &b->threadNext;
+    }
+    b = aligned_alloc(64, (sizeof(stageBuf_t) + 63) & ~(size_t)63);
+    if (b != NULL) {
+        memset(b, 0, sizeof(stageBuf_t));
+        b->data = malloc(d->stageSize);
+        if (b->data == NULL) {
+            free(b);
+            b = NULL;
+        }
+    }
+    if (b == NULL) {
+        pthread_setspecific(stageKey, first);
+        return NULL;
+    }
+    atomic_init(&b->refs, 2);
+    b->serial = d->serial;
+    b->size   = d->stageSize;
+
+    pthread_mutex_lock(&d->logBufLock);
+    b->next      = d->stageBufs;
+    d->stageBufs = b;
+    pthread_mutex_unlock(&d->logBufLock);
+    b->threadNext = first;
+    pthread_setspecific(stageKey, b);
+    return b;
+}
+
+/**
+ * Copy a message into the calling thread's staging buffer, as a record
+ * stamped with the time if the log merges timestamps, otherwise as it
+ * is.  Only if the buffer is full is logBufLock taken: a producer
+ * whose log's policy is DROP_ON_FULL then drops the message; any other
+ * wakes the writer and waits on bufFreed until it has harvested the
+ * buffer.  Returns 0 if the message was staged, 1 if it
+ * was dropped, or -1 if it was not staged, because it is more than
+ * half the size of a buffer or the buffer cannot be allocated, and
+ * should go into the log's pages instead.
+ */
+int
+stageMsg(cFTLogDesc_t* d, const char* msg, u_int32_t len) {
+    u_int64_t need = d->mergeStamps ?
+                STAGE_ROUND(sizeof(stageRec_t) + (u_int64_t)len) : len;
+    if (need > d->stageSize / 2)
+        return -1;
+    stageBuf_t* b = myStageBuf(d);
+    if (b == NULL)
+        return -1;
+
+    u_int64_t head   = atomic_load_explicit(&b->head, memory_order_relaxed);
+    u_int32_t off    = head & (b->size - 1);
+    u_int32_t contig = b->size - off;
+    u_int64_t total  = need + (d->mergeStamps && contig < need ? contig : 0);
+    if (head + total - atomic_load_explicit(&b->tail, memory_order_acquire)
+                                                                > b->size) {
+        pthread_mutex_lock(&d->logBufLock);
+        if (d->policy == DROP_ON_FULL) {
+            d->droppedCount++;
+            wakeWriter(d);
+            pthread_mutex_unlock(&d->logBufLock);
+            return 1;
+        }
+        d->blockedCount++;
+        while (head + total - atomic_load_explicit(&b->tail,
+                                    memory_order_acquire) > b->size) {
+            wakeWriter(d);
+            pthread_cond_wait(&d->bufFreed, &d->logBufLock);
+        }
+        pthread_mutex_unlock(&d->logBufLock);
+    }
+    if (!d->mergeStamps) {
+        u_int32_t part = len < contig ? len : contig;
+        memcpy(b->data + off, msg, part);
+        memcpy(b->data, msg + part, len - part);
+        atomic_store_explicit(&b->head, head + need, memory_order_release);
+        atomic_store_explicit(&b->msgs,
+                atomic_load_explicit(&b->msgs, memory_order_relaxed) + 1,
+                memory_order_relaxed);
+        return 0;
+    }
+    stageRec_t* rec = (stageRec_t*)(b->data + off);
+    if (contig < need) {
+        // pad out the end of the ring and start again at the beginning
+        rec->len   = contig;
+        rec->flags = STAGE_PAD;
+        head      += contig;
+        rec        = (stageRec_t*)b->data;
+    }
+    rec->len   = len;
+    rec->flags = 0;
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    rec->nanos = (u_int64_t)now.tv_sec * 1000000000 + now.tv_nsec;
+    memcpy(rec + 1, msg, len);
+    atomic_store_explicit(&b->head, head + need, memory_order_release);
+    return 0;
+}
+
+/**
+ * Make room for at least n records in the writer's scratch space.
+ * Returns 0 or -1.
+ */
+static int
+growStageEntries(cFTLogDesc_t* d, size_t n) {
+    if (n <= d->stageCapacity)
+        return 0;
+    size_t capacity = d->stageCapacity ? d->stageCapacity : 256;
+    while (capacity < n)
+        capacity *= 2;
+    stageEntry_t* entries = realloc(d->stageEntries,
+                                        capacity * sizeof(stageEntry_t));
+    if (entries == NULL)
+        return -1;
+    d->stageEntries = entries;
+    struct iovec* iov = realloc(d->stageIov, capacity * sizeof(struct iovec));
+    if (iov == NULL)
+        return -1;
+    d->stageIov      = iov;
+    d->stageCapacity = capacity;
+    return 0;
+}
+
+/** Order records by timestamp, then by the order they were harvested. */
+static int
+compareEntries(const void* a, const void* b) {
+    const stageEntry_t* x = a;
+    const stageEntry_t* y = b;
+    if (x->nanos != y->nanos)
+        return x->nanos < y->nanos ? -1 : 1;
+    return x->order < y->order ? -1 : x->order > y->order;
+}
+
+/**
+ * Gather what a staging buffer holds from tail to head, unframed, into
+ * the writer's scratch space from entry *n on, as one or two iovecs.
+ * Returns the number of bytes gathered.
+ */
+static size_t
+gatherBytes(cFTLogDesc_t* d, stageBuf_t* b, u_int64_t head,
+                                                u_int64_t tail, size_t* n) {
+    u_int64_t len = head - tail;
+    if (len == 0 || growStageEntries(d, *n + 2) < 0)
+        return 0;
+    u_int32_t off  = tail & (b->size - 1);
+    u_int32_t part = len < b->size - off ? len : b->size - off;
+    d->stageIov[(*n)++] = (struct iovec){b->data + off, part};
+    if (len > part)
+        d->stageIov[(*n)++] = (struct iovec){b->data, len - part};
+    b->harvestTo = head;
+    return len;
+}
+
+/**
+ * Gather the records a staging buffer holds from tail to head into the
+ * writer's scratch space from entry *n on, one entry per message.
+ * Returns the number of bytes gathered.
+ */
+static size_t
+gatherRecords(cFTLogDesc_t* d, stageBuf_t* b, u_int64_t head,
+                                                u_int64_t tail, size_t* n) {
+    size_t bytes = 0;
+    while (tail < head) {
+        stageRec_t* rec = (stageRec_t*)(b->data + (tail & (b->size - 1)));
+        if (rec->flags & STAGE_PAD) {
+            tail += rec->len;
+            continue;
+        }
+        if (growStageEntries(d, *n + 1) < 0)
+            break;          // the rest can wait for the next flush
+        stageEntry_t* e = d->stageEntries + *n;
+        e->nanos        = rec->nanos;
+        e->order        = (*n)++;
+        e->iov.iov_base = rec + 1;
+        e->iov.iov_len  = rec->len;
+        bytes += rec->len;
+        tail  += STAGE_ROUND(sizeof(stageRec_t) + (u_int64_t)rec->len);
+    }
+    b->harvestTo = tail;
+    return bytes;
+}
+
+/**
+ * Harvest the messages staged since the last flush: gather them from
+ * every thread's buffer, one buffer after another or, if the log was
+ * opened with merge_stamps, merged into timestamp order, and write them
+ * out with as few writev() calls as possible.  Then hand the space back
+ * to the producers, waking any waiting for it, and free the buffers of
+ * threads which have exited once they are empty.  Like drainShmRing(),
+ * skipped while the file is in the middle of a message split across
+ * pages.  Sets *bytes to the number of bytes written, for syncLog().
+ * Runs in the writer thread.  Returns 0 or -1 if a write failed.
+ */
+int
+harvestStaged(cFTLogDesc_t* d, size_t* bytes) {
+    *bytes = 0;
+    if (!d->threadBufs || d->midMessage)
+        return 0;
+
+    // producers only ever add buffers at the head of the list
+    pthread_mutex_lock(&d->logBufLock);
+    stageBuf_t* first = d->stageBufs;
+    pthread_mutex_unlock(&d->logBufLock);
+
+    size_t n = 0;
+    u_int64_t msgs = 0;
+    stageBuf_t* b;
+    for (b = first; b != NULL; b = b->next) {
+        u_int64_t head = atomic_load_explicit(&b->head, memory_order_acquire);
+        u_int64_t tail = atomic_load_explicit(&b->tail, memory_order_relaxed);
+        b->harvestTo   = tail;
+        if (d->mergeStamps) {
+            *bytes += gatherRecords(d, b, head, tail, &n);
+            continue;
+        }
+        // the count may run ahead of head by a message or so, which
+        // the next harvest writes out
+        u_int64_t copied = atomic_load_explicit(&b->msgs,
+                                                memory_order_relaxed);
+        *bytes    += gatherBytes(d, b, head, tail, &n);
+        msgs      += copied - b->counted;
+        b->counted = copied;
+    }
+
+    int status = 0;
+    int calls  = 0;
+    if (n > 0) {
+        size_t i;
+        if (d->mergeStamps) {
+            qsort(d->stageEntries, n, sizeof(stageEntry_t), compareEntries);
+            for (i = 0; i < n; i++)
+                d->stageIov[i] = d->stageEntries[i].iov;
+            msgs = n;
+        }
+        calls = writeAll(d->fd, d->stageIov, n);
+        if (calls < 0) {
+            perror("harvestStaged, writing to disk");
+            status = -1;
+            calls  = 0;
+        }
+    }
+    for (b = first; b != NULL; b = b->next)
+        atomic_store_explicit(&b->tail, b->harvestTo, memory_order_release);
+    d->fileBytes += *bytes;
+
+    stageBuf_t* gone = NULL;
+    pthread_mutex_lock(&d->logBufLock);
+    d->count      += msgs;
+    d->writeCalls += calls;
+    if (!status)
+        d->bytesWritten += *bytes;
+    pthread_cond_broadcast(&d->bufFreed);
+    // unlink the empty buffers of threads which have exited
+    stageBuf_t** pp = &d->stageBufs;
+    while (*pp != NULL) {
+        b = *pp;
+        if (atomic_load(&b->abandoned) && b->harvestTo ==
+                    atomic_load_explicit(&b->head, memory_order_relaxed)) {
+            *pp     = b->next;
+            b->next = gone;
+            gone    = b;
+        } else
+            pp = &b->next;
+    }
+    pthread_mutex_unlock(&d->logBufLock);
+    while (gone != NULL) {
+        b    = gone;
+        gone = b->next;
+        unrefStageBuf(b);
+    }
+    return status;
+}
@@ -2,14 +2,12 @@
 
 #include "cFTLogForPy.h"
 
-        pthread_t       writerThread;
-static  int             writerReady = false;
-static  pthread_mutex_t readyLock;
-static  pthread_cond_t  readyCond;
+// each manager's writer thread and the locks used to start it are in
+// its cFTLogMgr_t
 
 // local prototypes
 static void* startWriter (void * arg);
-static int writerInit(void); 
+static int writerInit(cFTLogMgr_t* mgr); 
 
 // These comments have become scattered in the reorganization of the
 // code.
@@ -65,26 +63,24 @@ static int writerInit(void);
  */
 
 /**
- * Start the disk writer running in a new thread, then wait for it to
- * signal that it has completed initialization.
+ * Start a manager's disk writer running in a new thread, then wait for
+ * it to signal that it has completed initialization.
  */
-int writerInitThreaded(void) {
-    writerReady = false;
-    pthread_mutex_init  (&readyLock,  NULL);
-    pthread_cond_init   (&readyCond,  NULL);
-//  readyLock   = PTHREAD_MUTEX_INITIALIZER;
-//  readyCond   = PTHREAD_COND_INITIALIZER;
-
-    if (pthread_create(&writerThread, NULL, startWriter, NULL) != 0) {
+int writerInitThreaded(cFTLogMgr_t* mgr) {
+    mgr->writerReady = false;
+    mgr->pid         = getpid();
+
+    if (pthread_create(&mgr->writerThread, NULL, startWriter, mgr) != 0) {
         perror("P: Failed to initialize writer thread");
         return -1;
     }
     // now wait for the new thread to say that it's ready
-    pthread_mutex_lock(&readyLock);
-    while(! writerReady) {
-        pthread_cond_wait(&readyCond, &readyLock);
+    pthread_mutex_lock(&mgr->readyLock);
+    while(! mgr->writerReady) {
+        pthread_cond_wait(&mgr->readyCond, &mgr->readyLock);
     }
-    pthread_mutex_unlock(&readyLock);
+    pthread_mutex_unlock(&mgr->readyLock);
+    mgr->running = true;
     return 0;
 }
 
@@ -101,15 +97,19 @@ int writerInitThreaded(void) {
  * the event loop.
  */
 static void* startWriter (void * arg) {
-    if(writerInit() < 0) {
+    if(writerInit((cFTLogMgr_t*) arg) < 0) {
         printf("log writer initialization failed!\n");
     }
     return NULL;
 }
 
-static int writerInit(void) {
+static int writerInit(cFTLogMgr_t* mgr) {
     /* XXX NEED A SANITY CHECK HERE */
-    loop = ev_loop_new( EVFLAG_AUTO );
+    mgr->loop = ev_loop_new( EVFLAG_AUTO );
+
+    // this keeps the loop running until stopWriter() is called, and lets
+    // other threads hand work to this one
+    setupWakeupWatcher(mgr);
 
 //  if(setupLibEvAndCallbacks() < 0) {
 //      printf("Error starting libevent\n");
@@ -117,14 +117,58 @@ static int writerInit(void) {
 //  }
 
     // Signal client, writer is ready
-    pthread_mutex_lock(&readyLock);
-    writerReady = true;
-    pthread_cond_signal(&readyCond);
-    pthread_mutex_unlock(&readyLock);
+    pthread_mutex_lock(&mgr->readyLock);
+    mgr->writerReady = true;
+    pthread_cond_signal(&mgr->readyCond);
+    pthread_mutex_unlock(&mgr->readyLock);
 
     // LOG(1, ("Writer init complete\n"));
 
-    ev_loop(loop, 0);   // start the loop; this should never return
+    ev_loop(mgr->loop, 0);  // start the loop; returns after stopWriter()
     return 0;
 }
 
+/////////////////////////////////////////////////////////////////////
+// FORKING //////////////////////////////////////////////////////////
+/////////////////////////////////////////////////////////////////////
+
+/**
+ * Have fork() take the extension's locks beforehand, so that none is
+ * inherited locked by a thread the child does not have.  Called once,
+ * when the module is loaded.
+ */
+void registerForkHandlers(void) {
+    static bool registered = false;
+    if (!registered && pthread_atfork(lockForFork, unlockAfterFork,
+                                                    resetInChild) == 0)
+        registered = true;
+}
+
+/**
+ * In a child process, give each manager which was running when the
+ * process was forked a new event loop and writer thread, restarting
+ * the timers of the logs it drains; shared logs are left to the
+ * writer of the process which opened them.  Call holding the GIL.
+ */
+void restartWriters(void) {
+    int id;
+    for (id = 0; id < CLOG_MAX_MGR; id++) {
+        cFTLogMgr_t* mgr = logMgrAt(id);
+        if (mgr == NULL || !mgr->forked)
+            continue;
+        int handle;
+        int last = lastLogSlot(mgr);
+        for (handle = LOG_HANDLE(mgr, 0); handle <= last; handle++) {
+            cFTLogDesc_t* d = logDescAt(handle);
+            if (d != NULL && !d->shared)
+                initLogTimer(d);
+        }
+        mgr->forked = false;
+        if (writerInitThreaded(mgr) < 0) {
+            mgr->running = false;
+            continue;
+        }
+        // the writer starts the timers when woken
+        ev_async_send(mgr->loop, &mgr->wakeupWatcher);
+    }
+}
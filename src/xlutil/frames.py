@@ -0,0 +1,79 @@
+# xlutil_py/src/xlutil/frames.py
+
+"""
+Read framed logs and recover them after a crash.
+
+A log opened with framed=True is written as a series of records, each
+FRAME_HEADER, the length of the message and the CRC32C of that length
+and the message, both little-endian, followed by the message itself.
+A crash in the middle of a write leaves a torn record at the end of the
+file; recover_tail() finds the last good record, checking every CRC in
+C without the GIL, and cuts the file back to it.
+"""
+
+import mmap
+import os
+import struct
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import crc32c, scan_frames
+
+__all__ = ['FRAME_HEADER', 'crc32c', 'frame', 'iter_frames', 'scan_file',
+           'recover_tail', ]
+
+FRAME_HEADER = struct.Struct('<II')     # length, CRC32C
+
+
+def frame(msg):
+    """ Return msg framed as a record, as a framed log writes it. """
+    size = struct.pack('<I', len(msg))
+    return size + struct.pack('<I', crc32c(msg, crc32c(size))) + bytes(msg)
+
+
+def iter_frames(data, offset=0):
+    """
+    Yield the messages of the good records in data, a bytes-like object
+    holding a framed log, from offset on, as memoryviews into it;
+    stop at the first torn or corrupt record.
+    """
+    end, _ = scan_frames(data, offset)
+    view = memoryview(data)
+    while offset < end:
+        length, _ = FRAME_HEADER.unpack_from(view, offset)
+        offset += FRAME_HEADER.size
+        yield view[offset:offset + length]
+        offset += length
+
+
+def scan_file(path):
+    """
+    Check every record of the framed log at path, which is mapped into
+    memory rather than read.  Returns a tuple of the offset just past
+    the last good record, the number of good records, and the length of
+    the file.
+    """
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return 0, 0, 0
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            end, records = scan_frames(data)
+        finally:
+            data.close()
+    return end, records, size
+
+
+def recover_tail(path, truncate=True):
+    """
+    Find the last good record of the framed log at path and, if truncate
+    is true, the default, cut off whatever follows it: a record torn by
+    a crash, or anything after the first corrupt record.  Call this
+    before the log is opened.  Returns the offset just past the last
+    good record, which is the length of the file afterwards, and the
+    number of good records.
+    """
+    end, records, size = scan_file(path)
+    if truncate and end < size:
+        os.truncate(path, end)
+    return end, records
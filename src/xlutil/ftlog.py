@@ -1,26 +1,124 @@
 # xlattice_py/xlattice/ftLog.py
 
-""" Fault-tolerant log classes and methods. """
-
+"""
+Fault-tolerant log classes and methods.
+
+Besides its policy, buf_size and buf_count, a log opened with
+LogMgr.open() takes these keyword options:
+
+durability      after each flush the writer calls fsync() (SYNC_FSYNC,
+                the default) or fdatasync() (SYNC_FDATASYNC), just
+                starts writeback (SYNC_ASYNC), calls fdatasync() only
+                every group_ms milliseconds or group_bytes bytes
+                (SYNC_GROUP), or leaves it to the OS (SYNC_NONE)
+group_ms        for SYNC_GROUP, by default 1000
+group_bytes     for SYNC_GROUP, by default 1 MiB
+high_water      wake the writer once this many pages are full rather
+                than at its next tick; by default 0, always wait
+rotate_bytes    rotate the file once it holds this many bytes or is
+rotate_secs     this many seconds old, renaming it NAME.log.N; by
+                default 0, never
+on_rotate       called by the writer, holding the GIL, with the old
+                file's new path and the new file's; it may return a
+                first record for the new file, such as a chain link
+                made by xlutil.logreader.chain_linker()
+shared          if true, child processes forked later log into the
+                same buffers, in shared memory, which cannot grow; only
+                this process may close the log
+shm_name        also give the log a POSIX shared-memory ring of this
+shm_slots       name, of shm_slots slots, a power of two, of
+shm_slot_size   shm_slot_size bytes, 16 of them a header, which any
+                process may log into with ShmProducer; by default 1024
+                slots of 512 bytes.  No object of that name may exist;
+                it is unlinked when the log is closed
+thread_bufs     if true, each thread stages its messages in a buffer of
+thread_buf_size its own, by default 64 KiB, which the writer harvests;
+                larger messages go into the pages.  Not for shared logs
+merge_stamps    if true, the writer merges what it harvests into the
+                order in which it was logged
+engine          ENGINE_PAGES, the default, or ENGINE_MPSC, a lock-free
+ring_size       ring of ring_size bytes, by default 1 MiB, which
+                producers reserve space in with an atomic add.  Not for
+                shared logs, nor with thread_bufs
+recoverable     if true, the buffers are kept in a file, NAME.log.ring,
+                from which the next open appends whatever a crashed run
+                left unwritten; one process at a time.  Not for shared
+                logs, nor with thread_bufs or ENGINE_MPSC
+framed          if true, each message is written as a record with its
+                length and CRC32C: see xlutil.frames.  Not with shm_name
+prealloc_bytes  if not 0, preallocate the file in extents of this many
+                bytes, at least 64 KiB, such as prealloc_bytes, 64 MiB;
+                the logical end is kept in NAME.log.end, locked, until
+                the file is cut back when closed or rotated
+
+An option out of range, or options which cannot go together, raise
+ValueError.
+"""
+
+import bisect
 import os
+import struct
 import time
+from array import array
 
 # pylint: disable=no-name-in-module
 from cFTLogForPy import(
-    init_cft_logger, open_cft_log, log_msg, close_cft_logger)
-
-
-__all__ = ['LogEntry', 'ActualLog', 'LogMgr', ]
+    new_cft_logger, open_cft_log, log_msg, log_msgs, log_stats,
+    flush_cft_log, close_cft_log, close_cft_logger,
+    attach_cft_shm, shm_log_msg, shm_stats,
+    # seconds between each log's timed flushes, by default
+    write_interval as default_write_interval,
+    # default size and number of each log's buffer pages
+    log_buffer_size, log_buf_count,
+    # default shape of a log's shared-memory ring
+    shm_slots, shm_slot_size,
+    # a sensible extent in which to preallocate a log's file
+    prealloc_bytes,
+    # what producers do when all of a log's buffers are full
+    BLOCK_ON_FULL, GROW_ON_FULL, DROP_ON_FULL,
+    # how hard the writer works to get each log onto the disk
+    SYNC_FSYNC, SYNC_FDATASYNC, SYNC_ASYNC, SYNC_GROUP, SYNC_NONE,
+    # how producers get messages to the writer
+    ENGINE_PAGES, ENGINE_MPSC)
+
+
+__all__ = ['LogEntry', 'pack_many', 'iter_unpack', 'ENTRY_VERSION',
+           'ENTRY_ID_WIDTHS', 'LogEntryTable',
+           'TimeStamper', 'ActualLog', 'LogMgr', 'ShmProducer',
+           'BLOCK_ON_FULL', 'GROW_ON_FULL', 'DROP_ON_FULL',
+           'SYNC_FSYNC', 'SYNC_FDATASYNC', 'SYNC_ASYNC', 'SYNC_GROUP',
+           'SYNC_NONE', 'ENGINE_PAGES', 'ENGINE_MPSC', ]
 
 # The first line of a chained log is a LogEntry pointing back to
 # the previous chunk of the log; its key is the content key of that
-# log in U.
+# log in U.  xlutil.logreader reads such logs.
 
 # See upax_go/entry.go and entry_test.go
 
+# the binary encoding of a LogEntry
+ENTRY_VERSION = 1
+ENTRY_ID_WIDTHS = (20, 32)      # SHA1 and SHA2/SHA3 widths
+_ENTRY_HEADER = struct.Struct('>BBHQI')
+
 
 class LogEntry(object):
-    """ A fault-tolerant log entry. """
+    """
+    A fault-tolerant log entry.
+
+    Entries have a fixed-layout binary encoding, big-endian:
+
+        uint8   format version, ENTRY_VERSION
+        uint8   W, the width of key, owner and src: 20 or 32
+        uint16  length of the path in bytes, P
+        uint64  tstamp
+        uint32  length
+        W       key
+        W       owner
+        W       src
+        P       path, UTF-8
+    """
+
+    __slots__ = ('_tstamp', '_key', '_owner', '_length', '_src', '_path', )
 
     def __init__(self,
                  tstamp,         # integer timestamp, either 32 or 64 bits
@@ -32,7 +130,7 @@ class LogEntry(object):
 
         self._tstamp = tstamp
         self._key = key
-        self._owner = owner,
+        self._owner = owner
         self._length = length
         self._src = src
         self._path = path
@@ -84,30 +182,391 @@ class LogEntry(object):
             self._src == other.src and\
             self._path == other.path
 
+    def to_bytes(self):
+        """
+        Return the entry's binary encoding.  Raises ValueError if the
+        key, owner and src are not all 20 or all 32 bytes long, the
+        path is too long, or the timestamp or length does not fit its
+        unsigned field.
+        """
+        width = len(self._key)
+        if width not in ENTRY_ID_WIDTHS or \
+                len(self._owner) != width or len(self._src) != width:
+            raise ValueError(
+                'key, owner and src must all be 20 or all 32 bytes long')
+        path = self._path.encode('utf-8')
+        if len(path) > 0xffff:
+            raise ValueError('path is %d bytes long' % len(path))
+        if not 0 <= self._tstamp < 2 ** 64:
+            raise ValueError('timestamp %d out of range' % self._tstamp)
+        if not 0 <= self._length < 2 ** 32:
+            raise ValueError('length %d out of range' % self._length)
+        return b''.join((
+            _ENTRY_HEADER.pack(ENTRY_VERSION, width, len(path),
+                               self._tstamp, self._length),
+            self._key, self._owner, self._src, path))
+
+    @classmethod
+    def from_buffer(cls, buf, offset=0):
+        """
+        Decode the entry whose encoding starts offset bytes into buf,
+        any object supporting the buffer protocol, such as bytes, a
+        memoryview or an mmap.  Returns the entry and the offset of the
+        byte following it.
+
+        Nothing is copied: the key, owner and src of the entry are
+        memoryview slices of buf, which stays exported for as long as
+        they are alive; convert them with bytes() to keep them longer.
+        Raises ValueError if the encoding is truncated or malformed.
+        """
+        view = buf if isinstance(buf, memoryview) else memoryview(buf)
+        try:
+            version, width, path_len, tstamp, length = \
+                _ENTRY_HEADER.unpack_from(view, offset)
+        except struct.error:
+            raise ValueError('truncated log entry at offset %d' % offset)
+        if version != ENTRY_VERSION or width not in ENTRY_ID_WIDTHS:
+            raise ValueError('bad log entry header at offset %d' % offset)
+        start = offset + _ENTRY_HEADER.size
+        end = start + 3 * width + path_len
+        if end > len(view):
+            raise ValueError('truncated log entry at offset %d' % offset)
+        key = view[start:start + width]
+        owner = view[start + width:start + 2 * width]
+        src = view[start + 2 * width:start + 3 * width]
+        path = str(view[start + 3 * width:end], 'utf-8')
+        return cls(tstamp, key, owner, length, src, path), end
+
+
+def pack_many(entries):
+    """ Return the binary encodings of an iterable of entries, end to end. """
+    return b''.join(entry.to_bytes() for entry in entries)
+
+
+def iter_unpack(buf, offset=0):
+    """
+    Yield the LogEntry encoded in buf, which may be a whole log file
+    read or mapped into memory, one after another from offset to the
+    end of the buffer.  As with LogEntry.from_buffer(), nothing is
+    copied.
+    """
+    view = buf if isinstance(buf, memoryview) else memoryview(buf)
+    end = len(view)
+    while offset < end:
+        entry, offset = LogEntry.from_buffer(view, offset)
+        yield entry
+
+
+# -------------------------------------------------------------------
+class LogEntryTable(object):
+    """
+    A compact, columnar store of many LogEntry.
+
+    Each field is held in a contiguous column: timestamps in an int64
+    array, lengths in a uint32 array, keys, owners and srcs end to end
+    in a bytearray each, and paths as indexes into a pool holding each
+    distinct path once.  All the entries in a table have ids of the same
+    width.  Entries are only made when asked for, by indexing or
+    iterating over the table.
+
+    The select_*() methods return the numbers of the matching rows, in
+    an array, and take() copies the rows chosen into a new table.
+    """
+
+    __slots__ = ('_width', '_tstamps', '_lengths', '_keys', '_owners',
+                 '_srcs', '_path_ids', '_paths', '_path_ndx', '_sorted', )
+
+    def __init__(self, width=20):
+        if width not in ENTRY_ID_WIDTHS:
+            raise ValueError('id width must be 20 or 32')
+        self._width = width
+        self._tstamps = array('q')
+        self._lengths = array('I')
+        self._keys = bytearray()
+        self._owners = bytearray()
+        self._srcs = bytearray()
+        self._path_ids = array('I')
+        self._paths = []
+        self._path_ndx = {}
+        self._sorted = True         # whether tstamps are non-decreasing
+
+    @classmethod
+    def from_entries(cls, entries, width=20):
+        """ Return a table holding an iterable of entries. """
+        table = cls(width)
+        table.extend(entries)
+        return table
+
+    @classmethod
+    def from_buffer(cls, buf, width=20):
+        """ Return a table holding the entries encoded in buf. """
+        return cls.from_entries(iter_unpack(buf), width)
+
+    @property
+    def width(self):
+        """ Return the width of the entries' key, owner and src. """
+        return self._width
+
+    @property
+    def path_count(self):
+        """ Return the number of distinct paths in the table. """
+        return len(self._paths)
+
+    def __len__(self):
+        return len(self._tstamps)
+
+    def nbytes(self):
+        """ Return the approximate number of bytes the columns occupy. """
+        return self._tstamps.itemsize * len(self._tstamps) + \
+            self._lengths.itemsize * len(self._lengths) + \
+            len(self._keys) + len(self._owners) + len(self._srcs) + \
+            self._path_ids.itemsize * len(self._path_ids) + \
+            sum(len(path) for path in self._paths)
+
+    def append(self, entry):
+        """
+        Add an entry to the table.  Raises ValueError if its ids are
+        not the table's width.
+        """
+        width = self._width
+        if len(entry.key) != width or len(entry.owner) != width or \
+                len(entry.src) != width:
+            raise ValueError('entry ids are not %d bytes long' % width)
+        tstamp = entry.tstamp
+        if self._tstamps and tstamp < self._tstamps[-1]:
+            self._sorted = False
+        self._tstamps.append(tstamp)
+        self._lengths.append(entry.length)
+        self._keys += entry.key
+        self._owners += entry.owner
+        self._srcs += entry.src
+        path = entry.path
+        ndx = self._path_ndx.get(path)
+        if ndx is None:
+            ndx = self._path_ndx[path] = len(self._paths)
+            self._paths.append(path)
+        self._path_ids.append(ndx)
+
+    def extend(self, entries):
+        """ Add an iterable of entries to the table. """
+        for entry in entries:
+            self.append(entry)
+
+    def __getitem__(self, row):
+        """ Return the entry in a row, as a new LogEntry. """
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('row %d out of range' % row)
+        start = row * self._width
+        end = start + self._width
+        return LogEntry(self._tstamps[row], bytes(self._keys[start:end]),
+                        bytes(self._owners[start:end]), self._lengths[row],
+                        bytes(self._srcs[start:end]),
+                        self._paths[self._path_ids[row]])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    # FILTERING -----------------------------------------------------
+
+    def select_time_range(self, start, end):
+        """
+        Return the rows with start <= tstamp < end.  If the entries
+        were added in timestamp order this is a binary search.
+        """
+        if self._sorted:
+            first = bisect.bisect_left(self._tstamps, start)
+            last = bisect.bisect_left(self._tstamps, end, first)
+            return array('L', range(first, last))
+        return array('L', [row for row, tstamp in enumerate(self._tstamps)
+                           if start <= tstamp < end])
+
+    def _select_prefix(self, column, prefix):
+        """
+        Return the rows whose value in a fixed-width column starts with
+        prefix, using bytearray.find() to scan the column.
+        """
+        width = self._width
+        rows = array('L')
+        if not prefix:
+            return array('L', range(len(self)))
+        if len(prefix) > width:
+            return rows
+        prefix = bytes(prefix)
+        find = column.find
+        pos = find(prefix)
+        while pos >= 0:
+            row, skew = divmod(pos, width)
+            if skew == 0:
+                rows.append(row)
+                pos = find(prefix, pos + width)
+            else:
+                # matched across a boundary: resume at the next row
+                pos = find(prefix, (row + 1) * width)
+        return rows
+
+    def select_owner(self, owner):
+        """ Return the rows logged by owner. """
+        if len(owner) != self._width:
+            return array('L')
+        return self._select_prefix(self._owners, owner)
+
+    def select_key_prefix(self, prefix):
+        """ Return the rows whose key starts with prefix. """
+        return self._select_prefix(self._keys, prefix)
+
+    def select(self, start=None, end=None, owner=None, key_prefix=None):
+        """
+        Return the rows matching all the criteria given: a timestamp at
+        or after start and before end, the owner, and a key starting
+        with key_prefix.
+        """
+        rows = None
+        if start is not None or end is not None:
+            rows = self.select_time_range(
+                -(1 << 63) if start is None else start,
+                1 << 63 if end is None else end)
+        for value, select in ((owner, self.select_owner),
+                              (key_prefix, self.select_key_prefix)):
+            if value is None:
+                continue
+            matches = select(value)
+            if rows is None:
+                rows = matches
+            else:
+                wanted = set(matches)
+                rows = array('L', [row for row in rows if row in wanted])
+        return array('L', range(len(self))) if rows is None else rows
+
+    def take(self, rows):
+        """ Return a new table holding the rows given, in that order. """
+        width = self._width
+        table = LogEntryTable(width)
+        table._tstamps = array('q', [self._tstamps[row] for row in rows])
+        table._lengths = array('I', [self._lengths[row] for row in rows])
+        for name in ('_keys', '_owners', '_srcs'):
+            column = getattr(self, name)
+            setattr(table, name, bytearray().join(
+                column[row * width:(row + 1) * width] for row in rows))
+        for row in rows:
+            path = self._paths[self._path_ids[row]]
+            ndx = table._path_ndx.get(path)
+            if ndx is None:
+                ndx = table._path_ndx[path] = len(table._paths)
+                table._paths.append(path)
+            table._path_ids.append(ndx)
+        tstamps = table._tstamps
+        table._sorted = all(tstamps[i] <= tstamps[i + 1]
+                            for i in range(len(tstamps) - 1))
+        return table
+
+    def filter(self, start=None, end=None, owner=None, key_prefix=None):
+        """ Return a new table of the entries matching select()'s criteria."""
+        return self.take(self.select(start, end, owner, key_prefix))
+
+
+# -------------------------------------------------------------------
+class TimeStamper(object):
+    """
+    Formats the local date and time prefixed to log lines.
+
+    Formatting the date and time is the most expensive part of logging
+    a message, so the formatted second is cached and only redone when
+    the wall-clock second changes.  precision is the number of digits
+    of the fraction of a second to append: 0, 3 or 6.
+    """
+
+    __slots__ = ('_precision', '_cache', )
+
+    def __init__(self, precision=0):
+        if precision not in (0, 3, 6):
+            raise ValueError('timestamp precision must be 0, 3 or 6')
+        self._precision = precision
+        # the second and its formatting, replaced together so that
+        # other threads never see one without the other
+        self._cache = (None, '')
+
+    @property
+    def precision(self):
+        """ Return the number of digits after the seconds. """
+        return self._precision
+
+    def stamp(self, now=None):
+        """
+        Return now, by default the current time, in seconds since the
+        epoch, as 'YYYY-MM-DD HH:MM:SS', followed if precision is not
+        zero by a decimal point and that many digits.
+        """
+        if now is None:
+            now = time.time()
+        second = int(now)
+        cached_second, text = self._cache
+        if second != cached_second:
+            text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+            self._cache = (second, text)
+        if self._precision:
+            fraction = int((now - second) * 10 ** self._precision)
+            return '%s.%0*d' % (text, self._precision, fraction)
+        return text
+
+
+def _nbytes(nbytes):
+    """
+    Translate the nbytes of a log_raw() call, None for the whole
+    message, into what the extension takes, a negative count.
+    """
+    return -1 if nbytes is None else nbytes
+
 
 # -------------------------------------------------------------------
 class ActualLog(object):
     """ Maintains information about each open log """
 
-    def __init__(self, base_name, mgr):
+    def __init__(self, base_name, mgr, policy=BLOCK_ON_FULL,
+                 buf_size=log_buffer_size, buf_count=log_buf_count,
+                 precision=0, **options):
         """
         Creates a new access log. The caller guarantees that the
         base name is unique.
+
+        Each message logged with log() or log_many() is prefixed with
+        the local date and time, to the second or, if precision is 3 or
+        6, to the millisecond or microsecond.
+
+        The policy says what a producer does if every buffer is full
+        because the writer thread has fallen behind: wait for it
+        (BLOCK_ON_FULL), add buffers (GROW_ON_FULL), or discard the
+        message (DROP_ON_FULL).
+
+        Messages are buffered in buf_count pages of buf_size bytes each
+        until the writer thread gets them to disk.  A message larger
+        than a page is spread over several.
+
+        Any other keyword options, such as durability, are passed on to
+        open_cft_log(); they are described in the module docstring.
+
+        Logs survive os.fork(): buffers are written out before the
+        fork, and the child gets writer threads of its own, which write
+        what it logs to the same files, except for shared logs.
         """
         # __slots__ = { '__baseName',
         self._base_name = base_name
         self._mgr = mgr
         self._log_file = os.path.join(mgr.log_dir, base_name + '.log')
         self._lfd = None
+        self._stamper = TimeStamper(precision)
 
         # we pass the full path name
         self.name_copy = self._log_file.strip()   # should copy the string
         # DEBUG
         # print("trying to open log with path '%s'" % self.nameCopy)
         # END
-        lfd = open_cft_log(self.name_copy)
+        lfd = open_cft_log(self.name_copy, policy, buf_size, buf_count,
+                           mgr=mgr.logger, **options)
         if lfd < 0:
-            raise RuntimeError("ERROR: init_cft_logger returns %d", lfd)
+            raise RuntimeError("ERROR: init_cft_logger returns %d" % lfd)
         else:
             # DEBUG
             # print("opened %s successfully with lfd %d" % (
@@ -135,15 +594,22 @@ class ActualLog(object):
         """ Return the manager responsible for the log. """
         return self._mgr
 
+    def _handle(self):
+        """ Return the file handle, raising ValueError if it is closed. """
+        if self._lfd is None:
+            raise ValueError('log %s is closed' % self._base_name)
+        return self._lfd
+
+    def _format(self, msg):
+        """ Prefix a message with the local date and time. """
+        return '%s %s\n' % (self._stamper.stamp(), msg)
+
     def log(self, msg):
         """ Log a message. """
-        now = time.localtime()
-        date = time.strftime('%Y-%m-%d', now)
-        hours = time.strftime('%H:%M:%S', now)
-        text = '%s %s %s\n' % (date, hours, msg)
+        text = self._format(msg)
         # note that this is a tuple
         # status =
-        log_msg(self._lfd, text)
+        log_msg(self._handle(), text)
 
         # XXX handle possible errors
 
@@ -152,34 +618,179 @@ class ActualLog(object):
 #       # END
         return text
 
+    def log_raw(self, data, nbytes=None):
+        """
+        Log a bytes-like object (bytes, bytearray, memoryview, ...) as is:
+        no timestamp is added and no newline appended, so the caller may
+        use its own, possibly binary, record framing.  If nbytes is
+        specified only that many leading bytes of data are logged.
+        """
+        log_msg(self._handle(), data, _nbytes(nbytes))
+
+    def log_many(self, msgs):
+        """
+        Log a batch of messages with a single call into the C extension,
+        which appends them all under one acquisition of the buffer lock.
+        The messages all carry the same timestamp.  Returns the text
+        written.
+        """
+        prefix = self._stamper.stamp()
+        texts = ['%s %s\n' % (prefix, msg) for msg in msgs]
+        log_msgs(self._handle(), texts)
+        return ''.join(texts)
+
+    def stats(self):
+        """
+        Return a dict of counters: messages logged ('count'), how often
+        producers had to wait for a free buffer ('blocked'), buffers
+        added to the ring ('grown'), messages discarded ('dropped'), the
+        number of buffers now in the ring ('pages'), the number of
+        flushes, write syscalls, bytes written and syncs made by the
+        writer thread ('flushes', 'writes', 'bytes_written', 'syncs'),
+        the seconds it has spent writing and syncing ('flush_time'), the
+        number of times it has rotated the log file ('rotations'), the
+        messages producers dropped because the log's shared-memory ring
+        was full ('shm_dropped'), and the bytes a crashed run of a
+        recoverable log left unwritten and open appended ('recovered').
+        """
+        return log_stats(self._handle())
+
+    def flush(self, wait=True):
+        """
+        Have the writer thread write out everything logged so far and
+        get it onto the disk, whatever the log's durability mode.  If
+        wait is true, block until that is done, returning 0 or -1 if a
+        write or sync failed; otherwise return 0 at once.
+        """
+        return flush_cft_log(self._handle(), wait)
+
+    def close(self):
+        """
+        Write out everything logged, close the log file and forget the
+        log, leaving the manager's other logs open.  Its slot in the
+        extension's table is reused by the next log opened, and a log
+        with the same base name may then be opened again.  Returns 0 or
+        -1 if the final write or sync failed.
+        """
+        status = close_cft_log(self._handle())
+        self._mgr._forget(self)           # pylint: disable=protected-access
+        self._lfd = None
+        return status
+
+    def _detach(self):
+        """
+        Forget the handle of a log closed by LogMgr.close(), whose slot
+        may be reused by a log opened later.
+        """
+        self._lfd = None
+
+    @property
+    def closed(self):
+        """ Return whether the log has been closed. """
+        return self._lfd is None
+
     @property
     def log_file_name(self):
         """ Return a copy of the log file's name. """
         return self.name_copy
 
 
+
+class ShmProducer(object):
+    """
+    Logs into the shared-memory ring of a log opened, perhaps by another
+    process, with shm_name set to name.  Messages are copied into the
+    ring without locking or any system call, and the writer thread of
+    the process which opened the log writes them out at its next tick.
+    Messages from different producers may interleave, but each is
+    written whole and, from any one thread, in order.
+
+    policy says what to do when the ring is full: wait for the writer
+    to empty it (BLOCK_ON_FULL) or discard the message (DROP_ON_FULL).
+    Messages are timestamped as by ActualLog.
+    """
+
+    def __init__(self, name, policy=BLOCK_ON_FULL, precision=0):
+        self._name = name
+        self._ring = attach_cft_shm(name, policy)
+        self._stamper = TimeStamper(precision)
+
+    @property
+    def name(self):
+        """ Return the name of the ring. """
+        return self._name
+
+    def log(self, msg):
+        """
+        Log a message, prefixed with the local date and time.  Returns
+        the text logged, or None if it was dropped.
+        """
+        text = '%s %s\n' % (self._stamper.stamp(), msg)
+        if shm_log_msg(self._ring, text.encode('utf-8')):
+            return text
+        return None
+
+    def log_raw(self, data, nbytes=None):
+        """
+        Log a bytes-like object as is, or its first nbytes bytes.
+        Returns whether it was logged rather than dropped.
+        """
+        return shm_log_msg(self._ring, data, _nbytes(nbytes))
+
+    def stats(self):
+        """
+        Return a dict of the ring's counters: its 'slots' and the most a
+        slot will hold ('slot_bytes'), the messages logged into it
+        ('head') and written out ('tail'), those dropped ('dropped'),
+        how often producers have waited for it ('waits'), the slots the
+        writer found bad or abandoned by their producers ('errors'), and
+        whether its log has been closed ('closed').
+        """
+        return shm_stats(self._ring)
+
+    def close(self):
+        """ Detach from the ring. """
+        self._ring = None
+
+
 class LogMgr(object):
-    """ Log manager. """
+    """
+    Log manager.
+
+    Each manager has its own writer thread, which flushes each of its
+    logs every write_interval seconds, so separate subsystems may each
+    have a manager, with its own interval, without interfering, and
+    their writers may run on different cores.  A manager which is never
+    closed keeps its writer thread until it is collected with none of
+    its logs open, or until the process exits.
+    """
 
-    def __init__(self, log_dir='logs'):
+    def __init__(self, log_dir='logs', write_interval=default_write_interval):
 
         # __slots__ = { }
 
         # a map indexed by the base name of the log
         self._log_map = {}
         self._log_dir = log_dir
+        self._write_interval = write_interval
 
         # THIS IS A PARTIAL FIX: the above assumes that all logs
         # share the same directory
-        # status =
-        init_cft_logger()
+        self._logger = new_cft_logger(write_interval)
 
-    def open(self, base_name):
-        """ Open the log, possibly creating it. """
+    def open(self, base_name, policy=BLOCK_ON_FULL,
+             buf_size=log_buffer_size, buf_count=log_buf_count, **options):
+        """
+        Open the log, possibly creating it.  The policy is what a
+        producer does when the log's buffers are all full; there are
+        buf_count of them, each buf_size bytes long.  Other options,
+        such as durability, are described in the module docstring.
+        """
 
         if base_name in self._log_map:
             raise ValueError('log named %s already exists' % base_name)
-        log_handle = ActualLog(base_name, self)
+        log_handle = ActualLog(base_name, self, policy, buf_size, buf_count,
+                               **options)
         if log_handle:
             self._log_map[base_name] = log_handle
             # DEBUG
@@ -187,13 +798,35 @@ class LogMgr(object):
             # END
             return log_handle
 
+    def _forget(self, log_handle):
+        """ Drop a log closed by ActualLog.close() from the map. """
+        if self._log_map.get(log_handle.base_name) is log_handle:
+            del self._log_map[log_handle.base_name]
+
+    @property
+    def open_logs(self):
+        """ Return a dict of the logs open, by base name. """
+        return dict(self._log_map)
+
     def close(self):
         """ Closes all log files. """
+        for log_handle in self._log_map.values():
+            log_handle._detach()          # pylint: disable=protected-access
         self._log_map = {}
         # print("BRANCHING TO closeClogger()") ; sys.stdout.flush();
-        return close_cft_logger(None)
+        return close_cft_logger(self._logger)
 
     @property
     def log_dir(self):
         """ Return a path to the log directory. """
         return self._log_dir
+
+    @property
+    def write_interval(self):
+        """ Return the seconds between timed flushes of each log. """
+        return self._write_interval
+
+    @property
+    def logger(self):
+        """ Return the C extension's handle on the writer thread. """
+        return self._logger
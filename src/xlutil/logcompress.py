@@ -0,0 +1,190 @@
+# xlutil_py/src/xlutil/logcompress.py
+
+"""
+Compress rotated log files in the background and read them back.
+
+When the writer thread rotates a log, NAME.log becomes NAME.log.N.  A
+SegmentCompressor, given the old file through the log's on_rotate
+callback, compresses it on a low-priority worker thread into
+NAME.log.N.gz (zlib) or NAME.log.N.xz (lzma) and removes the original.
+open_segment() and iter_lines() read such files transparently.
+"""
+
+import gzip
+import lzma
+import os
+import queue
+import re
+import threading
+
+__all__ = ['SegmentCompressor', 'open_segment', 'segment_paths',
+           'iter_lines', 'COMPRESSED_EXTS', ]
+
+# the stdlib module used for each extension
+COMPRESSED_EXTS = {'.gz': gzip, '.xz': lzma}
+
+_METHOD_EXTS = {'zlib': '.gz', 'lzma': '.xz'}
+_CHUNK = 1024 * 1024
+
+
+def open_segment(path):
+    """
+    Open a log file or rotated segment for reading in binary mode,
+    decompressing it on the fly if its name ends in one of
+    COMPRESSED_EXTS.
+    """
+    module = COMPRESSED_EXTS.get(os.path.splitext(path)[1])
+    if module is None:
+        return open(path, 'rb')
+    return module.open(path, 'rb')
+
+
+def segment_paths(log_path):
+    """
+    Return the paths to the files of a rotated log, oldest first: the
+    numbered segments, each perhaps compressed, and then log_path
+    itself.  A segment being compressed may briefly exist in both
+    forms; the original is preferred.
+    """
+    directory = os.path.dirname(log_path) or '.'
+    name = os.path.basename(log_path)
+    pattern = re.compile(r'%s\.(\d+)(%s)?$' % (
+        re.escape(name), '|'.join(re.escape(ext) for ext in COMPRESSED_EXTS)))
+    found = {}
+    for entry in os.listdir(directory):
+        match = pattern.match(entry)
+        if match is None:
+            continue
+        number = int(match.group(1))
+        if number not in found or match.group(2) is None:
+            found[number] = os.path.join(directory, entry)
+    paths = [found[number] for number in sorted(found)]
+    if os.path.exists(log_path):
+        paths.append(log_path)
+    return paths
+
+
+def iter_lines(log_path):
+    """
+    Yield the lines of a rotated log, as bytes, oldest segment first,
+    decompressing segments as they are read.
+    """
+    for path in segment_paths(log_path):
+        with open_segment(path) as file:
+            for line in file:
+                yield line
+
+
+class SegmentCompressor(object):
+    """
+    Compresses rotated log files on a worker thread.
+
+    method is 'zlib' or 'lzma' and level the compression level, by
+    default 6.  The worker runs at the lowest scheduling priority where
+    the OS allows that per thread, trading idle CPU for disk I/O and
+    space.  Call close() to finish the files queued and stop it.
+    """
+
+    def __init__(self, method='zlib', level=6):
+        if method not in _METHOD_EXTS:
+            raise ValueError("compression method must be 'zlib' or 'lzma'")
+        self._ext = _METHOD_EXTS[method]
+        self._level = level
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._files = 0
+        self._errors = []
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='log-compressor')
+        self._thread.start()
+
+    def submit(self, path):
+        """ Queue a file to be compressed. """
+        self._queue.put(path)
+
+    def on_rotate(self, then=None):
+        """
+        Return an on_rotate callback for ActualLog which queues each
+        rotated file for compression, after first calling then, if
+        given, and returning what it returns: say the callback made by
+        xlutil.logreader.chain_linker(), which must read the old file
+        before it is compressed.
+        """
+        def callback(old_path, new_path):
+            """ Call then, if any, and queue old_path. """
+            record = None if then is None else then(old_path, new_path)
+            self.submit(old_path)
+            return record
+        return callback
+
+    def close(self, wait=True):
+        """ Stop the worker once the files queued have been compressed. """
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+    def stats(self):
+        """
+        Return a dict of the number of files compressed ('files'), the
+        bytes read and written ('bytes_in', 'bytes_out'), and the
+        paths which could not be compressed, with the reason
+        ('errors').
+        """
+        with self._lock:
+            return {'files': self._files, 'bytes_in': self._bytes_in,
+                    'bytes_out': self._bytes_out,
+                    'errors': list(self._errors)}
+
+    def _run(self):
+        """ The worker: compress files until told to stop. """
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass                        # not per thread here: run anyway
+        while True:
+            path = self._queue.get()
+            if path is None:
+                break
+            try:
+                self._compress(path)
+            except Exception as exc:    # pylint: disable=broad-except
+                # keep going: one bad file must not stop the rest
+                with self._lock:
+                    self._errors.append((path, str(exc)))
+
+    def _open(self, path):
+        """ Open path to write compressed data to. """
+        if self._ext == '.gz':
+            return gzip.open(path, 'wb', compresslevel=self._level)
+        return lzma.open(path, 'wb', preset=self._level)
+
+    def _compress(self, path):
+        """
+        Compress path to path plus the extension, replacing it only
+        once the compressed copy is complete; a partial copy is removed.
+        """
+        dest = path + self._ext
+        tmp = dest + '.tmp'
+        bytes_in = 0
+        try:
+            with open(path, 'rb') as src, self._open(tmp) as out:
+                while True:
+                    chunk = src.read(_CHUNK)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    bytes_in += len(chunk)
+            os.replace(tmp, dest)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        os.unlink(path)
+        with self._lock:
+            self._files += 1
+            self._bytes_in += bytes_in
+            self._bytes_out += os.path.getsize(dest)
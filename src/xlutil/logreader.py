@@ -0,0 +1,400 @@
+# xlutil_py/src/xlutil/logreader.py
+
+"""
+Read chained logs of binary LogEntry records.
+
+A chained log is a series of chunks, each a file of LogEntry records
+end to end.  The first record of every chunk but the oldest is a chain
+link: an entry with an empty path whose key is the content key (the
+SHA1 or SHA256 hash, depending on the key's width) of the previous
+chunk and whose length is that chunk's length.  A chain link whose key
+is all zero bytes marks the start of the chain.
+
+Each chunk may have an index beside it, in a file with INDEX_EXT
+appended to its name, mapping content keys and timestamps to the
+offsets of entries, so that lookups need not scan the whole chunk.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+from xlutil.ftlog import LogEntry, iter_unpack
+from xlutil.logcompress import COMPRESSED_EXTS, open_segment
+
+__all__ = ['LogReader', 'DirResolver', 'chain_link', 'chain_linker',
+           'content_key', 'write_index', 'INDEX_EXT', ]
+
+INDEX_EXT = '.idx'
+
+# index header: magic, version, pad, number of entries indexed, the
+# number of bytes of the chunk they cover, and the chunk's device,
+# inode and mtime in ns when it was indexed; then the key records,
+# sorted by key, and the timestamp records, sorted by timestamp
+_INDEX_MAGIC = b'FTLI'
+_INDEX_VERSION = 2
+_INDEX_HEADER = struct.Struct('>4sB3xIQQQq')
+_KEY_RECORD = struct.Struct('>32sQ')        # key padded with zeroes
+_TIME_RECORD = struct.Struct('>QQ')
+
+
+def content_key(data, width=20):
+    """
+    Return the content key of data: its SHA1 hash if width is 20,
+    otherwise its SHA256 hash.
+    """
+    if width == 20:
+        return hashlib.sha1(data).digest()
+    return hashlib.sha256(data).digest()
+
+
+def chain_link(prev_data, tstamp, owner, src):
+    """
+    Return the LogEntry linking a new chunk to the previous one, whose
+    contents are prev_data, or None for the first chunk, to the start
+    of the chain.  owner and src, which must be the same width, set the
+    width of the key.
+    """
+    width = len(owner)
+    if prev_data is None:
+        return LogEntry(tstamp, bytes(width), owner, 0, src, '')
+    return LogEntry(tstamp, content_key(prev_data, width), owner,
+                    len(prev_data), src, '')
+
+
+def chain_linker(owner, src):
+    """
+    Return an on_rotate callback for ActualLog which starts each new
+    file of a rotated log with a chain link to the file before it, so
+    that a log of binary LogEntry records written with log_raw() can be
+    read back as one by LogReader.
+    """
+    def on_rotate(old_path, _new_path):
+        """ Return the link to the file just rotated out. """
+        with open(old_path, 'rb') as file:
+            data = file.read()
+        return chain_link(data, int(time.time()), owner, src).to_bytes()
+    return on_rotate
+
+
+def _is_link(entry):
+    """ Whether an entry is a chain link rather than a logged event. """
+    return entry.path == ''
+
+
+def _map(path):
+    """
+    Return a read-only mmap of the file at path, or b'' if it is empty.
+    A compressed chunk, as written by xlutil.logcompress, is read and
+    decompressed instead.
+    """
+    if os.path.splitext(path)[1] in COMPRESSED_EXTS:
+        with open_segment(path) as file:
+            return file.read()
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _unmap(data):
+    """
+    Close data, as returned by _map(), unless views into it are still
+    alive, in which case it is closed when the last of them goes.
+    """
+    if isinstance(data, mmap.mmap):
+        try:
+            data.close()
+        except BufferError:
+            pass
+
+
+class DirResolver(object):
+    """
+    Finds chunks by content key among the files in a directory.  Each
+    file is hashed once, with the algorithm for the width of the first
+    key looked up of that width; compressed files are hashed as they
+    were before compression.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._by_width = {}
+
+    def __call__(self, key):
+        """ Return the path to the chunk with content key key, or None. """
+        key = bytes(key)
+        by_key = self._by_width.get(len(key))
+        if by_key is None:
+            by_key = self._by_width[len(key)] = {}
+            for name in sorted(os.listdir(self._directory)):
+                path = os.path.join(self._directory, name)
+                if name.endswith((INDEX_EXT, '.ring', '.tmp')) or \
+                        not os.path.isfile(path):
+                    continue
+                data = _map(path)
+                by_key[content_key(data, len(key))] = path
+                _unmap(data)
+        return by_key.get(key)
+
+
+class LogReader(object):
+    """
+    Reads a chained log, given the path to its newest chunk.
+
+    Chunks are memory-mapped and entries decoded lazily, as described
+    under LogEntry.from_buffer(), so an entry's ids are views into the
+    map, which stays open for as long as they are alive.  Chain links
+    are followed back from the newest chunk using resolve, a function
+    from content key to path; by default the chunk's directory is
+    searched.  Entries are yielded oldest chunk first; chain links
+    themselves are not yielded.
+
+    close() closes the maps; a reader may also be used as a context
+    manager, which closes it on exit.  A map which entries still refer
+    to is closed when the last of them goes.
+    """
+
+    def __init__(self, path, resolve=None):
+        self._path = path
+        if resolve is None:
+            resolve = DirResolver(os.path.dirname(path) or '.')
+        self._resolve = resolve
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def path(self):
+        """ Return the path to the newest chunk. """
+        return self._path
+
+    def close(self):
+        """ Close the chunks mapped so far. """
+        maps, self._maps = self._maps, []
+        for data in maps:
+            _unmap(data)
+
+    def _map(self, path):
+        """ Map the chunk at path, to be closed by close(). """
+        data = _map(path)
+        if isinstance(data, mmap.mmap):
+            self._maps.append(data)
+        return data
+
+    def chunks(self):
+        """
+        Return the paths to the chunks of the log, oldest first.
+        Raises ValueError if a chain link cannot be resolved.
+        """
+        paths = []
+        path = self._path
+        while path is not None:
+            if path in paths:
+                raise ValueError('log chain loops back to %s' % path)
+            paths.append(path)
+            data = _map(path)
+            if not data:
+                break
+            first, _ = LogEntry.from_buffer(data)
+            key = bytes(first.key) if _is_link(first) else None
+            del first
+            _unmap(data)
+            path = None
+            if key is not None and any(key):
+                path = self._resolve(key)
+                if path is None:
+                    raise ValueError('no chunk with key %s, linked from %s' %
+                                     (key.hex(), paths[-1]))
+        paths.reverse()
+        return paths
+
+    def __iter__(self):
+        return self.entries()
+
+    def entries(self):
+        """ Yield every entry in the log, oldest chunk first. """
+        for path in self.chunks():
+            for entry in iter_unpack(self._map(path)):
+                if not _is_link(entry):
+                    yield entry
+
+    # INDEXES -------------------------------------------------------
+
+    def build_index(self):
+        """
+        Write an index beside each chunk, replacing any already there.
+        """
+        for path in self.chunks():
+            write_index(path)
+
+    def find_key(self, key):
+        """ Yield the entries whose key is key, oldest chunk first. """
+        key = bytes(key)
+        padded = key.ljust(_KEY_RECORD.size - 8, b'\0')
+        for path in self.chunks():
+            data = self._map(path)
+            index = _Index.load(path, len(data))
+            covered = 0
+            if index is not None:
+                covered = index.covered
+                try:
+                    for offset in index.key_offsets(padded):
+                        entry, _ = LogEntry.from_buffer(data, offset)
+                        if entry.key == key:
+                            yield entry
+                finally:
+                    index.close()
+            for entry in _scan(data, covered):
+                if entry.key == key:
+                    yield entry
+
+    def time_range(self, start, end):
+        """
+        Yield the entries timestamped at or after start and before end,
+        oldest chunk first.  Within an indexed chunk they are in
+        timestamp order, otherwise in the order they were logged.
+        """
+        for path in self.chunks():
+            data = self._map(path)
+            index = _Index.load(path, len(data))
+            covered = 0
+            if index is not None:
+                covered = index.covered
+                try:
+                    for offset in index.time_offsets(start, end):
+                        entry, _ = LogEntry.from_buffer(data, offset)
+                        yield entry
+                finally:
+                    index.close()
+            for entry in _scan(data, covered):
+                if start <= entry.tstamp < end:
+                    yield entry
+
+
+def _scan(data, offset):
+    """ Yield the entries in data from offset on, skipping chain links. """
+    if offset < len(data):
+        for entry in iter_unpack(data, offset):
+            if not _is_link(entry):
+                yield entry
+
+
+def write_index(path):
+    """ Write the index of the chunk at path, returning its path. """
+    info = os.stat(path)
+    data = _map(path)
+    keys = []
+    times = []
+    offset = 0
+    while offset < len(data):
+        entry, end = LogEntry.from_buffer(data, offset)
+        if not _is_link(entry):
+            keys.append((bytes(entry.key), offset))
+            times.append((entry.tstamp, offset))
+        offset = end
+        del entry
+    covered = len(data)
+    _unmap(data)
+    keys.sort()
+    times.sort()
+    parts = [_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, len(keys),
+                                covered, info.st_dev, info.st_ino,
+                                info.st_mtime_ns)]
+    parts.extend(_KEY_RECORD.pack(key, offset) for key, offset in keys)
+    parts.extend(_TIME_RECORD.pack(tstamp, offset)
+                 for tstamp, offset in times)
+    index_path = path + INDEX_EXT
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(b''.join(parts))
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+class _Index(object):
+    """ A memory-mapped chunk index. """
+
+    def __init__(self, data, count, covered):
+        self._data = data
+        self._count = count
+        self.covered = covered
+        self._times_at = _INDEX_HEADER.size + count * _KEY_RECORD.size
+
+    @classmethod
+    def load(cls, path, chunk_len):
+        """
+        Return the index of the chunk at path, whose length is
+        chunk_len, or None if there is no usable index.  An index of an
+        earlier, shorter version of the same file is still used for the
+        part of the chunk it covers; one of another file at that path,
+        or of this one rewritten at the same length, is not.
+        """
+        try:
+            info = os.stat(path)
+            data = _map(path + INDEX_EXT)
+        except FileNotFoundError:
+            return None
+        if len(data) < _INDEX_HEADER.size:
+            _unmap(data)
+            return None
+        magic, version, count, covered, dev, ino, mtime_ns = \
+            _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION or \
+                (dev, ino) != (info.st_dev, info.st_ino) or \
+                covered > chunk_len or (covered == chunk_len and
+                                        mtime_ns != info.st_mtime_ns) or \
+                len(data) != _INDEX_HEADER.size + \
+                count * (_KEY_RECORD.size + _TIME_RECORD.size):
+            _unmap(data)
+            return None
+        return cls(data, count, covered)
+
+    def close(self):
+        """ Close the index's map. """
+        _unmap(self._data)
+
+    def _key_at(self, ndx):
+        return _KEY_RECORD.unpack_from(
+            self._data, _INDEX_HEADER.size + ndx * _KEY_RECORD.size)
+
+    def _time_at(self, ndx):
+        return _TIME_RECORD.unpack_from(
+            self._data, self._times_at + ndx * _TIME_RECORD.size)
+
+    def _bisect(self, record_at, value):
+        """ Return the first ndx whose record_at(ndx)[0] >= value. """
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if record_at(mid)[0] < value:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def key_offsets(self, padded):
+        """ Yield the offsets of entries whose padded key is padded. """
+        ndx = self._bisect(self._key_at, padded)
+        while ndx < self._count:
+            key, offset = self._key_at(ndx)
+            if key != padded:
+                break
+            yield offset
+            ndx += 1
+
+    def time_offsets(self, start, end):
+        """ Yield the offsets of entries with start <= tstamp < end. """
+        ndx = self._bisect(self._time_at, start)
+        while ndx < self._count:
+            tstamp, offset = self._time_at(ndx)
+            if tstamp >= end:
+                break
+            yield offset
+            ndx += 1
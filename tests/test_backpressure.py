@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_backpressure.py
+
+""" Test what producers do when every log buffer is full. """
+
+import os
+import shutil
+import sys
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import log_msgs
+from xlutil.ftlog import LogMgr, BLOCK_ON_FULL, GROW_ON_FULL, DROP_ON_FULL
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'backpressure')
+LINE = b"padding ljlkjk;ljlj;k;lklj;j;kjkljklj %06x\n"
+
+# a batch is copied under a single acquisition of the buffer lock, so
+# the writer cannot free any pages while it is being copied
+BATCH = [LINE % n__ for n__ in range(8 * 1024)]       # 360 KB
+
+
+class TestBackpressure(unittest.TestCase):
+    """ Test what producers do when every log buffer is full. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        pass
+
+    def read_log(self, logger):
+        """ Close the manager and return the log's contents. """
+        self.mgr.close()
+        with open(logger.log_file_name, 'rb') as file:
+            return file.read()
+
+    def test_block(self):
+        """ Producers wait for the writer and nothing is lost. """
+
+        logger = self.mgr.open('block', BLOCK_ON_FULL)
+        log_msgs(logger.lfd, BATCH)
+        stats = logger.stats()
+        print("\nBLOCK_ON_FULL: %s" % stats)
+        self.assertEqual(len(BATCH), stats['count'])
+        self.assertTrue(stats['blocked'] > 0)
+        self.assertEqual(0, stats['grown'])
+        self.assertEqual(0, stats['dropped'])
+        self.assertEqual(b''.join(BATCH), self.read_log(logger))
+
+    def test_grow(self):
+        """ The ring grows instead of blocking, up to its limit. """
+
+        logger = self.mgr.open('grow', GROW_ON_FULL)
+        log_msgs(logger.lfd, BATCH)
+        stats = logger.stats()
+        print("\nGROW_ON_FULL: %s" % stats)
+        self.assertEqual(len(BATCH), stats['count'])
+        self.assertEqual(0, stats['blocked'])
+        self.assertTrue(stats['grown'] > 0)
+        self.assertEqual(4 + stats['grown'], stats['pages'])
+        self.assertEqual(0, stats['dropped'])
+        self.assertEqual(b''.join(BATCH), self.read_log(logger))
+
+    def test_drop(self):
+        """ Messages that don't fit are discarded and counted. """
+
+        logger = self.mgr.open('drop', DROP_ON_FULL)
+        log_msgs(logger.lfd, BATCH)
+        stats = logger.stats()
+        print("\nDROP_ON_FULL: %s" % stats)
+        self.assertTrue(stats['dropped'] > 0)
+        self.assertEqual(len(BATCH), stats['count'] + stats['dropped'])
+        self.assertEqual(0, stats['blocked'])
+        self.assertEqual(0, stats['grown'])
+        # what was kept is an unbroken prefix of the batch
+        contents = self.read_log(logger)
+        self.assertEqual(b''.join(BATCH[:stats['count']]), contents)
+
+    def test_bad_policy(self):
+        """ An unknown policy is refused. """
+
+        with self.assertRaises(ValueError):
+            self.mgr.open('bad', 17)
+        self.mgr.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
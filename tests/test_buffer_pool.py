@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_buffer_pool.py
+
+""" Test logs opened with non-default buffer sizes and counts. """
+
+import os
+import shutil
+import sys
+import threading
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import log_msgs, log_buffer_size, log_buf_count
+from xlutil.ftlog import LogMgr, BLOCK_ON_FULL, GROW_ON_FULL, DROP_ON_FULL
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'buffer_pool')
+
+
+class TestBufferPool(unittest.TestCase):
+    """ Test logs opened with non-default buffer sizes and counts. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        pass
+
+    def read_log(self, logger):
+        """ Close the manager and return the log's contents. """
+        self.mgr.close()
+        with open(logger.log_file_name, 'rb') as file:
+            return file.read()
+
+    def test_defaults(self):
+        """ The defaults are the historical 4 pages of 16 KiB. """
+
+        self.assertEqual(16 * 1024, log_buffer_size)
+        self.assertEqual(4, log_buf_count)
+        self.mgr.close()
+
+    def test_large_pool(self):
+        """ A log with 8 MiB of buffers takes 4 MiB without blocking. """
+
+        logger = self.mgr.open('large', buf_size=1024 * 1024, buf_count=8)
+        record = b'x' * 1023 + b'\n'
+        batch = [record] * 4096
+        log_msgs(logger.lfd, batch)
+        stats = logger.stats()
+        self.assertEqual(4096, stats['count'])
+        self.assertEqual(0, stats['blocked'])
+        self.assertEqual(8, stats['pages'])
+        self.assertEqual(b''.join(batch), self.read_log(logger))
+
+    def test_message_larger_than_ring(self):
+        """
+        A message larger than all the default buffers together spans
+        pages, waiting for the writer part way through, and arrives
+        unbroken.
+        """
+        logger = self.mgr.open('huge')
+        logger.log('before')
+        big = bytes(range(256)) * 1024              # 256 KiB
+        logger.log_raw(big)
+        logger.log('after')
+        stats = logger.stats()
+        self.assertEqual(3, stats['count'])
+        self.assertTrue(stats['blocked'] > 0)
+        contents = self.read_log(logger)
+        first = contents.index(b'before\n') + len(b'before\n')
+        self.assertEqual(big, contents[first:first + len(big)])
+        self.assertTrue(contents.endswith(b'after\n'))
+
+    def test_spanning_with_threads(self):
+        """
+        Messages several times the page size, logged from many threads,
+        are never interleaved with one another.
+        """
+        logger = self.mgr.open('threads', buf_size=256, buf_count=4)
+        thread_count = 6
+        msg_count = 20
+
+        def producer(tag):
+            """ Log msg_count messages each about 1 KiB long. """
+            for n__ in range(msg_count):
+                body = ('%d:%02d:' % (tag, n__)) * 128
+                logger.log_raw((body + '\n').encode('ascii'))
+
+        threads = [threading.Thread(target=producer, args=(t__,))
+                   for t__ in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        lines = self.read_log(logger).decode('ascii').splitlines()
+        self.assertEqual(thread_count * msg_count, len(lines))
+        for line in lines:
+            unit = line[:line.index(':', line.index(':') + 1) + 1]
+            self.assertEqual(unit * 128, line)
+
+    def test_oversize_dropped_whole(self):
+        """
+        With DROP_ON_FULL a message which cannot fit in the free pages
+        is dropped whole, never truncated.
+        """
+        logger = self.mgr.open('drop', DROP_ON_FULL, 128, 2)
+        logger.log_raw(b'y' * 200 + b'\n')          # spans 2 pages
+        logger.log_raw(b'z' * 300 + b'\n')          # can never fit
+        stats = logger.stats()
+        self.assertEqual(1, stats['count'])
+        self.assertEqual(1, stats['dropped'])
+        self.assertEqual(b'y' * 200 + b'\n', self.read_log(logger))
+
+    def test_bad_sizes(self):
+        """
+        Page sizes and counts out of range are refused, saying which.
+        """
+
+        for size, count in ((32, 4), (1024, 1), (2 ** 31, 4), (1024, -1),
+                            (1024, 10 ** 6)):
+            with self.assertRaises(ValueError):
+                self.mgr.open('bad%d_%d' % (size, count),
+                              buf_size=size, buf_count=count)
+        with self.assertRaisesRegex(ValueError, 'buf_size 1 '):
+            self.mgr.open('tiny', buf_size=1)
+        self.mgr.close()
+
+    def test_pool_too_large(self):
+        """
+        A page size and count each in range but together taking more
+        than 4 GiB, or able to grow to that, are refused.
+        """
+        for policy, size, count in ((BLOCK_ON_FULL, 2 ** 30, 5),
+                                    (BLOCK_ON_FULL, 2 ** 20, 2 ** 13),
+                                    (GROW_ON_FULL, 2 ** 27, 4)):
+            with self.assertRaises(ValueError):
+                self.mgr.open('big%d_%d' % (size, count), policy,
+                              buf_size=size, buf_count=count)
+        self.mgr.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -49,7 +49,7 @@ class TestCLogObj(unittest.TestCase):
         if version >= '0.5.1':
             print(" %s" % xlattice.__version_date__)
             # pylint: disable=no-member
-            self.assertEqual(16, cFTLogForPy.max_log)
+            self.assertEqual(64 * 1024, cFTLogForPy.max_log)
         else:
             print(" THIS IS AN OLD VERSION OF THE LIBRARY")
 
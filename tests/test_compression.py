@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_compression.py
+
+""" Test background compression of rotated log files. """
+
+import hashlib
+import os
+import shutil
+import sys
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import log_msgs
+from xlutil.ftlog import LogMgr, LogEntry
+from xlutil.logcompress import SegmentCompressor, iter_lines, segment_paths
+from xlutil.logreader import LogReader, chain_linker
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'compression')
+LINE = b"2017-07-14 02:40:00 GET /index.html 200 %08x\n"
+OWNER = b'o' * 20
+SRC = b's' * 20
+
+
+class TestCompression(unittest.TestCase):
+    """ Test background compression of rotated log files. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        pass
+
+    def do_test_method(self, method, ext):
+        """ Log, rotate and compress; read everything back. """
+
+        compressor = SegmentCompressor(method)
+        logger = self.mgr.open(method, rotate_bytes=64 * 1024,
+                               on_rotate=compressor.on_rotate())
+        batches = [[LINE % (b__ * 1000 + n__) for n__ in range(1000)]
+                   for b__ in range(10)]
+        for batch in batches:
+            log_msgs(logger.lfd, batch)
+            logger.flush()
+        self.mgr.close()
+        compressor.close()
+
+        stats = compressor.stats()
+        print("\n%s: %d files, %d bytes compressed to %d (%.1fx)" % (
+            method, stats['files'], stats['bytes_in'], stats['bytes_out'],
+            stats['bytes_in'] / max(stats['bytes_out'], 1)))
+        self.assertEqual([], stats['errors'])
+        paths = segment_paths(logger.log_file_name)
+        self.assertEqual(stats['files'] + 1, len(paths))
+        for path in paths[:-1]:
+            self.assertTrue(path.endswith(ext))
+        self.assertTrue(stats['bytes_out'] * 5 < stats['bytes_in'])
+        expected = [line for batch in batches for line in batch]
+        self.assertEqual(expected, list(iter_lines(logger.log_file_name)))
+
+    def test_zlib(self):
+        """ Segments compressed with zlib are read back transparently. """
+        self.do_test_method('zlib', '.gz')
+
+    def test_lzma(self):
+        """ Segments compressed with lzma are read back transparently. """
+        self.do_test_method('lzma', '.xz')
+
+    def test_chained_and_compressed(self):
+        """ LogReader follows a chain through compressed segments. """
+
+        compressor = SegmentCompressor()
+        logger = self.mgr.open(
+            'chain', rotate_bytes=4096,
+            on_rotate=compressor.on_rotate(chain_linker(OWNER, SRC)))
+        entries = [LogEntry(1500000000 + n__,
+                            hashlib.sha1(b'%d' % n__).digest(), OWNER,
+                            n__, SRC, 'file%d' % n__)
+                   for n__ in range(300)]
+        for n__, entry in enumerate(entries):
+            logger.log_raw(entry.to_bytes())
+            if n__ % 50 == 49:
+                logger.flush()
+        self.mgr.close()
+        compressor.close()
+        reader = LogReader(logger.log_file_name)
+        chunks = reader.chunks()
+        self.assertTrue(len(chunks) > 2)
+        self.assertTrue(all(path.endswith('.gz') for path in chunks[:-1]))
+        self.assertEqual(entries, list(reader))
+
+    def test_errors(self):
+        """
+        A file which cannot be compressed is recorded in the errors,
+        whatever the exception, and leaves no partial copy behind; the
+        worker goes on to the next.
+        """
+        os.makedirs(PATH_TO_LOGS)
+        path = os.path.join(PATH_TO_LOGS, 'segment.log.1')
+        with open(path, 'wb') as file:
+            file.write(LINE * 100)
+        missing = os.path.join(PATH_TO_LOGS, 'missing.log.1')
+        for method, ext in (('zlib', '.gz'), ('lzma', '.xz')):
+            compressor = SegmentCompressor(method, level=99)
+            compressor.submit(missing)
+            compressor.submit(path)
+            compressor.close()
+            stats = compressor.stats()
+            self.assertEqual([missing, path],
+                             [err[0] for err in stats['errors']])
+            self.assertEqual(0, stats['files'])
+            self.assertEqual(['segment.log.1'], os.listdir(PATH_TO_LOGS))
+        compressor = SegmentCompressor()
+        compressor.submit(path)
+        compressor.close()
+        self.assertEqual([], compressor.stats()['errors'])
+        self.assertEqual(['segment.log.1.gz'], os.listdir(PATH_TO_LOGS))
+        self.mgr.close()
+
+    def test_bad_method(self):
+        """ Only zlib and lzma are offered. """
+
+        with self.assertRaises(ValueError):
+            SegmentCompressor('bz2')
+        self.mgr.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
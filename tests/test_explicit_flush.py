@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_explicit_flush.py
+
+""" Test explicit flushes and the high-water mark. """
+
+import os
+import shutil
+import sys
+import time
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import flush_cft_log, log_msgs
+from xlutil.ftlog import LogMgr, SYNC_NONE
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'explicit_flush')
+LINE = b"padding ljlkjk;ljlj;k;lklj;j;kjkljklj %08x\n"
+
+
+def file_bytes(logger):
+    """ Return what has reached the log file so far. """
+    with open(logger.log_file_name, 'rb') as file:
+        return file.read()
+
+
+class TestExplicitFlush(unittest.TestCase):
+    """ Test explicit flushes and the high-water mark. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        pass
+
+    def test_flush_and_wait(self):
+        """
+        After flush() returns, everything logged, including the partly
+        filled active page, is in the file.
+        """
+        logger = self.mgr.open('wait')
+        logger.log_raw(b'first\n')
+        t00 = time.perf_counter()
+        self.assertEqual(0, logger.flush())
+        elapsed = time.perf_counter() - t00
+        print("\nflush(wait=True) took %.3f ms" % (elapsed * 1000))
+        self.assertEqual(b'first\n', file_bytes(logger))
+
+        logger.log_raw(b'second\n')
+        self.assertEqual(0, flush_cft_log(logger.lfd))
+        self.assertEqual(b'first\nsecond\n', file_bytes(logger))
+        self.assertTrue(logger.stats()['syncs'] >= 2)
+        self.mgr.close()
+
+    def test_flush_without_waiting(self):
+        """ flush(wait=False) returns at once; the data follows shortly. """
+
+        logger = self.mgr.open('nowait')
+        logger.log_raw(b'hello\n')
+        self.assertEqual(0, logger.flush(wait=False))
+        for _ in range(100):
+            if file_bytes(logger) == b'hello\n':
+                break
+            time.sleep(0.001)
+        self.assertEqual(b'hello\n', file_bytes(logger))
+        self.mgr.close()
+
+    def test_flush_syncs_with_durability_none(self):
+        """ An explicit flush syncs even if the log never would itself. """
+
+        logger = self.mgr.open('none', durability=SYNC_NONE)
+        logger.log_raw(b'x\n')
+        logger.flush()
+        self.assertEqual(1, logger.stats()['syncs'])
+        self.mgr.close()
+
+    def test_flush_bad_index(self):
+        """ Flushing a log which is not open is an error. """
+
+        with self.assertRaises(ValueError):
+            flush_cft_log(17)
+        self.mgr.close()
+
+    def test_high_water(self):
+        """
+        With a high-water mark of one page, a filled page is written at
+        once instead of at the writer's next tick.
+        """
+        batch = [LINE % n__ for n__ in range(512)]        # over a page
+        expected = b''.join(batch)
+        timer = self.mgr.open('timer')
+        eager = self.mgr.open('eager', high_water=1)
+        for logger in (timer, eager):
+            log_msgs(logger.lfd, batch)
+        time.sleep(0.02)            # well inside WRITE_INTERVAL
+        print("\nafter 20 ms: %d bytes on disk with the timer alone, "
+              "%d with high_water=1" % (
+                  len(file_bytes(timer)), len(file_bytes(eager))))
+        self.assertTrue(len(file_bytes(eager)) > 0)
+        self.mgr.close()
+        for logger in (timer, eager):
+            self.assertEqual(expected, file_bytes(logger))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_flush.py
+
+""" Test and benchmark the writer thread's flushing of log buffers. """
+
+import os
+import shutil
+import sys
+import time
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import log_msgs
+from xlutil.ftlog import (
+    LogMgr, SYNC_FSYNC, SYNC_FDATASYNC, SYNC_ASYNC, SYNC_GROUP, SYNC_NONE)
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'flush')
+LINE = b"padding ljlkjk;ljlj;k;lklj;j;kjkljklj %08x\n"
+
+
+class TestFlush(unittest.TestCase):
+    """ Test and benchmark the writer thread's flushing of log buffers. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        pass
+
+    def read_log(self, logger):
+        """ Close the manager and return the log's contents. """
+        self.mgr.close()
+        with open(logger.log_file_name, 'rb') as file:
+            return file.read()
+
+    def test_one_writev_per_flush(self):
+        """
+        Several FULL pages and the active page go to disk together, in
+        a single write syscall.
+        """
+        logger = self.mgr.open('gather')
+        batch = [LINE % n__ for n__ in range(1000)]       # 3 pages
+        log_msgs(logger.lfd, batch)
+        time.sleep(0.3)
+        stats = logger.stats()
+        self.assertEqual(1, stats['flushes'])
+        self.assertEqual(1, stats['writes'])
+        self.assertEqual(len(b''.join(batch)), stats['bytes_written'])
+        self.assertEqual(b''.join(batch), self.read_log(logger))
+
+    def test_keeps_up_with_megabytes_per_second(self):
+        """
+        With large pages a 100 ms writer interval drains a log written
+        at several MB/s without producers ever having to wait.
+        """
+        logger = self.mgr.open('fast', buf_size=1024 * 1024, buf_count=8)
+        batch = [LINE % n__ for n__ in range(1024)]       # 48 KiB
+        expected = b''.join(batch)
+        batches = 0
+        t00 = time.perf_counter()
+        while time.perf_counter() - t00 < 1.5:
+            log_msgs(logger.lfd, batch)
+            batches += 1
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - t00
+        stats = logger.stats()
+        print("\n%.1f MB/s logged; %d flushes, %.2f writes/flush, "
+              "%d blocked" % (
+                  batches * len(expected) / elapsed / 1e6,
+                  stats['flushes'],
+                  stats['writes'] / max(stats['flushes'], 1),
+                  stats['blocked']))
+        self.assertEqual(0, stats['blocked'])
+        self.assertEqual(stats['flushes'], stats['writes'])
+        self.assertEqual(expected * batches, self.read_log(logger))
+
+    def test_durability_modes(self):
+        """
+        Log the same traffic under each durability mode, checking that
+        the data is complete and comparing the time the writer spends
+        flushing.
+        """
+        batch = [LINE % n__ for n__ in range(256)]        # 12 KiB
+        expected = b''.join(batch)
+        modes = (('fsync', SYNC_FSYNC, {}),
+                 ('fdatasync', SYNC_FDATASYNC, {}),
+                 ('async', SYNC_ASYNC, {}),
+                 ('group', SYNC_GROUP, {'group_ms': 250,
+                                        'group_bytes': 1024 * 1024}),
+                 ('none', SYNC_NONE, {}), )
+        logs = [(name, self.mgr.open(name, durability=mode, **extra))
+                for name, mode, extra in modes]
+        rounds = 10
+        for _ in range(rounds):
+            for _, logger in logs:
+                log_msgs(logger.lfd, batch)
+            time.sleep(0.12)        # a flush per round
+        print()
+        syncs = {}
+        for name, logger in logs:
+            stats = logger.stats()
+            syncs[name] = stats['syncs']
+            print("%-10s %3d flushes %3d syncs %8.3f ms/flush" % (
+                name, stats['flushes'], stats['syncs'],
+                1000 * stats['flush_time'] / max(stats['flushes'], 1)))
+        self.assertEqual(0, syncs['none'])
+        self.assertTrue(syncs['group'] < syncs['fsync'])
+        self.assertTrue(syncs['group'] < syncs['fdatasync'])
+        self.mgr.close()
+        for _, logger in logs:
+            with open(logger.log_file_name, 'rb') as file:
+                self.assertEqual(expected * rounds, file.read())
+
+    def test_bad_durability(self):
+        """ An unknown durability mode is refused. """
+
+        with self.assertRaises(ValueError):
+            self.mgr.open('bad', durability=SYNC_NONE + 1)
+        self.mgr.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_fork.py
+
+""" Test logging from processes forked while logs are open. """
+
+import os
+import shutil
+import sys
+import threading
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import quiesce_cft_loggers
+from xlutil.ftlog import LogMgr, SYNC_NONE, ENGINE_MPSC
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'fork')
+
+
+class TestFork(unittest.TestCase):
+    """ Test logging from processes forked while logs are open. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        self.mgr.close()
+
+    def read(self, base_name):
+        """ Return the lines of a log file. """
+        with open(os.path.join(PATH_TO_LOGS, base_name + '.log'), 'rb') as file:
+            return file.read().splitlines()
+
+    def fork(self, child):
+        """ Run child() in a child process, returning its pid. """
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                child()
+                code = 0
+            finally:
+                os._exit(code)          # pylint: disable=protected-access
+        return pid
+
+    def wait(self, pid):
+        """ Check that a child process exited cleanly. """
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+
+    def test_child_gets_its_own_writer(self):
+        """
+        What was buffered before the fork is written once, by the parent;
+        a child's writer writes what it logs afterwards, and both go on
+        logging to the same file.
+        """
+        logger = self.mgr.open('private', durability=SYNC_NONE)
+        logger.log_raw(b'before\n')             # still buffered
+
+        def child():
+            """ Log, then close, which waits for the child's writer. """
+            logger.log_raw(b'child\n')
+            self.assertEqual(0, logger.flush())
+            self.assertEqual(0, self.mgr.close())
+
+        self.wait(self.fork(child))
+        logger.log_raw(b'parent\n')
+        self.assertEqual(0, logger.close())
+        self.assertEqual([b'before', b'child', b'parent'],
+                         self.read('private'))
+
+    def test_no_sync_at_fork(self):
+        """
+        What is buffered is written before a fork, but not synced unless
+        the log's durability mode calls for it.
+        """
+        logger = self.mgr.open('nosync', durability=SYNC_NONE)
+        logger.log_raw(b'before the fork\n')
+        quiesce_cft_loggers()
+        self.assertEqual([b'before the fork'], self.read('nosync'))
+        self.assertEqual(0, logger.stats()['syncs'])
+        self.assertEqual(0, logger.flush())
+        self.assertEqual(1, logger.stats()['syncs'])
+
+    def test_shared_log(self):
+        """
+        Children log into a shared log's buffers without a writer of
+        their own; the parent's writer writes out everything they log.
+        """
+        logger = self.mgr.open('shared', durability=SYNC_NONE, shared=True,
+                               buf_size=4096, buf_count=4)
+        children, lines = 4, 2000
+
+        def child(number):
+            """ Log lines into the shared buffers and exit. """
+            for n__ in range(lines):
+                logger.log_raw(b'child %d line %d\n' % (number, n__))
+            with self.assertRaises(ValueError):
+                logger.close()
+
+        pids = [self.fork(lambda n=n__: child(n)) for n__ in range(children)]
+        for pid in pids:
+            self.wait(pid)
+        self.assertEqual(children * lines, logger.stats()['count'])
+        self.assertEqual(0, logger.close())
+        got = self.read('shared')
+        self.assertEqual(children * lines, len(got))
+        for number in range(children):
+            mine = [line for line in got
+                    if line.startswith(b'child %d ' % number)]
+            self.assertEqual([b'child %d line %d' % (number, n__)
+                              for n__ in range(lines)], mine)
+
+
+    def test_mpsc_ring(self):
+        """
+        A child forked while another thread is logging into a byte ring
+        starts with the ring empty: it writes only what it logs itself,
+        and the parent writes each of its own lines once.
+        """
+        logger = self.mgr.open('mpsc', durability=SYNC_NONE,
+                               engine=ENGINE_MPSC, ring_size=64 * 1024)
+        lines = 20000
+        started = threading.Event()
+
+        def producer():
+            """ Log lines from a second thread, across the fork. """
+            for n__ in range(lines):
+                logger.log_raw(b'thread line %d\n' % n__)
+                if n__ == 100:
+                    started.set()
+
+        thread = threading.Thread(target=producer)
+        thread.start()
+        started.wait()
+
+        def child():
+            """ Log, then close, which waits for the child's writer. """
+            logger.log_raw(b'child\n')
+            self.assertEqual(0, logger.flush())
+            self.assertEqual(0, self.mgr.close())
+
+        pid = self.fork(child)
+        thread.join()
+        self.wait(pid)
+        self.assertEqual(0, logger.close())
+        got = self.read('mpsc')
+        self.assertEqual(1, got.count(b'child'))
+        self.assertEqual([b'thread line %d' % n__ for n__ in range(lines)],
+                         [line for line in got if line != b'child'])
+
+    def test_thread_bufs(self):
+        """
+        A child forked while another thread is staging messages drops
+        the staging buffers: it writes only what it logs itself, and the
+        parent writes each of its own lines once.
+        """
+        logger = self.mgr.open('staged', durability=SYNC_NONE,
+                               thread_bufs=True)
+        lines = 20000
+        started = threading.Event()
+
+        def producer():
+            """ Log lines from a second thread, across the fork. """
+            for n__ in range(lines):
+                logger.log_raw(b'thread line %d\n' % n__)
+                if n__ == 100:
+                    started.set()
+
+        thread = threading.Thread(target=producer)
+        thread.start()
+        started.wait()
+
+        def child():
+            """ Log, then close, which waits for the child's writer. """
+            logger.log_raw(b'child\n')
+            self.assertEqual(0, logger.flush())
+            self.assertEqual(0, self.mgr.close())
+
+        pid = self.fork(child)
+        thread.join()
+        self.wait(pid)
+        self.assertEqual(0, logger.close())
+        got = self.read('staged')
+        self.assertEqual(1, got.count(b'child'))
+        self.assertEqual([b'thread line %d' % n__ for n__ in range(lines)],
+                         [line for line in got if line != b'child'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_frames.py
+
+""" Test framed logs and recovering their torn tails. """
+
+import os
+import random
+import shutil
+import sys
+import time
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import log_msgs
+from xlutil.ftlog import LogMgr, SYNC_NONE, ENGINE_MPSC
+from xlutil.frames import (
+    FRAME_HEADER, crc32c, frame, iter_frames, scan_file, recover_tail)
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'frames')
+
+
+def slow_crc32c(data):
+    """ CRC32C a bit at a time, to check the fast one against. """
+    crc = 0xffffffff
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82f63b78 if crc & 1 else crc >> 1
+    return crc ^ 0xffffffff
+
+
+class TestFrames(unittest.TestCase):
+    """ Test framed logs and recovering their torn tails. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        self.mgr.close()
+
+    def path(self, base_name):
+        """ Return the path to a log file. """
+        return os.path.join(PATH_TO_LOGS, base_name + '.log')
+
+    def read(self, base_name):
+        """ Return the contents of a log file. """
+        with open(self.path(base_name), 'rb') as file:
+            return file.read()
+
+    def test_crc32c(self):
+        """
+        The CRC is CRC32C, whatever the length and alignment of the
+        data, and may be computed piecemeal.
+        """
+        self.assertEqual(0xe3069283, crc32c(b'123456789'))
+        rng = random.Random(42)
+        data = bytes(rng.getrandbits(8) for _ in range(256))
+        for _ in range(200):
+            start = rng.randrange(16)
+            end = start + rng.randrange(64)
+            piece = memoryview(data)[start:end]
+            self.assertEqual(slow_crc32c(piece), crc32c(piece))
+        self.assertEqual(crc32c(data), crc32c(data[100:], crc32c(data[:100])))
+
+    def test_framed_log(self):
+        """
+        Every message, whichever way it is logged, is written as a good
+        record; a rotated file's first record is framed too.
+        """
+        msgs = [b'line %d\n' % n__ for n__ in range(500)]
+        big = b'x' * 10000
+        for engine in (0, ENGINE_MPSC):
+            name = 'framed%d' % engine
+            logger = self.mgr.open(name, durability=SYNC_NONE, framed=True,
+                                   buf_size=4096, engine=engine,
+                                   ring_size=64 * 1024)
+            for msg in msgs[:250]:
+                logger.log_raw(msg)
+            logger.log_raw(big)
+            logger.log_raw(b'')
+            log_msgs(logger.lfd, msgs[250:])
+            self.assertEqual(0, logger.close())
+            data = self.read(name)
+            got = [bytes(msg) for msg in iter_frames(data)]
+            self.assertEqual(len(msgs) + 2, len(got))
+            self.assertEqual(msgs[:250] + [big, b''] + msgs[250:], got)
+            self.assertEqual((len(data), len(got), len(data)),
+                             scan_file(self.path(name)))
+
+        def on_rotate(_old, _new):
+            """ Return the first record of the new file. """
+            return b'first'
+        logger = self.mgr.open('rotated', durability=SYNC_NONE, framed=True,
+                               rotate_bytes=100, on_rotate=on_rotate)
+        logger.log_raw(b'y' * 200)
+        self.assertEqual(0, logger.flush())
+        logger.log_raw(b'z')
+        self.assertEqual(0, logger.close())
+        self.assertEqual(frame(b'first') + frame(b'z'), self.read('rotated'))
+
+    def test_torn_tail(self):
+        """
+        A torn last record, or anything after a corrupt one, is cut off,
+        leaving the good records before it.
+        """
+        good = b''.join(frame(b'record %d\n' % n__) for n__ in range(100))
+        path = self.path('torn')
+        os.makedirs(PATH_TO_LOGS, exist_ok=True)
+        for tail in (frame(b'torn record')[:-3], frame(b'x')[:5],
+                     b'\0' * 4096):
+            with open(path, 'wb') as file:
+                file.write(good + tail)
+            self.assertEqual((len(good), 100), recover_tail(path, False))
+            self.assertEqual(len(good + tail), os.path.getsize(path))
+            self.assertEqual((len(good), 100), recover_tail(path))
+            self.assertEqual(good, self.read('torn'))
+
+        # a flipped bit stops the scan at the record it is in
+        data = bytearray(good)
+        second = len(frame(b'record 0\n'))
+        data[second + FRAME_HEADER.size] ^= 4
+        with open(path, 'wb') as file:
+            file.write(data)
+        self.assertEqual((second, 1), recover_tail(path))
+        self.assertEqual(good[:second], self.read('torn'))
+
+    def test_scan_speed(self):
+        """ Time a scan of a large framed log, which is all good. """
+        record = frame(b'x' * 4088)
+        count = 16 * 1024
+        path = self.path('big')
+        os.makedirs(PATH_TO_LOGS, exist_ok=True)
+        with open(path, 'wb') as file:
+            for _ in range(count // 1024):
+                file.write(record * 1024)
+        t00 = time.perf_counter()
+        end, records, size = scan_file(path)
+        secs = time.perf_counter() - t00
+        self.assertEqual((size, count), (end, records))
+        print("\nscanned %d MiB of records in %.3f s: %.0f MiB/s" % (
+            size >> 20, secs, size / secs / 2 ** 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
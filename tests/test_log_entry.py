@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_log_entry.py
+
+""" Test the binary encoding of LogEntry. """
+
+import hashlib
+import os
+import time
+import unittest
+
+from xlutil.ftlog import LogEntry, pack_many, iter_unpack
+
+ENTRY_COUNT = 20000
+
+
+def make_entry(n__, width=20):
+    """ Return a LogEntry with width-byte ids made from n__. """
+    key = hashlib.sha256(b'key %d' % n__).digest()[:width]
+    owner = hashlib.sha256(b'owner').digest()[:width]
+    src = hashlib.sha256(b'src %d' % (n__ % 7)).digest()[:width]
+    return LogEntry(1500000000 + n__, key, owner, n__ * 17, src,
+                    'dir%d/file%d.txt' % (n__ % 10, n__))
+
+
+class TestLogEntry(unittest.TestCase):
+    """ Test the binary encoding of LogEntry. """
+
+    def test_owner_is_not_a_tuple(self):
+        """ The owner is stored as given. """
+
+        owner = os.urandom(20)
+        entry = LogEntry(0, os.urandom(20), owner, 0, os.urandom(20), 'x')
+        self.assertEqual(owner, entry.owner)
+        with self.assertRaises(AttributeError):
+            entry.extra = 1         # pylint: disable=assigning-non-slot
+
+    def test_round_trip(self):
+        """ Entries of both widths survive encoding and decoding. """
+
+        for width in (20, 32):
+            entry = make_entry(42, width)
+            data = entry.to_bytes()
+            self.assertEqual(16 + 3 * width + len('dir2/file42.txt'),
+                             len(data))
+            copy, end = LogEntry.from_buffer(data)
+            self.assertEqual(len(data), end)
+            self.assertEqual(entry, copy)
+            self.assertEqual('dir2/file42.txt', copy.path)
+
+    def test_from_buffer_does_not_copy(self):
+        """ Ids are views into the buffer, found at any offset. """
+
+        data = bytearray(b'junk') + make_entry(7).to_bytes()
+        entry, end = LogEntry.from_buffer(memoryview(data), 4)
+        self.assertEqual(len(data), end)
+        self.assertIsInstance(entry.key, memoryview)
+        self.assertIs(data, entry.key.obj)
+        data[4 + 16] ^= 0xff            # first byte of the key
+        self.assertNotEqual(make_entry(7).key, entry.key)
+
+    def test_bad_entries(self):
+        """ Bad widths and damaged encodings are refused. """
+
+        with self.assertRaises(ValueError):
+            LogEntry(0, b'k' * 20, b'o' * 32, 0, b's' * 20, 'x').to_bytes()
+        with self.assertRaises(ValueError):
+            LogEntry(0, b'k' * 16, b'o' * 16, 0, b's' * 16, 'x').to_bytes()
+        for tstamp, length in ((-1, 0), (2 ** 64, 0), (0, -1), (0, 2 ** 32)):
+            with self.assertRaises(ValueError):
+                LogEntry(tstamp, b'k' * 20, b'o' * 20, length, b's' * 20,
+                         'x').to_bytes()
+        data = make_entry(1).to_bytes()
+        with self.assertRaises(ValueError):
+            LogEntry.from_buffer(data[:-1])
+        with self.assertRaises(ValueError):
+            LogEntry.from_buffer(data[:10])
+        with self.assertRaises(ValueError):
+            LogEntry.from_buffer(b'\x07' + data[1:])
+
+    def test_pack_many(self):
+        """ Pack and unpack a large batch, reporting the rates. """
+
+        entries = [make_entry(n__, 20 if n__ % 2 else 32)
+                   for n__ in range(ENTRY_COUNT)]
+        t00 = time.perf_counter()
+        data = pack_many(entries)
+        t01 = time.perf_counter()
+        copies = list(iter_unpack(data))
+        t02 = time.perf_counter()
+        print("\npacked %.0f entries/sec, unpacked %.0f entries/sec, "
+              "%.1f bytes/entry" % (
+                  ENTRY_COUNT / (t01 - t00), ENTRY_COUNT / (t02 - t01),
+                  len(data) / ENTRY_COUNT))
+        self.assertEqual(entries, copies)
+        self.assertEqual([], list(iter_unpack(b'')))
+
+
+if __name__ == '__main__':
+    unittest.main()
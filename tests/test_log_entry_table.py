@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_log_entry_table.py
+
+""" Test and benchmark the columnar LogEntryTable. """
+
+import hashlib
+import time
+import tracemalloc
+import unittest
+
+from xlutil.ftlog import LogEntry, LogEntryTable, pack_many
+
+ENTRY_COUNT = 100000
+OWNERS = [hashlib.sha1(b'owner %d' % n__).digest() for n__ in range(4)]
+
+
+def make_entry(n__):
+    """ Return the n__-th test entry. """
+    key = hashlib.sha1(b'key %d' % n__).digest()
+    src = hashlib.sha1(b'src %d' % (n__ % 3)).digest()
+    return LogEntry(1500000000 + n__, key, OWNERS[n__ % 4], n__ * 3, src,
+                    'dir%d/file%d.txt' % (n__ % 10, n__ % 1000))
+
+
+class TestLogEntryTable(unittest.TestCase):
+    """ Test and benchmark the columnar LogEntryTable. """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.entries = [make_entry(n__) for n__ in range(ENTRY_COUNT)]
+        cls.table = LogEntryTable.from_entries(cls.entries)
+
+    def test_round_trip(self):
+        """ Entries come back out as they went in. """
+
+        table = self.table
+        self.assertEqual(ENTRY_COUNT, len(table))
+        self.assertEqual(1000, table.path_count)
+        self.assertEqual(self.entries[0], table[0])
+        self.assertEqual(self.entries[-1], table[-1])
+        self.assertEqual(self.entries[:100], list(table)[:100])
+        with self.assertRaises(IndexError):
+            table[ENTRY_COUNT]          # pylint: disable=pointless-statement
+
+    def test_from_buffer(self):
+        """ A table can be loaded from encoded entries. """
+
+        table = LogEntryTable.from_buffer(pack_many(self.entries[:500]))
+        self.assertEqual(self.entries[:500], list(table))
+
+    def test_wrong_width(self):
+        """ Entries must match the table's width. """
+
+        table = LogEntryTable(32)
+        with self.assertRaises(ValueError):
+            table.append(self.entries[0])
+        with self.assertRaises(ValueError):
+            LogEntryTable(16)
+
+    def test_select(self):
+        """ Filters agree with a plain scan of the entries. """
+
+        table = self.table
+        rows = table.select_time_range(1500000100, 1500000200)
+        self.assertEqual(list(range(100, 200)), list(rows))
+        rows = table.select_owner(OWNERS[1])
+        self.assertEqual(list(range(1, ENTRY_COUNT, 4)), list(rows))
+        prefix = self.entries[777].key[:2]
+        expected = [n__ for n__, entry in enumerate(self.entries)
+                    if entry.key.startswith(prefix)]
+        self.assertEqual(expected, list(table.select_key_prefix(prefix)))
+        rows = table.select(1500000000, 1500000040, owner=OWNERS[2])
+        self.assertEqual(list(range(2, 40, 4)), list(rows))
+
+        subset = table.filter(owner=OWNERS[3], key_prefix=b'')
+        self.assertEqual(ENTRY_COUNT // 4, len(subset))
+        self.assertEqual(self.entries[3], subset[0])
+        self.assertEqual(self.entries[7], subset[1])
+
+    def test_unsorted_time_range(self):
+        """ Timestamps need not be in order. """
+
+        table = LogEntryTable.from_entries(reversed(self.entries[:1000]))
+        rows = table.select_time_range(1500000010, 1500000013)
+        self.assertEqual([987, 988, 989], list(rows))
+
+    def test_memory_and_speed(self):
+        """ Compare memory used and scan speed with a list of entries. """
+
+        tracemalloc.start()
+        entries = [make_entry(n__) for n__ in range(ENTRY_COUNT)]
+        list_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+        table = LogEntryTable.from_entries(entries)
+        table_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print("\n%d entries: %.0f bytes/entry as objects, %.0f in a table" % (
+            ENTRY_COUNT, list_bytes / ENTRY_COUNT, table_bytes / ENTRY_COUNT))
+        self.assertTrue(table_bytes < list_bytes / 2)
+
+        owner = OWNERS[1]
+        prefix = entries[12345].key[:3]
+        for name, test, select in (
+                ('owner', lambda entry: entry.owner == owner,
+                 lambda: table.select_owner(owner)),
+                ('key prefix', lambda entry: entry.key.startswith(prefix),
+                 lambda: table.select_key_prefix(prefix))):
+            t00 = time.perf_counter()
+            by_list = [n__ for n__, entry in enumerate(entries)
+                       if test(entry)]
+            t01 = time.perf_counter()
+            by_table = select()
+            t02 = time.perf_counter()
+            print("%-10s scan: %6.2f ms over objects, %6.2f ms over the "
+                  "table, %d rows" % (name, (t01 - t00) * 1000,
+                                      (t02 - t01) * 1000, len(by_table)))
+            self.assertEqual(by_list, list(by_table))
+
+
+if __name__ == '__main__':
+    unittest.main()
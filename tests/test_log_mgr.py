@@ -5,6 +5,7 @@
 
 import os
 import shutil
+import threading
 import time
 import unittest
 import sys
@@ -31,7 +32,6 @@ class TestLogMgr(unittest.TestCase):
         # print "XXX NO MESSAGES XXX"
         expected_log_file = 'logs/foo.log'
         self.assertEqual(expected_log_file, logger.log_file_name)
-        # we don't provide any way to close individual logs
         mgr.close()
 
         contents = None
@@ -114,6 +114,80 @@ class TestLogMgr(unittest.TestCase):
             contents = file.read()
         self.assertEqual(msg, contents)      # FOOFOO
 
+    def test_concurrent_threads(self):
+        """
+        Log from several Python threads at once.  log_msg() releases the
+        GIL while it copies into the buffers, so the threads interleave;
+        every message must nevertheless arrive intact.
+        """
+        if os.path.exists('./logs'):
+            shutil.rmtree('./logs')
+        mgr = LogMgr('logs')
+        logger = mgr.open('threads')
+        thread_count = 8
+        msg_count = 32
+
+        def producer(tag):
+            """ Log msg_count messages tagged with the thread number. """
+            for n__ in range(msg_count):
+                logger.log("thread %d message %02d" % (tag, n__))
+
+        threads = [threading.Thread(target=producer, args=(t__,))
+                   for t__ in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        mgr.close()
+
+        with open('logs/threads.log', 'r') as file:
+            lines = file.read().splitlines()
+        self.assertEqual(thread_count * msg_count, len(lines))
+        bodies = sorted(line.split(' ', 2)[2] for line in lines)
+        expected = sorted("thread %d message %02d" % (t__, n__)
+                          for t__ in range(thread_count)
+                          for n__ in range(msg_count))
+        self.assertEqual(expected, bodies)
+
+    def test_close_is_fast(self):
+        """
+        Closing waits only for the final flush, not for fixed sleeps,
+        and everything logged up to the close reaches the file.  The
+        close is timed against explicit flushes of the same amount,
+        with a write interval long enough that any sleep tied to it
+        would dwarf them.
+        """
+        if os.path.exists('./logs'):
+            shutil.rmtree('./logs')
+        mgr = LogMgr('logs', write_interval=10)
+        loggers = [mgr.open('fast%d' % n__) for n__ in range(4)]
+
+        def log_round(first):
+            """ Log 100 messages to each log. """
+            for logger in loggers:
+                for n__ in range(first, first + 100):
+                    logger.log("message %03d" % n__)
+        flushes = []
+        for first in (0, 100, 200):
+            log_round(first)
+            t00 = time.perf_counter()
+            for logger in loggers:
+                self.assertEqual(0, logger.flush())
+            flushes.append(time.perf_counter() - t00)
+        log_round(300)
+        t00 = time.perf_counter()
+        self.assertEqual(0, mgr.close())
+        elapsed = time.perf_counter() - t00
+        print("\nclosed 4 logs in %.1f ms, flushed them in %.1f ms" % (
+            elapsed * 1000, max(flushes) * 1000))
+        self.assertTrue(elapsed < 20 * max(flushes))
+
+        for n__ in range(4):
+            with open('logs/fast%d.log' % n__, 'r') as file:
+                lines = file.read().splitlines()
+            self.assertEqual(400, len(lines))
+            self.assertTrue(lines[-1].endswith("message 399"))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_log_mgrs.py
+
+""" Test several independent log managers in one process. """
+
+import gc
+import os
+import shutil
+import sys
+import time
+import unittest
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import (
+    init_cft_logger, open_cft_log, log_msg, close_cft_log, close_cft_logger,
+    new_cft_logger)
+from xlutil.ftlog import LogMgr, SYNC_NONE
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'log_mgrs')
+
+
+# the writer threads are not Python threads, so threading cannot count them
+CAN_COUNT_THREADS = psutil is not None or os.path.isdir('/proc/self/task')
+
+
+def threads():
+    """ Return the number of threads in this process. """
+    if psutil is not None:
+        return psutil.Process().num_threads()
+    return len(os.listdir('/proc/self/task'))
+
+
+class TestLogMgrs(unittest.TestCase):
+    """ Test several independent log managers in one process. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+
+    def read(self, mgr, base_name):
+        """ Return the contents of a manager's log file. """
+        with open(os.path.join(mgr.log_dir, base_name + '.log'), 'rb') as file:
+            return file.read()
+
+    @unittest.skipUnless(CAN_COUNT_THREADS, 'needs psutil or /proc')
+    def test_each_has_its_own_writer(self):
+        """
+        Each manager starts its own writer thread, flushes at its own
+        interval, and may be closed without disturbing the others.
+        """
+        before = threads()
+        fast = LogMgr(os.path.join(PATH_TO_LOGS, 'fast'), write_interval=0.05)
+        slow = LogMgr(os.path.join(PATH_TO_LOGS, 'slow'), write_interval=30)
+        self.assertEqual(before + 2, threads())
+        self.assertEqual(0.05, fast.write_interval)
+
+        fast_log = fast.open('a', durability=SYNC_NONE)
+        slow_log = slow.open('a', durability=SYNC_NONE)
+        self.assertNotEqual(fast_log.lfd, slow_log.lfd)
+        fast_log.log_raw(b'fast\n')
+        slow_log.log_raw(b'slow\n')
+        time.sleep(0.3)
+        self.assertEqual(b'fast\n', self.read(fast, 'a'))
+        self.assertEqual(b'', self.read(slow, 'a'))
+
+        self.assertEqual(0, fast.close())
+        self.assertEqual(before + 1, threads())
+        with self.assertRaises(ValueError):
+            fast_log.log_raw(b'too late\n')
+        slow_log.log_raw(b'still open\n')
+        self.assertEqual(0, slow_log.flush())
+        self.assertEqual(b'slow\nstill open\n', self.read(slow, 'a'))
+        self.assertEqual(0, slow.close())
+        self.assertEqual(before, threads())
+
+    @unittest.skipUnless(CAN_COUNT_THREADS, 'needs psutil or /proc')
+    def test_collected(self):
+        """
+        A manager collected with no logs open stops its writer thread;
+        one with a log open keeps it.
+        """
+        before = threads()
+        mgr = LogMgr(os.path.join(PATH_TO_LOGS, 'idle'))
+        logger = mgr.open('a', durability=SYNC_NONE)
+        logger.log_raw(b'idle\n')
+        self.assertEqual(0, logger.close())
+        self.assertEqual(before + 1, threads())
+        del mgr, logger
+        gc.collect()
+        self.assertEqual(before, threads())
+
+        mgr = LogMgr(os.path.join(PATH_TO_LOGS, 'busy'))
+        lfd = mgr.open('a', durability=SYNC_NONE).lfd
+        del mgr
+        gc.collect()
+        self.assertEqual(before + 1, threads())
+        log_msg(lfd, b'still open\n')
+        self.assertEqual(0, close_cft_log(lfd))
+        with open(os.path.join(PATH_TO_LOGS, 'busy', 'a.log'), 'rb') as file:
+            self.assertEqual(b'still open\n', file.read())
+
+    def test_default_manager_unaffected(self):
+        """
+        Creating and closing LogMgrs leaves logs opened through the
+        module-level functions, which use the default manager, alone.
+        """
+        os.makedirs(PATH_TO_LOGS)
+        path = os.path.join(PATH_TO_LOGS, 'default.log')
+        self.assertEqual(0, init_cft_logger())
+        ndx = open_cft_log(path)
+        self.assertEqual(0, ndx)
+        log_msg(ndx, b'before\n')
+        other = LogMgr(os.path.join(PATH_TO_LOGS, 'other'))
+        other.open('x').log_raw(b'other\n')
+        other.close()
+        log_msg(ndx, b'after\n')
+        self.assertEqual(0, close_cft_logger())
+        with open(path, 'rb') as file:
+            self.assertEqual(b'before\nafter\n', file.read())
+        self.assertEqual(b'other\n', self.read(other, 'x'))
+
+    def test_bad_arguments(self):
+        """ Bad intervals and managers are refused. """
+        with self.assertRaises(ValueError):
+            new_cft_logger(0)
+        with self.assertRaises(TypeError):
+            open_cft_log(os.path.join(PATH_TO_LOGS, 'bad.log'), mgr=42)
+        mgr = new_cft_logger()
+        self.assertEqual(0, close_cft_logger(mgr))
+        self.assertEqual(0, close_cft_logger(mgr))     # already closed
+        self.assertTrue(open_cft_log(
+            os.path.join(PATH_TO_LOGS, 'late.log'), mgr=mgr) < 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_log_msgs.py
+
+""" Test and benchmark batched logging through log_msgs(). """
+
+import os
+import shutil
+import sys
+import time
+import unittest
+
+# pylint: disable=no-name-in-module
+import cFTLogForPy
+from cFTLogForPy import (
+    init_cft_logger, open_cft_log, log_msg, log_msgs, close_cft_logger)
+from xlutil.ftlog import LogMgr
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+MSG_COUNT = 2000
+TEMPLATE = "padding ljlkjk;ljlj;k;lklj;j;kjkljklj %04x\n"
+PATH_TO_LOGS = os.path.join('tmp', 'batched')
+
+
+class TestLogMsgs(unittest.TestCase):
+    """ Test and benchmark batched logging through log_msgs(). """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+
+    def tearDown(self):
+        pass
+
+    # actual unit tests #############################################
+
+    def test_batch_matches_single(self):
+        """
+        Verify that a batch written with log_msgs() produces exactly the
+        same file as the same messages written one at a time, and time
+        the two paths.
+        """
+        messages = [TEMPLATE % n__ for n__ in range(MSG_COUNT)]
+        single_file = os.path.join(PATH_TO_LOGS, 'single.log')
+        batch_file = os.path.join(PATH_TO_LOGS, 'batch.log')
+
+        init_cft_logger()
+        single_ndx = open_cft_log(single_file)
+        batch_ndx = open_cft_log(batch_file)
+        self.assertEqual(0, single_ndx)
+        self.assertEqual(1, batch_ndx)
+
+        t00 = time.perf_counter()
+        for msg in messages:
+            log_msg(single_ndx, msg)
+        t01 = time.perf_counter()
+        log_msgs(batch_ndx, messages)
+        t02 = time.perf_counter()
+        status = close_cft_logger()
+        self.assertEqual(0, status)
+
+        single_rate = MSG_COUNT / max(t01 - t00, 1e-9)
+        batch_rate = MSG_COUNT / max(t02 - t01, 1e-9)
+        print("\nlog_msg:  %12.0f messages/sec" % single_rate)
+        print("log_msgs: %12.0f messages/sec (%.1fx)" % (
+            batch_rate, batch_rate / single_rate))
+
+        with open(single_file, 'r') as file:
+            single = file.read()
+        with open(batch_file, 'r') as file:
+            batch = file.read()
+        self.assertEqual(''.join(messages), single)
+        self.assertEqual(single, batch)
+
+    def test_object_and_bad_input(self):
+        """ Exercise LogForPy.log_msgs() and its argument checking. """
+
+        init_cft_logger()
+        # pylint: disable=no-member
+        obj = cFTLogForPy.LogForPy()
+        obj.init(os.path.join(PATH_TO_LOGS, 'obj.log'))
+        obj.log_msgs(["first\n", "second\n", "third\n"])
+        self.assertEqual(3, obj.count())
+        obj.log_msgs(msg for msg in ["fourth\n"])
+        self.assertEqual(4, obj.count())
+        obj.log_msgs([])
+        self.assertEqual(4, obj.count())
+        with self.assertRaises(TypeError):
+            obj.log_msgs(["fifth\n", 6])
+        with self.assertRaises(TypeError):
+            obj.log_msgs(7)
+        self.assertEqual(4, obj.count())
+        close_cft_logger()
+
+    def test_log_many(self):
+        """ Verify that ActualLog.log_many() writes what it returns. """
+
+        mgr = LogMgr(PATH_TO_LOGS)
+        logger = mgr.open('many')
+        text = logger.log("just one")
+        text += logger.log_many(["gibberish %d" % n__ for n__ in range(16)])
+        mgr.close()
+
+        with open(logger.log_file_name, 'r') as file:
+            contents = file.read()
+        self.assertEqual(text, contents)
+        self.assertEqual(17, len(contents.splitlines()))
+
+    def test_bytes_like_messages(self):
+        """
+        Verify that buffer-protocol objects are logged byte for byte,
+        embedded nulls included, and that nbytes selects a prefix.
+        """
+        framed = b'\x00\x00\x00\x05hello'
+        scratch = bytearray(b'reused buffer\nGARBAGE')
+
+        mgr = LogMgr(PATH_TO_LOGS)
+        logger = mgr.open('raw')
+        logger.log_raw(framed)
+        logger.log_raw(bytearray(b'bytearray\n'))
+        logger.log_raw(memoryview(b'xxmemoryview\n')[2:])
+        logger.log_raw(scratch, 14)
+        log_msgs(logger.lfd, [b'batched bytes\n', 'batched str\n'])
+        with self.assertRaises(ValueError):
+            logger.log_raw(scratch, len(scratch) + 1)
+        with self.assertRaises(TypeError):
+            log_msg(logger.lfd, 42)
+        mgr.close()
+
+        with open(logger.log_file_name, 'rb') as file:
+            contents = file.read()
+        self.assertEqual(framed + b'bytearray\nmemoryview\n' +
+                         b'reused buffer\nbatched bytes\nbatched str\n',
+                         contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
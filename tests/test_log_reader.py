@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_log_reader.py
+
+""" Test reading chained logs of binary LogEntry records. """
+
+import hashlib
+import os
+import shutil
+import time
+import unittest
+from unittest import mock
+
+from xlutil.ftlog import LogEntry, pack_many
+from xlutil.logreader import (
+    LogReader, DirResolver, chain_link, content_key, write_index, INDEX_EXT)
+
+PATH_TO_LOGS = os.path.join('tmp', 'log_reader')
+OWNER = b'o' * 20
+SRC = b's' * 20
+PER_CHUNK = 2000
+
+
+def make_entry(n__):
+    """ Return the n__-th entry of the test log. """
+    key = hashlib.sha1(b'file %d' % (n__ % 500)).digest()
+    return LogEntry(1500000000 + n__, key, OWNER, n__, SRC,
+                    'dir/file%d' % n__)
+
+
+class TestLogReader(unittest.TestCase):
+    """ Test reading chained logs of binary LogEntry records. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        os.makedirs(PATH_TO_LOGS)
+        # three chunks, each linked to the one before
+        self.paths = []
+        prev = None
+        for chunk in range(3):
+            link = chain_link(prev, 1500000000, OWNER, SRC)
+            entries = [make_entry(n__) for n__ in
+                       range(chunk * PER_CHUNK, (chunk + 1) * PER_CHUNK)]
+            prev = link.to_bytes() + pack_many(entries)
+            path = os.path.join(PATH_TO_LOGS, 'chunk%d' % chunk)
+            with open(path, 'wb') as file:
+                file.write(prev)
+            self.paths.append(path)
+
+    def tearDown(self):
+        pass
+
+    def test_follow_chain(self):
+        """ Every entry is read, oldest chunk first, links skipped. """
+
+        reader = LogReader(self.paths[-1])
+        self.assertEqual(self.paths, reader.chunks())
+        entries = list(reader)
+        self.assertEqual(3 * PER_CHUNK, len(entries))
+        for n__, entry in enumerate(entries):
+            self.assertEqual(make_entry(n__), entry)
+        self.assertEqual(self.paths[:1], LogReader(self.paths[0]).chunks())
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_close(self):
+        """
+        Closing a reader closes its maps, except those which entries
+        still refer to; those entries can still be read.
+        """
+        fds = len(os.listdir('/proc/self/fd'))
+        with LogReader(self.paths[-1]) as reader:
+            self.assertEqual(3 * PER_CHUNK, sum(1 for _ in reader))
+            kept = next(reader.find_key(make_entry(1).key))
+        self.assertEqual(make_entry(1), kept)
+        del kept
+        self.assertEqual(fds, len(os.listdir('/proc/self/fd')))
+
+    def test_resolver_width(self):
+        """ Files are hashed only with the algorithm of the key. """
+        resolve = DirResolver(PATH_TO_LOGS)
+        with mock.patch('xlutil.logreader.content_key',
+                        wraps=content_key) as hashed:
+            with open(self.paths[0], 'rb') as file:
+                key = content_key(file.read())
+            self.assertEqual(self.paths[0], resolve(key))
+            self.assertEqual(self.paths[0], resolve(key))
+            self.assertEqual(len(self.paths), hashed.call_count)
+            self.assertEqual({20}, {call[0][1] for call in
+                                    hashed.call_args_list})
+
+    def test_broken_chain(self):
+        """ A link to a missing chunk is reported. """
+
+        os.unlink(self.paths[1])
+        with self.assertRaises(ValueError):
+            LogReader(self.paths[2]).chunks()
+
+    def test_lookups(self):
+        """
+        Lookups by key and time find the same entries with and without
+        an index, and the index is much faster.
+        """
+        reader = LogReader(self.paths[-1])
+        key = make_entry(123).key
+        t00 = time.perf_counter()
+        scanned = list(reader.find_key(key))
+        in_range = list(reader.time_range(1500001990, 1500002010))
+        t01 = time.perf_counter()
+        reader.build_index()
+        t02 = time.perf_counter()
+        indexed = list(reader.find_key(key))
+        indexed_range = list(reader.time_range(1500001990, 1500002010))
+        t03 = time.perf_counter()
+        print("\nlookups: %.2f ms scanning, %.2f ms indexed "
+              "(index built in %.2f ms)" % (
+                  (t01 - t00) * 1000, (t03 - t02) * 1000,
+                  (t02 - t01) * 1000))
+        expected = [make_entry(n__) for n__ in range(123, 3 * PER_CHUNK, 500)]
+        self.assertEqual(expected, scanned)
+        self.assertEqual(expected, indexed)
+        expected = [make_entry(n__) for n__ in range(1990, 2010)]
+        self.assertEqual(expected, in_range)
+        self.assertEqual(expected, indexed_range)
+
+    def test_stale_index(self):
+        """ Entries appended after indexing are still found. """
+
+        write_index(self.paths[-1])
+        extra = make_entry(123)
+        with open(self.paths[-1], 'ab') as file:
+            file.write(extra.to_bytes())
+        found = list(LogReader(self.paths[-1]).find_key(extra.key))
+        self.assertEqual(3 * PER_CHUNK // 500 + 1, len(found))
+        self.assertEqual(extra, found[-1])
+        self.assertTrue(os.path.exists(self.paths[-1] + INDEX_EXT))
+
+    def test_replaced_chunk(self):
+        """ An index of another file at the chunk's path is not used. """
+
+        write_index(self.paths[0])
+        entries = [make_entry(n__ + 10 ** 6) for n__ in range(PER_CHUNK + 1)]
+        tmp_path = self.paths[0] + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(chain_link(None, 1500000000, OWNER, SRC).to_bytes() +
+                       pack_many(entries))
+        os.replace(tmp_path, self.paths[0])
+        reader = LogReader(self.paths[0])
+        self.assertEqual([], list(reader.time_range(1500000000, 1500000100)))
+        self.assertEqual(entries[:100], list(reader.time_range(
+            1500000000 + 10 ** 6, 1500000100 + 10 ** 6)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_mpsc_ring.py
+
+""" Test and benchmark the lock-free MPSC ring engine. """
+
+import os
+import shutil
+import sys
+import threading
+import time
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import log_msg
+from xlutil.ftlog import (
+    LogMgr, DROP_ON_FULL, SYNC_NONE, ENGINE_PAGES, ENGINE_MPSC)
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'mpsc_ring')
+LINE = b"padding ljlkjk;ljlj;k;lklj;j;kjkljklj %08x\n"
+
+
+class TestMpscRing(unittest.TestCase):
+    """ Test and benchmark the lock-free MPSC ring engine. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        self.mgr.close()
+
+    def read(self, logger):
+        """ Return the lines of a log file. """
+        with open(logger.log_file_name, 'rb') as file:
+            return file.read().splitlines()
+
+    def run_threads(self, count, target):
+        """ Run target(n) in count threads and wait for them all. """
+        threads = [threading.Thread(target=target, args=(n__,))
+                   for n__ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_many_producers(self):
+        """
+        Threads log through a small ring, lapping it many times and
+        wrapping messages around its end; every line arrives whole,
+        each thread's in order, and an oversized message goes through
+        the pages.
+        """
+        logger = self.mgr.open('mpsc', durability=SYNC_NONE,
+                               engine=ENGINE_MPSC, ring_size=4096)
+        threads, lines = 8, 2000
+
+        def producer(number):
+            """ Log numbered lines of varying length. """
+            for n__ in range(lines):
+                logger.log_raw(b'thread %d line %d%s\n' % (
+                    number, n__, b'.' * (n__ % 13)))
+
+        self.run_threads(threads, producer)
+        big = b'x' * 4096 + b'\n'
+        logger.log_raw(big)
+        self.assertEqual(0, logger.flush())
+        stats = logger.stats()
+        self.assertTrue(stats['blocked'] > 0)
+        self.assertEqual(threads * lines + 1, stats['count'])
+        self.assertEqual(0, logger.close())
+        got = self.read(logger)
+        self.assertEqual(threads * lines + 1, len(got))
+        self.assertIn(big[:-1], got)
+        for number in range(threads):
+            mine = [line for line in got
+                    if line.startswith(b'thread %d ' % number)]
+            self.assertEqual([b'thread %d line %d%s' % (
+                number, n__, b'.' * (n__ % 13))
+                              for n__ in range(lines)], mine)
+
+    def test_drop_on_full(self):
+        """ A full ring drops messages if the policy says so. """
+        logger = self.mgr.open('drop', policy=DROP_ON_FULL,
+                               durability=SYNC_NONE, engine=ENGINE_MPSC,
+                               ring_size=4096)
+        for n__ in range(2000):
+            logger.log_raw(b'line %d\n' % n__)
+        self.assertEqual(0, logger.flush())
+        stats = logger.stats()
+        self.assertTrue(stats['dropped'] > 0)
+        self.assertEqual(2000, stats['count'] + stats['dropped'])
+        self.assertEqual(0, logger.close())
+        self.assertEqual(stats['count'], len(self.read(logger)))
+
+    def test_bad_options(self):
+        """ The engine must exist, and the ring be of a sensible size. """
+        with self.assertRaises(ValueError):
+            self.mgr.open('engine', engine=ENGINE_MPSC + 1)
+        with self.assertRaises(ValueError):
+            self.mgr.open('small', engine=ENGINE_MPSC, ring_size=1024)
+        with self.assertRaises(ValueError):
+            self.mgr.open('shared', engine=ENGINE_MPSC, shared=True)
+        with self.assertRaises(ValueError):
+            self.mgr.open('staged', engine=ENGINE_MPSC, thread_bufs=True)
+
+    def test_latency(self):
+        """
+        Compare the latency of log_msg() under the two engines, with
+        several threads logging to the same log at the same time.
+        """
+        threads, calls = 8, 4000
+        print("\nengine   p50 us   p99 us p99.9 us   max us")
+        for name, engine in (('pages', ENGINE_PAGES), ('mpsc', ENGINE_MPSC)):
+            logger = self.mgr.open(name, durability=SYNC_NONE, engine=engine,
+                                   buf_size=64 * 1024, buf_count=16)
+            lfd = logger.lfd
+            times = [None] * threads
+
+            def producer(number):
+                """ Time each of this thread's calls. """
+                mine = []
+                clock = time.perf_counter
+                for n__ in range(calls):
+                    t00 = clock()
+                    log_msg(lfd, LINE % n__)
+                    mine.append(clock() - t00)
+                times[number] = mine
+
+            self.run_threads(threads, producer)
+            self.assertEqual(0, logger.close())
+            self.assertEqual(threads * calls, len(self.read(logger)))
+            samples = sorted(t for mine in times for t in mine)
+
+            def pct(fraction):
+                """ Return a percentile of the samples, in us. """
+                return samples[int(fraction * (len(samples) - 1))] * 1e6
+            print("%-6s %8.2f %8.2f %8.2f %8.1f" % (
+                name, pct(0.5), pct(0.99), pct(0.999), pct(1.0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_open_close.py
+
+""" Test opening and closing individual logs while others stay open. """
+
+import os
+import shutil
+import sys
+import threading
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import log_msg, log_msgs, log_stats, max_log
+from xlutil.ftlog import LogMgr, SYNC_NONE
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'open_close')
+
+
+class TestOpenClose(unittest.TestCase):
+    """ Test opening and closing individual logs while others stay open. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        self.mgr.close()
+
+    def read(self, base_name):
+        """ Return the contents of a log file. """
+        with open(os.path.join(PATH_TO_LOGS, base_name + '.log'), 'rb') as file:
+            return file.read()
+
+    def test_close_writes_out_and_forgets(self):
+        """
+        Closing a log writes out what was buffered and drops it from the
+        manager, leaving the manager's other logs working.
+        """
+        keep = self.mgr.open('keep')
+        gone = self.mgr.open('gone')
+        ndx = gone.lfd
+        gone.log_raw(b'last words\n')
+        self.assertEqual(0, gone.close())
+        self.assertTrue(gone.closed)
+        self.assertEqual(b'last words\n', self.read('gone'))
+        self.assertEqual(['keep'], list(self.mgr.open_logs))
+        with self.assertRaises(ValueError):
+            log_msg(ndx, b'too late\n')
+        with self.assertRaises(ValueError):
+            log_stats(ndx)
+
+        keep.log_raw(b'still here\n')
+        self.assertEqual(0, keep.flush())
+        self.assertEqual(b'still here\n', self.read('keep'))
+
+        # the base name may be used again, and the slot is reused
+        again = self.mgr.open('gone')
+        self.assertEqual(ndx, again.lfd)
+        again.log_raw(b'back\n')
+        again.close()
+        self.assertEqual(b'last words\nback\n', self.read('gone'))
+
+    def test_closed_with_mgr(self):
+        """ Closing the manager closes each of its logs. """
+        loggers = [self.mgr.open('mgr%d' % n__) for n__ in range(3)]
+        loggers[1].close()
+        self.assertEqual(0, self.mgr.close())
+        for logger in loggers:
+            self.assertTrue(logger.closed)
+            self.assertIsNone(logger.lfd)
+
+    def test_close_while_logging(self):
+        """
+        A log may be closed while other threads are logging to it with
+        the GIL released: the close waits for them, and each stops with
+        ValueError once the log is closing; every line it did log is
+        written whole.
+        """
+        batch = [b'line %d\n' % n__ for n__ in range(100)]
+        for cycle in range(20):
+            logger = self.mgr.open('busy', durability=SYNC_NONE,
+                                   buf_size=4096, buf_count=2)
+            ndx = logger.lfd
+            started = threading.Barrier(5)
+            stopped = []
+
+            def producer(ndx=ndx, started=started, stopped=stopped):
+                """ Log batches until the log is closed under us. """
+                started.wait()
+                try:
+                    while True:
+                        log_msgs(ndx, batch)
+                        log_msg(ndx, b'single\n')
+                except ValueError:
+                    stopped.append(True)
+
+            threads = [threading.Thread(target=producer) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            started.wait()
+            self.assertEqual(0, logger.close())
+            for thread in threads:
+                thread.join()
+            self.assertEqual(4, len(stopped))
+            for line in self.read('busy').splitlines():
+                self.assertTrue(line == b'single' or line.startswith(b'line'),
+                                (cycle, line))
+            os.unlink(os.path.join(PATH_TO_LOGS, 'busy.log'))
+
+    def test_closed_by_batch(self):
+        """
+        A batch whose messages are generated by code which closes the
+        log is refused with ValueError, rather than hanging the close.
+        """
+        logger = self.mgr.open('batch', durability=SYNC_NONE)
+        ndx = logger.lfd
+
+        def closing():
+            """ Yield a line, then close the log. """
+            yield b'before\n'
+            self.assertEqual(0, logger.close())
+            yield b'after\n'
+        with self.assertRaises(ValueError):
+            log_msgs(ndx, closing())
+        self.assertTrue(logger.closed)
+        self.assertEqual(b'', self.read('batch'))
+
+    def test_thousands_of_cycles(self):
+        """
+        Opening and closing logs thousands of times reuses a handful of
+        slots rather than running out of them.
+        """
+        slots = set()
+        for n__ in range(4000):
+            # not syncing keeps the closes quick
+            logger = self.mgr.open('cycle%d' % (n__ % 8),
+                                   durability=SYNC_NONE)
+            slots.add(logger.lfd)
+            logger.log_raw(b'%d\n' % n__)
+            self.assertEqual(0, logger.close())
+        self.assertEqual(1, len(slots))
+        self.assertEqual(b''.join(b'%d\n' % n__ for n__ in range(0, 4000, 8)),
+                         self.read('cycle0'))
+        self.assertEqual({}, self.mgr.open_logs)
+
+    def test_many_open_at_once(self):
+        """
+        Far more than the original sixteen logs may be open at once,
+        with slots freed in any order reused before new ones.
+        """
+        self.assertTrue(max_log >= 1024)
+        logs = [self.mgr.open('many%d' % n__) for n__ in range(200)]
+        base = logs[0].lfd
+        self.assertEqual(list(range(200)), [log.lfd - base for log in logs])
+        for logger in logs:
+            logger.log_raw(logger.base_name.encode() + b'\n')
+        for logger in logs[10:20]:
+            logger.close()
+        reopened = [self.mgr.open('again%d' % n__) for n__ in range(12)]
+        self.assertEqual(set(range(10, 20)) | {200, 201},
+                         {log.lfd - base for log in reopened})
+        self.mgr.close()
+        for logger in logs:
+            self.assertEqual(logger.base_name.encode() + b'\n',
+                             self.read(logger.base_name))
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+
+if __name__ == '__main__':
+    unittest.main()
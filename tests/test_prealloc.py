@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_prealloc.py
+
+""" Test and benchmark logs whose files are preallocated. """
+
+import os
+import shutil
+import sys
+import time
+import unittest
+
+from xlutil.ftlog import LogMgr, SYNC_FDATASYNC, SYNC_NONE
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'prealloc')
+EXTENT = 1024 * 1024
+
+
+class TestPrealloc(unittest.TestCase):
+    """ Test and benchmark logs whose files are preallocated. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        self.mgr.close()
+
+    def path(self, base_name):
+        """ Return the path to a log file. """
+        return os.path.join(PATH_TO_LOGS, base_name + '.log')
+
+    def read(self, path):
+        """ Return the contents of a file. """
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def test_trimmed_on_close(self):
+        """
+        The file is a whole number of extents while the log is open,
+        what is written follows anything already in it, and on close
+        it is cut back to what was written.
+        """
+        path = self.path('trim')
+        os.makedirs(PATH_TO_LOGS)
+        with open(path, 'wb') as file:
+            file.write(b'earlier\n')
+        logger = self.mgr.open('trim', durability=SYNC_NONE,
+                               prealloc_bytes=EXTENT)
+        lines = [b'line %d\n' % n__ for n__ in range(20000)]
+        for line in lines:
+            logger.log_raw(line)
+        self.assertEqual(0, logger.flush())
+        size = os.path.getsize(path)
+        self.assertEqual(0, size % EXTENT)
+        self.assertTrue(size >= len(b''.join(lines)) + EXTENT // 2)
+        self.assertTrue(os.path.exists(path + '.end'))
+        self.assertEqual(0, logger.close())
+        self.assertEqual(b'earlier\n' + b''.join(lines), self.read(path))
+        self.assertFalse(os.path.exists(path + '.end'))
+
+    def test_reopened_after_crash(self):
+        """
+        A process which dies with its log preallocated leaves zeros at
+        the end; they are written over when the log is next opened.
+        """
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                logger = self.mgr.open('crash', durability=SYNC_NONE,
+                                       prealloc_bytes=EXTENT)
+                logger.log_raw(b'before the crash\n')
+                code = logger.flush()
+            finally:
+                os._exit(code)          # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertEqual(2 * EXTENT, os.path.getsize(self.path('crash')))
+
+        logger = self.mgr.open('crash', durability=SYNC_NONE,
+                               prealloc_bytes=EXTENT)
+        logger.log_raw(b'after\n')
+        self.assertEqual(0, logger.close())
+        self.assertEqual(b'before the crash\nafter\n',
+                         self.read(self.path('crash')))
+
+    def crash(self, base_name, data, extent=EXTENT):
+        """
+        Log data to a preallocated log in a child process, which dies
+        without closing it.
+        """
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                logger = self.mgr.open(base_name, durability=SYNC_NONE,
+                                       prealloc_bytes=extent)
+                logger.log_raw(data)
+                code = logger.flush()
+            finally:
+                os._exit(code)          # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+
+    def test_zeros_written(self):
+        """
+        Zeros which were logged are not taken for the preallocated
+        space after a crash, nor is the end lost when the extent
+        changes.
+        """
+        self.crash('zeros', b'ends in zeros\0\0\0\0')
+        self.crash('zeros', b'more\0\0', 4 * EXTENT)
+        logger = self.mgr.open('zeros', durability=SYNC_NONE,
+                               prealloc_bytes=2 * EXTENT)
+        logger.log_raw(b'after\n')
+        self.assertEqual(0, logger.close())
+        self.assertEqual(b'ends in zeros\0\0\0\0more\0\0after\n',
+                         self.read(self.path('zeros')))
+
+    def test_opened_once(self):
+        """ A preallocated log cannot be opened twice at once. """
+        logger = self.mgr.open('once', prealloc_bytes=EXTENT)
+        other = LogMgr(PATH_TO_LOGS)
+        try:
+            with self.assertRaises(RuntimeError):
+                other.open('once', prealloc_bytes=EXTENT)
+        finally:
+            other.close()
+        logger.log_raw(b'mine\n')
+        self.assertEqual(0, logger.close())
+        self.assertEqual(b'mine\n', self.read(self.path('once')))
+
+    def test_rotation(self):
+        """ A rotated file is cut back too, and the new one preallocated. """
+        logger = self.mgr.open('rotate', durability=SYNC_NONE,
+                               prealloc_bytes=EXTENT, rotate_bytes=1000)
+        logger.log_raw(b'x' * 1500 + b'\n')
+        self.assertEqual(0, logger.flush())
+        logger.log_raw(b'y\n')
+        self.assertEqual(0, logger.flush())
+        self.assertEqual(0, os.path.getsize(self.path('rotate')) % EXTENT)
+        self.assertEqual(0, logger.close())
+        self.assertEqual(b'x' * 1500 + b'\n',
+                         self.read(self.path('rotate') + '.1'))
+        self.assertEqual(b'y\n', self.read(self.path('rotate')))
+
+    def test_bad_options(self):
+        """ An extent must be of a sensible size. """
+        with self.assertRaises(ValueError):
+            self.mgr.open('small', prealloc_bytes=4096)
+
+    def test_flush_latency(self):
+        """
+        Compare the latency of flushes, each followed by fdatasync(), of
+        a log which grows as it is written and one preallocated.
+        """
+        flushes = 200
+        line = b'padding ljlkjk;ljlj;k;lklj;j;kjkljklj %08x\n'
+        print("\nprealloc   p50 us   p99 us   max us")
+        for extent in (0, 16 * EXTENT):
+            name = 'latency%d' % extent
+            logger = self.mgr.open(name, durability=SYNC_FDATASYNC,
+                                   buf_size=64 * 1024, prealloc_bytes=extent)
+            times = []
+            for n__ in range(flushes):
+                for m__ in range(64):
+                    logger.log_raw(line % (n__ * 64 + m__))
+                t00 = time.perf_counter()
+                self.assertEqual(0, logger.flush())
+                times.append(time.perf_counter() - t00)
+            self.assertEqual(0, logger.close())
+            self.assertEqual(flushes * 64 * len(line % 0),
+                             os.path.getsize(self.path(name)))
+            times.sort()
+            print("%8s %8.1f %8.1f %8.1f" % (
+                'yes' if extent else 'no', times[len(times) // 2] * 1e6,
+                times[int(0.99 * (len(times) - 1))] * 1e6, times[-1] * 1e6))
+
+
+if __name__ == '__main__':
+    unittest.main()
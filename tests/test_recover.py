@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_recover.py
+
+""" Test recovering what a crashed run left in a log's ring file. """
+
+import os
+import shutil
+import sys
+import unittest
+
+from xlutil.ftlog import LogMgr, SYNC_NONE, ENGINE_MPSC
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'recover')
+
+
+class TestRecover(unittest.TestCase):
+    """ Test recovering what a crashed run left in a log's ring file. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        self.mgr.close()
+
+    def path(self, base_name):
+        """ Return the path to a log file. """
+        return os.path.join(PATH_TO_LOGS, base_name + '.log')
+
+    def read(self, base_name):
+        """ Return the lines of a log file. """
+        with open(self.path(base_name), 'rb') as file:
+            return file.read().splitlines()
+
+    def crash(self, base_name, lines, flush_at):
+        """
+        In a child process with a writer which never wakes by itself,
+        log numbered lines to a recoverable log, flushing once on the
+        way, and die without closing it.
+        """
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                mgr = LogMgr(PATH_TO_LOGS, write_interval=3600)
+                logger = mgr.open(base_name, durability=SYNC_NONE,
+                                  buf_size=4096, buf_count=8,
+                                  recoverable=True)
+                for n__ in range(lines):
+                    if n__ == flush_at:
+                        logger.flush()
+                    logger.log_raw(b'crashed line %d\n' % n__)
+                code = 0
+            finally:
+                os._exit(code)          # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+
+    def test_crash_recovered(self):
+        """
+        What a crashed run logged but never wrote is appended when the
+        log is next opened, before anything logged afterwards.
+        """
+        lines = 1000
+        self.crash('crash', lines, 400)
+        self.assertTrue(os.path.exists(self.path('crash') + '.ring'))
+        written = len(self.read('crash'))
+        self.assertEqual(400, written)
+
+        logger = self.mgr.open('crash', durability=SYNC_NONE,
+                               recoverable=True)
+        self.assertEqual(len(self.read('crash')), lines)
+        self.assertTrue(logger.stats()['recovered'] > 0)
+        logger.log_raw(b'after\n')
+        self.assertEqual(0, logger.close())
+        self.assertEqual([b'crashed line %d' % n__ for n__ in range(lines)] +
+                         [b'after'], self.read('crash'))
+        # closed cleanly, it leaves nothing to recover
+        self.assertFalse(os.path.exists(self.path('crash') + '.ring'))
+
+    def test_child_keeps_off_parents_pages(self):
+        """
+        A child process forked while a recoverable log is open logs into
+        pages of its own, and leaves the parent's ring file alone.
+        """
+        logger = self.mgr.open('fork', durability=SYNC_NONE,
+                               recoverable=True)
+        logger.log_raw(b'parent before\n')
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                logger.log_raw(b'child\n')
+                code = self.mgr.close()
+            finally:
+                os._exit(code)          # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertTrue(os.path.exists(self.path('fork') + '.ring'))
+        logger.log_raw(b'parent after\n')
+        self.assertEqual(0, logger.close())
+        self.assertEqual([b'parent before', b'child', b'parent after'],
+                         self.read('fork'))
+
+    def test_bad_options(self):
+        """
+        Only pages are recoverable, and only one process at a time may
+        have a log open recoverably.
+        """
+        with self.assertRaises(ValueError):
+            self.mgr.open('shared', recoverable=True, shared=True)
+        with self.assertRaises(ValueError):
+            self.mgr.open('staged', recoverable=True, thread_bufs=True)
+        with self.assertRaises(ValueError):
+            self.mgr.open('mpsc', recoverable=True, engine=ENGINE_MPSC)
+        logger = self.mgr.open('twice', recoverable=True)
+        other = LogMgr(PATH_TO_LOGS)
+        try:
+            with self.assertRaises(RuntimeError):
+                other.open('twice', recoverable=True)
+        finally:
+            other.close()
+        self.assertEqual(0, logger.close())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_rotation.py
+
+""" Test rotation of log files by the writer thread. """
+
+import hashlib
+import os
+import shutil
+import sys
+import time
+import unittest
+
+# pylint: disable=no-name-in-module
+from cFTLogForPy import log_msgs, stop_rotate_callbacks
+from xlutil.ftlog import LogMgr, LogEntry
+from xlutil.logreader import LogReader, chain_linker
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'rotation')
+LINE = b"padding ljlkjk;ljlj;k;lklj;j;kjkljklj %08x\n"
+OWNER = b'o' * 20
+SRC = b's' * 20
+
+
+def segments(logger):
+    """ Return the paths to the log's files, oldest first. """
+    path = logger.log_file_name
+    count = 0
+    while os.path.exists('%s.%d' % (path, count + 1)):
+        count += 1
+    return ['%s.%d' % (path, n__) for n__ in range(1, count + 1)] + [path]
+
+
+def read_all(paths):
+    """ Return the contents of the files, end to end. """
+    parts = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            parts.append(file.read())
+    return b''.join(parts)
+
+
+class TestRotation(unittest.TestCase):
+    """ Test rotation of log files by the writer thread. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+
+    def tearDown(self):
+        pass
+
+    def test_rotate_by_size(self):
+        """
+        Files are rotated once they hold rotate_bytes, never in the
+        middle of a message, and nothing is lost.
+        """
+        logger = self.mgr.open('size', rotate_bytes=16 * 1024)
+        batch = [LINE % n__ for n__ in range(256)]        # 12 KiB
+        big = b'<' + b'x' * 40000 + b'>\n'               # spans pages
+        for _ in range(10):
+            log_msgs(logger.lfd, batch)
+            logger.log_raw(big)
+            logger.flush()
+        stats = logger.stats()
+        self.mgr.close()
+        paths = segments(logger)
+        print("\n%d rotations, %d files" % (stats['rotations'], len(paths)))
+        self.assertTrue(stats['rotations'] >= 5)
+        self.assertEqual(stats['rotations'] + 1, len(paths))
+        for path in paths[:-1]:
+            with open(path, 'rb') as file:
+                data = file.read()
+            self.assertTrue(len(data) >= 16 * 1024)
+            self.assertTrue(data.endswith(b'\n'))
+        self.assertEqual((b''.join(batch) + big) * 10, read_all(paths))
+
+    def test_rotate_by_age(self):
+        """
+        Files are rotated once they are rotate_secs old, on the writer's
+        next tick even if nothing more has been logged.
+        """
+        logger = self.mgr.open('age', rotate_secs=1)
+        logger.log_raw(b'one\n')
+        logger.flush()
+        time.sleep(1.3)
+        logger.log_raw(b'two\n')
+        logger.flush()
+        logger.log_raw(b'three\n')
+        self.mgr.close()
+        paths = segments(logger)
+        self.assertEqual(2, len(paths))
+        self.assertEqual(b'one\n', read_all(paths[:1]))
+        self.assertEqual(b'two\nthree\n', read_all(paths[1:]))
+
+    def test_existing_segments_kept(self):
+        """ Segments left by an earlier run are never overwritten. """
+
+        os.makedirs(PATH_TO_LOGS, exist_ok=True)
+        with open(os.path.join(PATH_TO_LOGS, 'keep.log.1'), 'wb') as file:
+            file.write(b'earlier\n')
+        logger = self.mgr.open('keep', rotate_bytes=1)
+        logger.log_raw(b'later\n')
+        logger.flush()
+        self.mgr.close()
+        self.assertEqual([b'earlier\n', b'later\n', b''],
+                         [read_all([path]) for path in segments(logger)])
+
+    def test_chained_segments(self):
+        """
+        With chain_linker() each new file starts with a link to the one
+        before, so that LogReader reads the rotated log as one.
+        """
+        logger = self.mgr.open('chain', rotate_bytes=4096,
+                               on_rotate=chain_linker(OWNER, SRC))
+        entries = [LogEntry(1500000000 + n__,
+                            hashlib.sha1(b'%d' % n__).digest(), OWNER,
+                            n__, SRC, 'file%d' % n__)
+                   for n__ in range(500)]
+        for n__, entry in enumerate(entries):
+            logger.log_raw(entry.to_bytes())
+            if n__ % 50 == 49:
+                logger.flush()
+        stats = logger.stats()
+        self.mgr.close()
+        self.assertTrue(stats['rotations'] >= 5)
+        reader = LogReader(logger.log_file_name)
+        self.assertEqual(segments(logger), reader.chunks())
+        self.assertEqual(entries, list(reader))
+
+    def test_callbacks_stopped(self):
+        """
+        Once callbacks are stopped, as they are at exit, files are still
+        rotated but on_rotate is not called.  Run in a child process,
+        as there is no starting them again.
+        """
+        calls = []
+
+        def on_rotate(old, new):
+            """ Note the call and return a first record. """
+            calls.append((old, new))
+            return b'first\n'
+
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                stop_rotate_callbacks()
+                logger = self.mgr.open('stopped', rotate_bytes=1,
+                                       on_rotate=on_rotate)
+                logger.log_raw(b'one\n')
+                logger.flush()
+                logger.log_raw(b'two\n')
+                self.mgr.close()
+                if not calls and [b'one\n', b'two\n'] == [
+                        read_all([path]) for path in segments(logger)][:2]:
+                    code = 0
+            finally:
+                os._exit(code)          # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.mgr.close()
+
+    def test_bad_callback(self):
+        """ on_rotate must be callable. """
+
+        with self.assertRaises(TypeError):
+            self.mgr.open('bad', on_rotate=17)
+        self.mgr.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_shm_ring.py
+
+""" Test logging through a log's shared-memory ring. """
+
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import time
+import unittest
+
+from xlutil.ftlog import LogMgr, ShmProducer, DROP_ON_FULL, SYNC_NONE
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'shm_ring')
+
+# where, on Linux, POSIX shared-memory objects may be seen as files
+SHM_DIR = '/dev/shm'
+# offsets of a ring's head and its first slot
+HEAD, SLOTS = 64, 256
+
+# run by each producer process: attach by name and log numbered lines
+PRODUCER = '''
+import sys
+from xlutil.ftlog import ShmProducer
+ring = ShmProducer(sys.argv[1])
+for n in range(int(sys.argv[3])):
+    ring.log_raw(b'%s line %d\\n' % (sys.argv[2].encode(), n))
+'''
+
+
+class TestShmRing(unittest.TestCase):
+    """ Test logging through a log's shared-memory ring. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+        self.mgr = LogMgr(PATH_TO_LOGS)
+        self.name = 'xlutil-test-%d' % os.getpid()
+
+    def tearDown(self):
+        self.mgr.close()
+
+    def read(self, base_name):
+        """ Return the lines of a log file. """
+        with open(os.path.join(PATH_TO_LOGS, base_name + '.log'), 'rb') as file:
+            return file.read().splitlines()
+
+    def test_unrelated_producers(self):
+        """
+        Processes started afresh, which share nothing with this one but
+        the ring's name, log into a ring too small to hold what they
+        log, waiting for the writer to empty it; every line arrives
+        whole and in order, among those the owner logs itself.
+        """
+        logger = self.mgr.open('ring', durability=SYNC_NONE,
+                               shm_name=self.name, shm_slots=256)
+        producers, lines = 3, 2000
+        procs = [subprocess.Popen([sys.executable, '-c', PRODUCER, self.name,
+                                   'proc%d' % n__, str(lines)])
+                 for n__ in range(producers)]
+        for n__ in range(lines):
+            logger.log_raw(b'owner line %d\n' % n__)
+        for proc in procs:
+            self.assertEqual(0, proc.wait())
+        stats = ShmProducer(self.name).stats()
+        self.assertEqual(producers * lines, stats['head'])
+        self.assertTrue(stats['waits'] > 0)
+        self.assertEqual(0, logger.close())
+        got = self.read('ring')
+        self.assertEqual((producers + 1) * lines, len(got))
+        for who in ['owner'] + ['proc%d' % n__ for n__ in range(producers)]:
+            mine = [line for line in got if line.startswith(who.encode())]
+            self.assertEqual([b'%s line %d' % (who.encode(), n__)
+                              for n__ in range(lines)], mine)
+
+    def test_drop_on_full(self):
+        """ A producer which may drop messages never waits. """
+        logger = self.mgr.open('drop', durability=SYNC_NONE,
+                               shm_name=self.name, shm_slots=4)
+        ring = ShmProducer(self.name, DROP_ON_FULL)
+        logged = sum(ring.log_raw(b'%d\n' % n__) for n__ in range(1000))
+        stats = ring.stats()
+        self.assertTrue(logged >= 4)
+        self.assertEqual(1000 - logged, stats['dropped'])
+        self.assertEqual(0, stats['waits'])
+        self.assertEqual(0, logger.close())
+        self.assertEqual(logged, len(self.read('drop')))
+
+    def test_limits_and_close(self):
+        """
+        A message must fit in a slot; once its log is closed a ring
+        refuses messages and can no longer be attached to.
+        """
+        logger = self.mgr.open('close', shm_name=self.name, shm_slot_size=64)
+        ring = ShmProducer(self.name)
+        self.assertEqual(48, ring.stats()['slot_bytes'])
+        self.assertTrue(ring.log_raw(b'x' * 48))
+        with self.assertRaises(ValueError):
+            ring.log_raw(b'x' * 49)
+        # as with ActualLog, nbytes may pick out a prefix, or be None
+        self.assertTrue(ring.log_raw(b'y' * 49, 48))
+        self.assertTrue(ring.log_raw(b'z' * 48, None))
+        self.assertEqual(0, logger.close())
+        self.assertTrue(ring.stats()['closed'])
+        with self.assertRaises(ValueError):
+            ring.log('too late')
+        with self.assertRaises(OSError):
+            ShmProducer(self.name)
+        self.assertEqual([b'x' * 48 + b'y' * 48 + b'z' * 48],
+                         self.read('close'))
+
+        # the number of slots must be a power of two
+        with self.assertRaises(ValueError):
+            self.mgr.open('bad', shm_name=self.name, shm_slots=1000)
+        # and what other processes log into it is not framed
+        with self.assertRaises(ValueError):
+            self.mgr.open('bad', shm_name=self.name, framed=True)
+
+    def test_name_in_use(self):
+        """
+        A log cannot take a ring name already in use, whether by another
+        log or by an object a crashed run left behind.
+        """
+        logger = self.mgr.open('first', shm_name=self.name)
+        with self.assertRaises(RuntimeError):
+            self.mgr.open('second', shm_name=self.name)
+        self.assertTrue(ShmProducer(self.name).log_raw(b'still mine\n'))
+        self.assertEqual(0, logger.close())
+        self.assertEqual([b'still mine'], self.read('first'))
+
+        if os.path.isdir(SHM_DIR):
+            path = os.path.join(SHM_DIR, self.name)
+            with open(path, 'wb') as file:
+                file.write(b'left behind')
+            try:
+                with self.assertRaises(RuntimeError):
+                    self.mgr.open('third', shm_name=self.name)
+            finally:
+                os.unlink(path)
+
+    @unittest.skipUnless(os.path.isdir(SHM_DIR), 'needs ' + SHM_DIR)
+    def test_bad_slots(self):
+        """
+        The writer skips a slot whose producer died after claiming it,
+        once it has held the ring up for a second, and cuts a length
+        too large for its slot down to the slot; both count as errors.
+        """
+        logger = self.mgr.open('bad', durability=SYNC_NONE,
+                               shm_name=self.name, shm_slot_size=64)
+        ring = ShmProducer(self.name)
+        with open(os.path.join(SHM_DIR, self.name), 'r+b') as file:
+            shm = mmap.mmap(file.fileno(), 0)
+        try:
+            # claim slot 0, as a producer would, and die
+            struct.pack_into('<Q', shm, HEAD, 1)
+            self.assertTrue(ring.log_raw(b'after\n'))
+            self.assertEqual(0, logger.flush())
+            self.assertEqual([], self.read('bad'))
+            time.sleep(1.2)
+            self.assertEqual(0, logger.flush())
+            self.assertEqual([b'after'], self.read('bad'))
+
+            # publish slot 2 with a length larger than the ring
+            struct.pack_into('<Q', shm, HEAD, 3)
+            struct.pack_into('<QI', shm, SLOTS + 2 * 64, 3, 0xfffffff0)
+            self.assertEqual(0, logger.flush())
+        finally:
+            shm.close()
+        self.assertEqual(2, ring.stats()['errors'])
+        self.assertEqual(0, logger.close())
+        with open(os.path.join(PATH_TO_LOGS, 'bad.log'), 'rb') as file:
+            self.assertEqual(b'after\n' + b'\0' * 48, file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
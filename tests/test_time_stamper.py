@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# xlutil_py/tests/test_time_stamper.py
+
+""" Test and benchmark the cached timestamps prefixed to log lines. """
+
+import os
+import re
+import shutil
+import sys
+import time
+import unittest
+
+from xlutil.ftlog import LogMgr, TimeStamper
+
+sys.path.insert(0, 'build/lib.linux-x86_64-3.6')  # for the .so
+
+PATH_TO_LOGS = os.path.join('tmp', 'time_stamper')
+LINE_COUNT = 100000
+
+
+def uncached_format(msg):
+    """ How log lines were formatted before timestamps were cached. """
+    now = time.localtime()
+    date = time.strftime('%Y-%m-%d', now)
+    hours = time.strftime('%H:%M:%S', now)
+    return '%s %s %s\n' % (date, hours, msg)
+
+
+class TestTimeStamper(unittest.TestCase):
+    """ Test and benchmark the cached timestamps prefixed to log lines. """
+
+    def setUp(self):
+        if os.path.exists(PATH_TO_LOGS):
+            shutil.rmtree(PATH_TO_LOGS)
+
+    def tearDown(self):
+        pass
+
+    def test_same_as_uncached(self):
+        """ Whole-second stamps are exactly what strftime() gives. """
+
+        stamper = TimeStamper()
+        now = time.time()
+        for offset in (0, 0.5, 1, 59.9, 3600, 86400 * 200):
+            expected = time.strftime('%Y-%m-%d %H:%M:%S',
+                                     time.localtime(now + offset))
+            self.assertEqual(expected, stamper.stamp(now + offset))
+        # and nothing is stale when the second changes back
+        self.assertEqual(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+            stamper.stamp(now))
+
+    def test_sub_second_precision(self):
+        """ Milli- and microseconds are appended when asked for. """
+
+        now = 1500000000.25
+        second = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        self.assertEqual(second + '.250', TimeStamper(3).stamp(now))
+        self.assertEqual(second + '.250000', TimeStamper(6).stamp(now))
+        with self.assertRaises(ValueError):
+            TimeStamper(2)
+
+    def test_log_lines(self):
+        """ log() and log_many() lines carry the stamp asked for. """
+
+        mgr = LogMgr(PATH_TO_LOGS)
+        plain = mgr.open('plain')
+        fine = mgr.open('fine', precision=6)
+        text = plain.log('hello')
+        self.assertTrue(re.match(
+            r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d hello\n$', text))
+        text = fine.log_many(['one', 'two'])
+        self.assertTrue(re.match(
+            r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{6}) one\n\1 two\n$', text))
+        mgr.close()
+
+    def test_lines_per_second(self):
+        """
+        Compare the number of lines a second formatted with and without
+        the cache.
+        """
+        stamper = TimeStamper()
+        fine = TimeStamper(6)
+
+        def cached(msg):
+            """ Format a line using the cached stamp. """
+            return '%s %s\n' % (stamper.stamp(), msg)
+
+        def cached_fine(msg):
+            """ Ditto, to the microsecond. """
+            return '%s %s\n' % (fine.stamp(), msg)
+
+        rates = {}
+        for name, func in (('uncached', uncached_format),
+                           ('cached', cached),
+                           ('cached, usec', cached_fine)):
+            t00 = time.perf_counter()
+            for n__ in range(LINE_COUNT):
+                func('message number %d' % n__)
+            rates[name] = LINE_COUNT / (time.perf_counter() - t00)
+        print()
+        for name, rate in rates.items():
+            print("%-14s %10.0f lines/sec" % (name, rate))
+        self.assertTrue(rates['cached'] > rates['uncached'])
+
+
+if __name__ == '__main__':
+    unittest.main()
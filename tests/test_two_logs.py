@@ -6,6 +6,7 @@
 import os
 import shutil
 import sys
+import time
 import unittest
 from xlutil.ftlog import LogMgr
 
@@ -70,6 +71,51 @@ class TestTwoLogs(unittest.TestCase):
             contents = contents.strip()
             self.assertTrue(contents.endswith('oh hello, bar'))  # END BAR
 
+    def test_throughput_with_many_logs(self):
+        """
+        Every open log has its own timer in the writer thread, so all of
+        them are drained while the logs are open, not just the one most
+        recently opened.  Log to 1, 2, 4 and 8 logs at once, checking
+        that every file is complete and reporting the bytes drained per
+        second of wall time.
+        """
+        path_to_logs = os.path.join('tmp', 'many_logs')
+        line = "padding ljlkjk;ljlj;k;lklj;j;kjkljklj %04x\n"
+        rounds = 8
+        # well under one page per log per timer tick
+        per_round = 128
+
+        for log_count in (1, 2, 4, 8):
+            if os.path.exists(path_to_logs):
+                shutil.rmtree(path_to_logs)
+            mgr = LogMgr(path_to_logs)
+            logs = [mgr.open('log%d' % n__) for n__ in range(log_count)]
+            expected = [''] * log_count
+
+            t00 = time.perf_counter()
+            for r__ in range(rounds):
+                for ndx, log in enumerate(logs):
+                    batch = [line % (r__ * per_round + m__)
+                             for m__ in range(per_round)]
+                    log.log_raw(''.join(batch).encode('ascii'))
+                    expected[ndx] += ''.join(batch)
+                # the writer drains every log while we wait
+                time.sleep(0.15)
+            drained = sum(os.path.getsize(log.log_file) for log in logs)
+            t01 = time.perf_counter()
+            mgr.close()
+
+            total = sum(len(text) for text in expected)
+            print("\n%d logs: %8d of %8d bytes on disk before close, "
+                  "%10.0f bytes/sec" % (log_count, drained, total,
+                                        drained / (t01 - t00)))
+            # everything but the last round was flushed by the timers
+            self.assertTrue(drained >= total - log_count * len(line) *
+                            per_round)
+            for ndx, log in enumerate(logs):
+                with open(log.log_file, 'r') as file:
+                    self.assertEqual(expected[ndx], file.read())
+
 
 if __name__ == '__main__':
     unittest.main()